@@ -0,0 +1 @@
+# Shared loaders and analysis engines for the experiment-data notebooks.
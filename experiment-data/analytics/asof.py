@@ -0,0 +1,137 @@
+# As-of joins between events, e.g. every enforce_wait_modal_shown matched to the
+# previous event of its session, or to the next place-order within an hour.
+#
+# time-before-modal-view.ipynb filters the whole frame once per modal to find these. Here
+# both sides are sorted by time once and joined with pd.merge_asof, which walks the two
+# sorted arrays together and keeps, per group, the latest (or next, or nearest) match.
+# The group columns (session, user, domain, ...) are reduced to one integer key over
+# both sides first, so categoricals with different categories and several group
+# columns join the same way.
+#
+#   from analytics.asof import match_events
+#   pairs_df = match_events(df, 'enforce_wait_modal_shown')   # previous event in the session
+#   pairs_df = match_events('analytics_store', 'enforce_wait_modal_shown', 'place-order',
+#                           direction='forward', tolerance='1h')
+#   sns.histplot(pairs_df['seconds'])
+#
+#   python -m analytics.asof analytics_store enforce_wait_modal_shown --match place-order --direction forward
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from analytics.sessions import EXCLUDED_SESSIONS, EXCLUDED_USERS
+from analytics.store import load_events
+
+COLUMNS = ['session_id', 'user_id', 'type', 'created_at']
+EXCLUDED_TYPES = ('time-spent',)
+
+
+def group_keys(left, right, by):
+    """One integer key per distinct combination of the `by` columns over both frames, -1
+    where one of them is missing."""
+    by = [by] if isinstance(by, str) else list(by)
+    keys = np.zeros(len(left) + len(right), dtype=np.int64)
+    missing = np.zeros(len(keys), dtype=bool)
+    for column in by:
+        a, b = left[column], right[column]
+        if (isinstance(a.dtype, pd.CategoricalDtype) and isinstance(b.dtype, pd.CategoricalDtype)
+                and a.cat.categories.equals(b.cat.categories)):
+            # Both sides cut from one frame: the codes already are keys
+            codes, size = np.concatenate([a.cat.codes.to_numpy(), b.cat.codes.to_numpy()]), len(a.cat.categories)
+        else:
+            codes, uniques = pd.factorize(pd.concat([a.astype(object), b.astype(object)], ignore_index=True))
+            size = len(uniques)
+        missing |= codes < 0
+        keys, _ = pd.factorize(keys * (size + 1) + codes + 1)
+    keys[missing] = -1
+    return keys[:len(left)], keys[len(left):]
+
+
+def asof_join(left, right, by='session_id', on='created_at', direction='backward', tolerance=None,
+              allow_exact_matches=False, suffix='_matched'):
+    """`left` with, for every row, the columns of the `right` row with the same `by` values
+    that is closest before (`direction='backward'`), after ('forward') or either side
+    ('nearest') in `on`, suffixed with `suffix`. Rows without a match within `tolerance`
+    (a Timedelta or a string like '30min') get missing values. Exact ties in `on` only
+    match with `allow_exact_matches`. Rows keep the order of `left`."""
+    left_keys, right_keys = group_keys(left, right, by)
+    left_times = pd.to_datetime(left[on], utc=True).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    right_times = pd.to_datetime(right[on], utc=True).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    # NaT is the smallest int64
+    left_valid = (left_keys >= 0) & (left_times != np.iinfo(np.int64).min)
+    right_valid = (right_keys >= 0) & (right_times != np.iinfo(np.int64).min)
+
+    # Only the keys, nanosecond times and row positions go through merge_asof, the other
+    # columns are taken afterwards
+    left_sorted = pd.DataFrame({'_key': left_keys[left_valid], '_time': left_times[left_valid],
+                                '_row': np.flatnonzero(left_valid)}).sort_values('_time', kind='stable')
+    right_sorted = pd.DataFrame({'_key': right_keys[right_valid], '_time': right_times[right_valid],
+                                 '_matched_row': np.flatnonzero(right_valid)}).sort_values('_time', kind='stable')
+    merged = pd.merge_asof(
+        left_sorted, right_sorted, on='_time', by='_key', direction=direction,
+        tolerance=None if tolerance is None else pd.Timedelta(tolerance).value,
+        allow_exact_matches=allow_exact_matches,
+    )
+
+    matched_rows = np.full(len(left), -1, dtype=np.int64)
+    matched = merged['_matched_row'].notna().to_numpy()
+    matched_rows[merged['_row'].to_numpy()[matched]] = merged['_matched_row'].to_numpy()[matched].astype(np.int64)
+    # Rows without a match ask for label -1, which reindex fills with missing values
+    matches = right.reset_index(drop=True).reindex(matched_rows).add_suffix(suffix)
+    return pd.concat([left.reset_index(drop=True), matches.reset_index(drop=True)], axis=1)
+
+
+def match_events(source, event_types, match_types=None, by='session_id', direction='backward', tolerance=None,
+                 allow_exact_matches=False, columns=(), excluded_types=EXCLUDED_TYPES):
+    """One row per event of `event_types` with the matching event of `match_types` in the
+    same `by` group (see `asof_join`): its type as matched_type, its time as
+    matched_time and `seconds` from the event to the match (negative when the match
+    came before). Without `match_types` any event that is not of `event_types` or
+    `excluded_types` matches. `columns` are extra columns to keep from both events,
+    e.g. ['url'], and `by` can be a list such as ['user_id', 'domain']."""
+    event_types = [event_types] if isinstance(event_types, str) else list(event_types)
+    if isinstance(match_types, str):
+        match_types = [match_types]
+    by_columns = [by] if isinstance(by, str) else list(by)
+    wanted = list(dict.fromkeys(COLUMNS + by_columns + list(columns)))
+    types = None if match_types is None else event_types + list(match_types)
+    df = load_events(source, columns=wanted, types=types)
+    # Placeholder ids are shared by unrelated events
+    df = df[~df['user_id'].isin(EXCLUDED_USERS).to_numpy() & ~df['session_id'].isin(EXCLUDED_SESSIONS).to_numpy()]
+
+    is_event = df['type'].isin(event_types).to_numpy()
+    if match_types is None:
+        is_match = ~is_event & ~df['type'].isin(list(excluded_types)).to_numpy()
+    else:
+        is_match = df['type'].isin(match_types).to_numpy()
+    keep = list(dict.fromkeys(by_columns + ['user_id', 'session_id', 'type', 'created_at'] + list(columns)))
+    right = df.loc[is_match, list(dict.fromkeys(by_columns + ['type', 'created_at'] + list(columns)))]
+
+    pairs_df = asof_join(df.loc[is_event, keep], right, by_columns, 'created_at', direction, tolerance,
+                         allow_exact_matches)
+    pairs_df = pairs_df.drop(columns=[f'{column}_matched' for column in by_columns])
+    pairs_df = pairs_df.rename(columns={'created_at': 'time', 'created_at_matched': 'matched_time',
+                                        'type_matched': 'matched_type'})
+    pairs_df['seconds'] = (pairs_df['matched_time'] - pairs_df['time']).dt.total_seconds()
+    return pairs_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Match events to the previous or next event of another type")
+    parser.add_argument('source', nargs='?', default='analytics.csv', help='analytics export (csv) or columnar store folder')
+    parser.add_argument('event_types', nargs='+', help='event types to match, e.g. enforce_wait_modal_shown')
+    parser.add_argument('--match', nargs='+', help='event types to match them with, any other type by default')
+    parser.add_argument('--by', nargs='+', default=['session_id'], help='columns both events must share')
+    parser.add_argument('--direction', default='backward', choices=['backward', 'forward', 'nearest'])
+    parser.add_argument('--tolerance', help="maximum time between the events, e.g. '1h'")
+    parser.add_argument('--output', help='csv to write the matched pairs to')
+    args = parser.parse_args()
+
+    pairs_df = match_events(args.source, args.event_types, args.match, args.by, args.direction, args.tolerance)
+    matched = pairs_df['seconds'].notna()
+    print(f"{int(matched.sum())} of {len(pairs_df)} events matched")
+    print(pairs_df.loc[matched, 'seconds'].abs().describe(percentiles=[.25, .5, .75, .9]).to_string())
+
+    if args.output:
+        pairs_df.to_csv(args.output, index=False)
@@ -0,0 +1,125 @@
+# Domain classification for the analytics events.
+#
+# The extension sends `url` as hostname + pathname. The host is split off every URL in
+# one pass with pyarrow and dictionary encoded, so only the distinct hosts (a few
+# thousand, against millions of events) are classified in Python, and the result is
+# cached per host on the classifier. A host is matched against the listed domains by
+# looking up its suffixes from the most to the least specific label in a hash set,
+# so `checkout.ruggable.com` is a ruggable.com shop, and mapping the per-host results
+# back to the events is a take over the dictionary indices.
+#
+#   from analytics.domains import tag_events
+#   df = tag_events(df)   # adds domain, shop and category, drops music/tv.apple.com
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# From data_X.ipynb, without the duplicates
+SHOPIFY_DOMAINS = frozenset([
+    "klaedeskabet.dk", "fashionnova.com", "kyliecosmetics.com", "colourpop.com",
+    "jeffreestarcosmetics.com", "gymshark.com", "allbirds.com", "brooklinen.com",
+    "ruggable.com", "chubbiesshorts.com", "puravidabracelets.com", "nativecos.com",
+    "hauslabs.com", "skknbykim.com", "harney.com", "redbullshopus.com", "tula.com",
+    "tesla.com", "spiritualgangster.com", "taylorstitch.com", "american-giant.com",
+    "drsquatch.com", "mejuri.com", "peets.com", "deathwishcoffee.com", "hellotushy.com",
+    "bando.com", "moroccanoil.com", "negativeunderwear.com", "birdies.com", "naadam.co",
+    "popflexactive.com", "moderncitizen.com", "greatjonesgoods.com", "pinklily.com",
+    "misen.com", "materialkitchen.com", "hedleyandbennett.com", "rumpl.com",
+    "mizzenandmain.com", "ohpolly.com", "tecovas.com", "stance.com", "spongelle.com",
+    "trueclassictees.com", "meundies.com", "studs.com", "jackhenry.co", "luxyhair.com",
+    "juicycouture.com", "everlast.com", "skims.com", "feals.com", "foursigmatic.com",
+    "golde.co", "liquid-iv.com", "thesill.com", "wearlively.com", "andieswim.com",
+    "yourparade.com", "brightland.co", "omsom.com", "jenis.com", "snowehome.com",
+    "graza.co", "flybyjing.com", "getmaude.com", "ugmonk.com", "shop.app",
+])
+CATEGORIES = {
+    'shopify': SHOPIFY_DOMAINS,
+}
+# data_X.ipynb drops every event on Apple Music and Apple TV
+EXCLUDED_DOMAINS = frozenset(['music.apple.com', 'tv.apple.com'])
+# Suffixes where the registered domain has three labels instead of two
+MULTI_LABEL_SUFFIXES = frozenset(['co.uk', 'org.uk', 'ac.uk', 'com.au', 'co.nz', 'co.jp', 'com.br'])
+SUBDOMAIN_PREFIXES = ('www', 'ww2')
+
+
+def top_domain(host):
+    """Registered domain of a host, like `get_top_domain` in data_X.ipynb."""
+    labels = host.split('.')
+    if len(labels) > 2 and labels[0] in SUBDOMAIN_PREFIXES:
+        labels = labels[1:]
+    keep = 3 if '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES else 2
+    return '.'.join(labels[-keep:])
+
+
+def match_suffix(host, domains):
+    """The most specific suffix of `host` that is in `domains`, or None."""
+    labels = host.split('.')
+    for i in range(len(labels) - 1):
+        suffix = '.'.join(labels[i:])
+        if suffix in domains:
+            return suffix
+    return None
+
+
+def hosts(urls):
+    """Dictionary encoded host of every URL (hostname + pathname, a scheme is allowed)."""
+    urls = pa.array(urls, type=pa.string(), from_pandas=True)
+    if isinstance(urls, pa.ChunkedArray):
+        # Arrow backed string columns convert to chunked arrays
+        urls = urls.combine_chunks()
+    if pc.any(pc.match_substring(urls, '://')).as_py():
+        urls = pc.replace_substring_regex(urls, r'^[A-Za-z][A-Za-z0-9+.-]*://', '')
+    hosts = pc.list_element(pc.split_pattern(urls, '/', max_splits=1), 0)
+    return pc.dictionary_encode(pc.utf8_lower(hosts))
+
+
+class DomainClassifier:
+    def __init__(self, categories=CATEGORIES, excluded=EXCLUDED_DOMAINS):
+        # Every listed domain maps to its category; a domain in several categories keeps the first
+        self.categories = {}
+        for category, domains in categories.items():
+            for domain in domains:
+                self.categories.setdefault(domain.lower(), category)
+        self.excluded = frozenset(domain.lower() for domain in excluded)
+        self._cache = {}
+
+    def classify_host(self, host):
+        """(domain, shop, category, excluded) for a host. `shop` is the listed domain the
+        host belongs to and `category` its category, both None when it is not listed."""
+        result = self._cache.get(host)
+        if result is None:
+            shop = match_suffix(host, self.categories)
+            result = (
+                top_domain(host),
+                shop,
+                self.categories.get(shop),
+                match_suffix(host, self.excluded) is not None,
+            )
+            self._cache[host] = result
+        return result
+
+    def classify(self, urls):
+        """DataFrame with domain, shop, category (categoricals) and excluded for each URL."""
+        index = urls.index if isinstance(urls, pd.Series) else None
+        encoded = hosts(urls)
+        results = [self.classify_host(host) for host in encoded.dictionary.to_pylist()]
+        # Missing URLs take the extra last row, which is all None
+        indices = encoded.indices.fill_null(len(results)).to_numpy(zero_copy_only=False)
+
+        columns = {}
+        for i, name in enumerate(('domain', 'shop', 'category')):
+            codes, uniques = pd.factorize(pd.Series([result[i] for result in results] + [None], dtype=object))
+            columns[name] = pd.Categorical.from_codes(codes[indices], uniques)
+        excluded = np.array([result[3] for result in results] + [False], dtype=bool)
+        columns['excluded'] = excluded[indices]
+        return pd.DataFrame(columns, index=index)
+
+
+def tag_events(df, classifier=None, drop_excluded=True):
+    """Adds domain, shop and category columns from the url column and, by default,
+    drops the events on excluded domains."""
+    classifier = classifier or DomainClassifier()
+    tags = classifier.classify(df['url'])
+    df = df.assign(domain=tags['domain'], shop=tags['shop'], category=tags['category'])
+    return df[~tags['excluded'].to_numpy()] if drop_excluded else df
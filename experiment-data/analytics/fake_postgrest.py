@@ -0,0 +1,129 @@
+# Local stand-in for the Supabase REST API, to try out analytics.fetch without the real
+# database. Serves the rows of an analytics csv export with the parts of PostgREST that
+# fetch relies on: `order=col.asc,...`, `col=gt.value` style filters (gt, gte, lt, lte,
+# eq) and paging with a `Range: from-to` header, answered with 206 and Content-Range, or
+# 416 past the end. Like Supabase, at most `max_rows` rows are returned per request.
+#
+#   python -m analytics.fake_postgrest analytics.csv --port 54321
+#   python -m analytics.fetch --url http://127.0.0.1:54321 --key test --store /tmp/store
+import argparse
+import csv
+import json
+import operator
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'eq': operator.eq,
+}
+
+
+def read_rows(csv_path):
+    with open(csv_path, newline='') as file:
+        rows = list(csv.DictReader(file))
+    for row in rows:
+        if row.get('id', '').isdigit():
+            row['id'] = int(row['id'])
+    return rows
+
+
+def sort_key(value):
+    # Numbers before strings, like a typed column would never mix them
+    return (0, value, '') if isinstance(value, int) else (1, 0, value)
+
+
+def query_rows(rows, params):
+    for column, value in params:
+        if column in ('select', 'order', 'limit', 'offset'):
+            continue
+        op, _, value = value.partition('.')
+        compare = OPERATORS[op]
+        if column == 'id':
+            value = int(value)
+        rows = [row for row in rows if compare(row[column], value)]
+
+    order = dict(params).get('order')
+    if order:
+        # Stable sorts, least significant key first
+        for term in reversed(order.split(',')):
+            column, _, direction = term.partition('.')
+            rows = sorted(rows, key=lambda row: sort_key(row[column]), reverse=direction == 'desc')
+    return rows
+
+
+class PostgRESTHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        table = url.path.rsplit('/', 1)[-1]
+        if table != self.server.table:
+            self.reply(404, {'message': f'relation "{table}" does not exist'})
+            return
+
+        try:
+            rows = query_rows(self.server.rows, parse_qsl(url.query))
+        except (KeyError, ValueError) as e:
+            self.reply(400, {'message': f'bad query: {e}'})
+            return
+
+        first, last = 0, len(rows) - 1
+        if 'Range' in self.headers:
+            start, _, end = self.headers['Range'].partition('-')
+            first = int(start)
+            last = min(int(end), last) if end else last
+        last = min(last, first + self.server.max_rows - 1)
+
+        if first > 0 and first >= len(rows):
+            self.reply(416, {'message': 'Requested range not satisfiable'}, {'Content-Range': f'*/{len(rows)}'})
+            return
+        page = rows[first:last + 1]
+        status = 206 if len(page) < len(rows) else 200
+        content_range = f'{first}-{first + len(page) - 1}/*' if page else '*/*'
+        self.reply(status, page, {'Content-Range': content_range})
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(rows, host='127.0.0.1', port=54321, table='analytics', max_rows=1000, verbose=False):
+    """Start the server on a background thread. Rows can be appended to `server.rows`
+    while it runs. Stop it with `server.shutdown()`."""
+    server = ThreadingHTTPServer((host, port), PostgRESTHandler)
+    server.rows = rows
+    server.table = table
+    server.max_rows = max_rows
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, name='fake-postgrest', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve an analytics csv export like the Supabase REST API")
+    parser.add_argument('csv', nargs='?', default='analytics.csv')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--max-rows', type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = read_rows(args.csv)
+    server = serve(rows, args.host, args.port, max_rows=args.max_rows, verbose=True)
+    print(f"Serving {len(rows)} rows on http://{args.host}:{args.port}/rest/v1/analytics")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,110 @@
+# Incremental fetch of the Supabase analytics table into the columnar store.
+#
+# Pages through the PostgREST API with Range headers, ordered by `received_at` (set by
+# the database on insert, so rows never show up behind the watermark the way a late
+# client `created_at` could). Pages are buffered and appended to the store, and after
+# every write the watermark in `<store>/_watermark.json` is moved forward, so a rerun
+# only fetches rows that are new since the last one.
+#
+#   python -m analytics.fetch                 # uses SUPABASE_URL / SUPABASE_KEY from .env
+#   python -m analytics.fetch --url http://127.0.0.1:54321 --key test   # see fake_postgrest.py
+import argparse
+import os
+
+import pandas as pd
+import requests
+from dotenv import load_dotenv
+
+from analytics.store import STORE_PATH, append, read_watermark, write_watermark
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL", "https://iukxcgvmzjfelwfrpkyi.supabase.co")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+TABLE = 'analytics'
+ORDER_COLUMN = 'received_at'
+PAGE_SIZE = 1000  # Supabase returns at most 1000 rows per request by default
+FLUSH_ROWS = 50_000
+
+
+def next_watermark(watermark, rows, order_column):
+    """The last order value written and the ids written with exactly that value."""
+    value = rows[-1][order_column]
+    ids = [row['id'] for row in rows if row[order_column] == value]
+    if watermark is not None and watermark['value'] == value:
+        ids = watermark['ids'] + ids
+    return {'column': order_column, 'value': value, 'ids': ids}
+
+
+def fetch_pages(url, key, table=TABLE, order_column=ORDER_COLUMN, since=None, page_size=PAGE_SIZE, session=None):
+    """Yield pages of rows with `order_column` >= `since`, in order."""
+    session = session or requests.Session()
+    params = {'select': '*', 'order': f'{order_column}.asc,id.asc'}
+    if since is not None:
+        params[order_column] = f'gte.{since}'
+    headers = {
+        'apikey': key,
+        'Authorization': f'Bearer {key}',
+        'Range-Unit': 'items',
+    }
+
+    offset = 0
+    while True:
+        headers['Range'] = f'{offset}-{offset + page_size - 1}'
+        response = session.get(f'{url}/rest/v1/{table}', params=params, headers=headers)
+        if response.status_code == 416:
+            # Offset past the last row
+            return
+        response.raise_for_status()
+
+        rows = response.json()
+        # A short page is not the end: the server may cap pages below `page_size`
+        if not rows:
+            return
+        yield rows
+        offset += len(rows)
+
+
+def fetch(store_path=STORE_PATH, url=SUPABASE_URL, key=SUPABASE_KEY, table=TABLE, order_column=ORDER_COLUMN,
+          page_size=PAGE_SIZE, flush_rows=FLUSH_ROWS, session=None):
+    """Fetch all rows newer than the watermark into the store. Returns the number of new rows."""
+    watermark = read_watermark(store_path)
+    if watermark is not None and watermark['column'] != order_column:
+        raise ValueError(f"Store was fetched by {watermark['column']}, not {order_column}")
+    since = watermark['value'] if watermark else None
+    already_stored = set(watermark['ids']) if watermark else set()
+
+    fetched = 0
+    buffer = []
+
+    def flush():
+        nonlocal watermark, buffer, fetched
+        if not buffer:
+            return
+        append(pd.DataFrame(buffer), store_path)
+        watermark = next_watermark(watermark, buffer, order_column)
+        write_watermark(watermark, store_path)
+        fetched += len(buffer)
+        buffer = []
+
+    for rows in fetch_pages(url, key, table, order_column, since, page_size, session):
+        # Rows at exactly the watermark value were partly stored by the previous run
+        buffer.extend(row for row in rows if not (row[order_column] == since and row['id'] in already_stored))
+        if len(buffer) >= flush_rows:
+            flush()
+    flush()
+    return fetched
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fetch new analytics rows from Supabase into the columnar store")
+    parser.add_argument('--store', default=STORE_PATH)
+    parser.add_argument('--url', default=SUPABASE_URL)
+    parser.add_argument('--key', default=SUPABASE_KEY)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+
+    rows = fetch(args.store, args.url, args.key, page_size=args.page_size)
+    print(f"Fetched {rows} new rows into {args.store}")
+    print("Watermark:", read_watermark(args.store))
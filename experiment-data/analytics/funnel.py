@@ -0,0 +1,189 @@
+# Ordered funnels over the raw events, e.g.
+#   page-view → add-to-cart → checkout → enforce_wait_modal_shown → place-order
+# per session or per user.
+#
+# Events are sorted once by group and time, so every event has a position and each
+# group is a contiguous range of positions. For every step the positions of its events
+# are kept as a sorted array, and moving all groups from one step to the next is a
+# single binary search (np.searchsorted) for the first step event after the previous
+# step's position. Each step is the first matching event after the previous step.
+#
+# With `max_gap` the first match can be the wrong anchor: a lone page-view days before
+# the page-view that led to an add-to-cart. So every step event is instead joined to the
+# latest event before it, in its group, that completed the previous step (again one
+# searchsorted over those positions), and kept when that is at most `max_gap` earlier. A
+# group reaches the furthest step with such a chain, and its times are the ones of the
+# first chain that got there.
+#
+#   from analytics.funnel import funnel
+#   steps_df, times_df = funnel(df, ['page-view', 'add-to-cart', 'checkout',
+#                                    'enforce_wait_modal_shown', 'place-order'],
+#                               max_gap='30min', by='user_id')
+#
+# A step is an event type, a tuple of event types, or a function returning a boolean
+# mask over the events, e.g. `lambda df: df['url'].str.contains('/checkout', na=False)`.
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from analytics.store import load_events
+
+DEFAULT_STEPS = ['page-view', 'add-to-cart', 'checkout', 'enforce_wait_modal_shown', 'place-order']
+COLUMNS = ['session_id', 'user_id', 'type', 'created_at']
+
+
+def step_label(step):
+    if callable(step):
+        return getattr(step, '__name__', 'step')
+    if isinstance(step, (tuple, list)):
+        return '|'.join(step)
+    return step
+
+
+def step_mask(df, step):
+    if callable(step):
+        return np.asarray(step(df), dtype=bool)
+    types = [step] if isinstance(step, str) else list(step)
+    return df['type'].isin(types).to_numpy()
+
+
+def funnel(source, steps=DEFAULT_STEPS, max_gap=None, by='session_id', labels=None):
+    """Returns the per-step table and the time each group reached each step.
+
+    `steps_df` has one row per step with the number of groups that reached it, the
+    conversion from the previous and the first step, and the median and mean time to
+    the next step. `times_df` has one row per group that reached the first step and one
+    timestamp column per step (NaT when not reached).
+
+    `source` is a DataFrame, a csv export or the columnar store folder, `by` the
+    grouping column (session_id or user_id) and `max_gap` a Timedelta or string like
+    '30min'."""
+    labels = labels or [step_label(step) for step in steps]
+    if len(set(labels)) != len(labels):
+        raise ValueError(f"Step labels must be unique, got {labels}")
+
+    columns = None if any(callable(step) for step in steps) else list(dict.fromkeys([by] + COLUMNS))
+    df = load_events(source, columns=columns)
+    df = df.dropna(subset=[by, 'created_at'])
+
+    groups = df[by].astype('category')
+    times = df['created_at'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    order = np.lexsort((times, groups.cat.codes.to_numpy()))
+    group_codes = groups.cat.codes.to_numpy()[order]
+    times = times[order]
+    df = df.iloc[order]
+
+    starts = np.flatnonzero(np.diff(group_codes, prepend=-1) != 0)
+    ends = np.append(starts[1:], len(order)) if len(starts) else starts
+    max_gap = None if max_gap is None else pd.Timedelta(max_gap).value
+
+    if max_gap is not None:
+        reached = chained_steps(df, steps, times, starts, ends, max_gap)
+    else:
+        reached = first_steps(df, steps, starts, ends)
+
+    entered = reached[:, 0] >= 0
+    reached = reached[entered]
+    step_times = np.where(reached >= 0, times[np.maximum(reached, 0)], np.iinfo(np.int64).min)
+    times_df = pd.DataFrame(
+        {label: pd.to_datetime(step_times[:, i].view('datetime64[ns]'), utc=True) for i, label in enumerate(labels)},
+    )
+    times_df.insert(0, by, groups.cat.categories[group_codes[starts[entered]]])
+
+    counts = (reached >= 0).sum(axis=0)
+    gaps = [(times_df[labels[i + 1]] - times_df[labels[i]]).dt.total_seconds() for i in range(len(labels) - 1)]
+    steps_df = pd.DataFrame({
+        'step': labels,
+        'groups': counts,
+        'conversion_from_previous': counts / np.maximum(np.r_[counts[0], counts[:-1]], 1),
+        'conversion_from_start': counts / max(counts[0], 1),
+        'median_seconds_to_next': [gap.median() for gap in gaps] + [np.nan],
+        'mean_seconds_to_next': [gap.mean() for gap in gaps] + [np.nan],
+    }).set_index('step')
+    return steps_df, times_df
+
+
+def first_steps(df, steps, starts, ends):
+    """Position of each group's event for every step, the first one after the previous
+    step, -1 once the group dropped out."""
+    reached = np.empty((len(starts), len(steps)), dtype=np.int64)
+    current = None
+    for i, step in enumerate(steps):
+        positions = np.flatnonzero(step_mask(df, step))
+        # The first step is searched from the group start, later ones after the previous step
+        after = starts if current is None else current + 1
+        index = np.searchsorted(positions, np.maximum(after, 0))
+        found = np.full(len(starts), -1, dtype=np.int64)
+        in_range = index < len(positions)
+        found[in_range] = positions[index[in_range]]
+
+        valid = (found >= 0) & (found < ends)
+        if current is not None:
+            valid &= current >= 0
+        current = np.where(valid, found, -1)
+        reached[:, i] = current
+    return reached
+
+
+def chained_steps(df, steps, times, starts, ends, max_gap):
+    """Like `first_steps`, but every step event is anchored on the latest earlier event
+    of the group that completed the previous step, and only counts within `max_gap` of it."""
+    group_of = np.repeat(np.arange(len(starts)), ends - starts)
+    # Per step: sorted positions of the events that complete it, and for each the index
+    # of its anchor among the previous step's
+    completed, anchors = [], []
+    for i, step in enumerate(steps):
+        positions = np.flatnonzero(step_mask(df, step))
+        anchor = np.full(len(positions), -1, dtype=np.int64)
+        if i > 0:
+            previous = completed[-1]
+            anchor = np.searchsorted(previous, positions) - 1
+            valid = anchor >= 0
+            if len(previous):
+                before = previous[np.maximum(anchor, 0)]
+                valid &= (group_of[before] == group_of[positions]) & (times[positions] - times[before] <= max_gap)
+            positions, anchor = positions[valid], anchor[valid]
+        completed.append(positions)
+        anchors.append(anchor)
+
+    # Walk back from the first event of each group's furthest step along its anchors
+    reached = np.full((len(starts), len(steps)), -1, dtype=np.int64)
+    chain = np.full(len(starts), -1, dtype=np.int64)
+    for i in reversed(range(len(steps))):
+        if i + 1 < len(steps):
+            on_chain = chain >= 0
+            chain[on_chain] = anchors[i + 1][chain[on_chain]]
+        groups, first = np.unique(group_of[completed[i]], return_index=True)
+        new = chain[groups] < 0
+        chain[groups[new]] = first[new]
+        on_chain = chain >= 0
+        reached[on_chain, i] = completed[i][chain[on_chain]]
+    return reached
+
+
+def time_to_next_step(times_df, labels=None):
+    """Seconds between consecutive steps, one column per transition, for plotting the
+    distributions. Groups that did not make a transition are NaN."""
+    labels = labels or [column for column in times_df.columns if pd.api.types.is_datetime64_any_dtype(times_df[column])]
+    return pd.DataFrame({
+        f'{a} → {b}': (times_df[b] - times_df[a]).dt.total_seconds()
+        for a, b in zip(labels, labels[1:])
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Conversion through an ordered funnel of event types")
+    parser.add_argument('source', nargs='?', default='analytics.csv', help='analytics export (csv) or columnar store folder')
+    parser.add_argument('--steps', nargs='+', default=DEFAULT_STEPS, help='event types in funnel order')
+    parser.add_argument('--max-gap', help="maximum time between two steps, e.g. '30min'")
+    parser.add_argument('--by', default='session_id', choices=['session_id', 'user_id'])
+    parser.add_argument('--output', help='folder to write the result tables to as csv')
+    args = parser.parse_args()
+
+    steps_df, times_df = funnel(args.source, args.steps, args.max_gap, args.by)
+    print(steps_df.to_string())
+
+    if args.output:
+        steps_df.to_csv(f"{args.output}/funnel_steps.csv")
+        times_df.to_csv(f"{args.output}/funnel_times.csv", index=False)
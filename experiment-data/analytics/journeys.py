@@ -0,0 +1,195 @@
+# Event type transitions, most frequent paths and dwell times for every journey at once,
+# instead of rebuilding one user's sequence at a time as the journey notebooks do.
+#
+# Events are sorted once by journey (session or user) and time, and event types are
+# replaced by integer codes, so the whole dataset is one array of codes with journey
+# boundaries. A transition is a pair of neighbouring codes in the same journey and the
+# transition counts are one bincount over `from * states + to`; every journey also gets
+# a (start) and an (end) transition, so the table reads like a Sankey diagram. The dwell
+# time of an event is the time until the next event of its journey, and the paths are
+# the first `path_length` codes of every journey, counted with np.unique over rows.
+#
+#   python -m analytics.journeys analytics_store --by user_id --max-gap 30min --output plots
+#
+#   from analytics.journeys import journeys, transition_matrix
+#   transitions_df, dwell_df, paths_df = journeys(df, domains=['zalando.dk'])
+#   sns.heatmap(transition_matrix(transitions_df))
+#
+# By default consecutive events of the same type are collapsed into one (page-view,
+# page-view, checkout is page-view → checkout), and time-spent events are left out.
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from analytics.domains import tag_events
+from analytics.sessions import EXCLUDED_SESSIONS, EXCLUDED_USERS
+from analytics.store import load_events
+
+COLUMNS = ['session_id', 'user_id', 'type', 'created_at']
+EXCLUDED_TYPES = ('time-spent',)
+START = '(start)'
+END = '(end)'
+PATH_LENGTH = 5
+TOP_K = 20
+
+
+def encode(source, by='session_id', domains=None, types=None, excluded_types=EXCLUDED_TYPES, max_gap=None,
+           collapse=True):
+    """The events as sorted arrays: (journey start positions, type codes, times in ns,
+    type names). A journey is a run of events of one `by` value, split where two events
+    are more than `max_gap` apart."""
+    columns = COLUMNS + (['url'] if domains is not None else [])
+    df = load_events(source, columns=columns, types=types)
+    if domains is not None:
+        df = tag_events(df)
+        df = df[df['domain'].isin(list(domains)).to_numpy()]
+
+    group_codes, _ = pd.factorize(df[by])
+    type_codes, names = pd.factorize(df['type'], sort=True)
+    times = df['created_at'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    # Filtered on the arrays, the frame itself is never copied
+    keep = (group_codes >= 0) & (type_codes >= 0) & ~pd.isna(df['created_at']).to_numpy()
+    keep &= ~df['user_id'].isin(EXCLUDED_USERS).to_numpy() & ~df['session_id'].isin(EXCLUDED_SESSIONS).to_numpy()
+    if excluded_types:
+        keep &= ~np.isin(np.asarray(names, dtype=object), list(excluded_types))[type_codes]
+    group_codes, type_codes, times = group_codes[keep], type_codes[keep], times[keep]
+
+    # Sorting by journey and time is one argsort over journey * n + rank of the time,
+    # a lot faster than np.lexsort on the two columns
+    time_order = np.argsort(times, kind='stable')
+    rank = np.empty(len(times), dtype=np.int64)
+    rank[time_order] = np.arange(len(times))
+    order = np.argsort(group_codes.astype(np.int64) * len(times) + rank)
+    group_codes, type_codes, times = group_codes[order], type_codes[order], times[order]
+
+    boundary = np.diff(group_codes, prepend=-1) != 0
+    if max_gap is not None:
+        boundary |= np.diff(times, prepend=times[:1]) > pd.Timedelta(max_gap).value
+    if collapse:
+        # Keep the first event of every run of one type within a journey
+        keep = boundary | (np.diff(type_codes, prepend=-1) != 0)
+        boundary, type_codes, times = boundary[keep], type_codes[keep], times[keep]
+    return np.flatnonzero(boundary), type_codes, times, list(names)
+
+
+def transitions(starts, type_codes, times, names):
+    """One row per observed (from, to) pair with count, probability (share of the
+    transitions out of `from`) and median_seconds between the two events."""
+    states = len(names) + 2
+    start, end = len(names), len(names) + 1
+    last = np.r_[starts[1:] - 1, len(type_codes) - 1] if len(starts) else starts
+    # Within a journey every event is followed by the next one, except the last
+    inner = np.ones(len(type_codes), dtype=bool)
+    inner[last] = False
+    inner = np.flatnonzero(inner)
+
+    pairs = np.concatenate([
+        start * states + type_codes[starts],
+        type_codes[inner] * states + type_codes[inner + 1],
+        type_codes[last] * states + end,
+    ])
+    counts = np.bincount(pairs, minlength=states * states)
+    observed = np.flatnonzero(counts)
+    labels = np.array(names + [START, END], dtype=object)
+
+    seconds = pd.Series((times[inner + 1] - times[inner]) / 1e9)
+    medians = seconds.groupby(pairs[len(starts):len(starts) + len(inner)]).median()
+    outgoing = counts.reshape(states, states).sum(axis=1)
+    return pd.DataFrame({
+        'from': labels[observed // states],
+        'to': labels[observed % states],
+        'count': counts[observed],
+        'probability': counts[observed] / outgoing[observed // states],
+        'median_seconds': medians.reindex(observed).to_numpy(),
+    })
+
+
+def dwell_times(starts, type_codes, times, names):
+    """Per event type: events, the ones followed by another event in the journey, and
+    the mean, median and 90th percentile seconds until that next event."""
+    followed = np.ones(len(type_codes), dtype=bool)
+    if len(starts):
+        followed[np.r_[starts[1:] - 1, len(type_codes) - 1]] = False
+    index = np.flatnonzero(followed)
+    seconds = pd.Series((times[index + 1] - times[index]) / 1e9)
+    grouped = seconds.groupby(type_codes[index])
+    dwell_df = pd.DataFrame({
+        'events': np.bincount(type_codes, minlength=len(names)),
+        'followed': np.bincount(type_codes[index], minlength=len(names)),
+    }, index=pd.Index(names, name='type'))
+    for column, values in (('mean_seconds', grouped.mean()), ('median_seconds', grouped.median()),
+                           ('p90_seconds', grouped.quantile(0.9))):
+        dwell_df[column] = values.reindex(range(len(names))).to_numpy()
+    return dwell_df.sort_values('events', ascending=False)
+
+
+def top_paths(starts, type_codes, names, path_length=PATH_LENGTH, top_k=TOP_K):
+    """The `top_k` most frequent journey beginnings of at most `path_length` events,
+    with the number and share of journeys that start with exactly that path."""
+    ends = np.r_[starts[1:], len(type_codes)] if len(starts) else starts
+    positions = starts[:, None] + np.arange(path_length)
+    # Events past the end of a journey are -1, so shorter paths are their own rows
+    paths = np.where(positions < ends[:, None], type_codes[np.minimum(positions, len(type_codes) - 1)], -1)
+    base = len(names) + 1
+    if base ** path_length < 2 ** 63:
+        # A path is a number in base `types + 1`, one digit per step, counted with a 1-d unique
+        digits = base ** np.arange(path_length - 1, -1, -1, dtype=np.int64)
+        keys, counts = np.unique((paths.astype(np.int64) + 1) @ digits, return_counts=True)
+        unique_paths = keys[:, None] // digits % base - 1
+    else:
+        unique_paths, counts = np.unique(paths, axis=0, return_counts=True)
+    top = np.argsort(-counts, kind='stable')[:top_k]
+    return pd.DataFrame({
+        'path': [' → '.join(names[code] for code in unique_paths[i] if code >= 0) for i in top],
+        'length': (unique_paths[top] >= 0).sum(axis=1),
+        'journeys': counts[top],
+        'share': counts[top] / max(len(starts), 1),
+    })
+
+
+def journeys(source, by='session_id', domains=None, types=None, excluded_types=EXCLUDED_TYPES, max_gap=None,
+             collapse=True, path_length=PATH_LENGTH, top_k=TOP_K):
+    """Returns (transitions_df, dwell_df, paths_df), see `transitions`, `dwell_times` and
+    `top_paths`.
+
+    `source` is a DataFrame, a csv export or the columnar store folder, `by` session_id
+    or user_id, `domains` limits the events to those domains (as tagged by
+    analytics.domains) and `types` to those event types. `max_gap`, e.g. '30min', splits
+    a journey where nothing happened for that long."""
+    starts, type_codes, times, names = encode(source, by, domains, types, excluded_types, max_gap, collapse)
+    return (
+        transitions(starts, type_codes, times, names),
+        dwell_times(starts, type_codes, times, names),
+        top_paths(starts, type_codes, names, path_length, top_k),
+    )
+
+
+def transition_matrix(transitions_df, value='probability'):
+    """`value` as a from × to matrix for a heatmap, 0 for pairs that never happened."""
+    return transitions_df.pivot(index='from', columns='to', values=value).fillna(0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Event type transitions, top paths and dwell times of all journeys")
+    parser.add_argument('source', nargs='?', default='analytics.csv', help='analytics export (csv) or columnar store folder')
+    parser.add_argument('--by', default='session_id', choices=['session_id', 'user_id'])
+    parser.add_argument('--domains', nargs='+', help='only events on these domains')
+    parser.add_argument('--max-gap', help="split journeys after this much inactivity, e.g. '30min'")
+    parser.add_argument('--keep-repeats', action='store_true', help='do not collapse repeated event types')
+    parser.add_argument('--path-length', type=int, default=PATH_LENGTH)
+    parser.add_argument('--top', type=int, default=TOP_K)
+    parser.add_argument('--output', help='folder to write the result tables to as csv')
+    args = parser.parse_args()
+
+    transitions_df, dwell_df, paths_df = journeys(args.source, args.by, args.domains, max_gap=args.max_gap,
+                                                  collapse=not args.keep_repeats, path_length=args.path_length,
+                                                  top_k=args.top)
+    print(paths_df.to_string(index=False))
+    print()
+    print(dwell_df.to_string())
+
+    if args.output:
+        transitions_df.to_csv(f"{args.output}/journey_transitions.csv", index=False)
+        dwell_df.to_csv(f"{args.output}/journey_dwell_times.csv")
+        paths_df.to_csv(f"{args.output}/journey_paths.csv", index=False)
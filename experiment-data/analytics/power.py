@@ -0,0 +1,178 @@
+# Power analysis over grids of effect sizes, sample sizes and standard deviations, like
+# the loop in statistical_analysis.ipynb but for whole grids at once.
+#
+# A cell is a baseline mean (the interview mean shifted by `mean_difference`), the mean
+# after a relative change of `percentage_effect`, a standard deviation and optionally a
+# number of participants per group. The analytic power is that of statsmodels'
+# TTestIndPower (two-sided pooled t-test) evaluated with scipy's noncentral t over all
+# cells in one call, and the sample size for a target power is found by bisection over
+# all cells together.
+#
+# The Monte-Carlo power draws, for every simulated experiment, the group means and sums
+# of squares directly (normal and chi-square), which for normal data is the same as
+# drawing the samples and costs the same whatever the sample size. Simulations of a cell
+# are one vector, cells are spread over a process pool and every cell has its own seed
+# from one SeedSequence, so results do not depend on the number of workers.
+#
+#   python -m analytics.power --output interview_results.csv
+#   python -m analytics.power --std 2.9811 6.9595 --nobs 50 100 200 --simulations 10000
+#
+#   from analytics.power import grid, sample_size, power_grid, table
+#   cells = sample_size(grid(std=[2.9811, 6.9595]))
+#   table(cells, 'nobs')
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# From statistical_analysis.ipynb
+INTERVIEW_MEAN = 2.0125
+INTERVIEW_STD = 2.9811
+QUESTIONARY_MEAN = 2.7285
+QUESTIONARY_STD = 6.9595
+MEAN_DIFFERENCES = [-1.5, -1, -.5, 0, .5, 1, 1.5]
+PERCENTAGE_EFFECTS = [-0.1, -0.2, -0.3, -0.4, -0.5]
+POWER = 0.8
+ALPHA = 0.05
+SIMULATIONS = 10_000
+CELLS_PER_TASK = 64
+MIN_NOBS = 2
+MAX_NOBS = 1e12
+
+
+def grid(mean_difference=MEAN_DIFFERENCES, percentage_effect=PERCENTAGE_EFFECTS, std=(INTERVIEW_STD,), nobs=None,
+         base_mean=INTERVIEW_MEAN):
+    """One row per combination: mean_difference, percentage_effect, std, (nobs,)
+    mean_before, mean_after and the standardized effect_size."""
+    dimensions = {'mean_difference': mean_difference, 'percentage_effect': percentage_effect, 'std': std}
+    if nobs is not None:
+        dimensions['nobs'] = nobs
+    cells = pd.MultiIndex.from_product(list(dimensions.values()), names=list(dimensions)).to_frame(index=False)
+    cells['mean_before'] = base_mean + cells['mean_difference']
+    cells['mean_after'] = cells['mean_before'] * (1 + cells['percentage_effect'])
+    cells['effect_size'] = (cells['mean_after'] - cells['mean_before']) / cells['std']
+    return cells
+
+
+def analytic_power(effect_size, nobs1, alpha=ALPHA, ratio=1):
+    """Power of the two-sided pooled two-sample t-test, as TTestIndPower.power, for arrays."""
+    effect_size, nobs1 = np.broadcast_arrays(np.asarray(effect_size, dtype=float), np.asarray(nobs1, dtype=float))
+    nobs2 = nobs1 * ratio
+    df = nobs1 + nobs2 - 2
+    noncentrality = effect_size * np.sqrt(nobs1 * nobs2 / (nobs1 + nobs2))
+    critical = stats.t.isf(alpha / 2, df)
+    return stats.nct.sf(critical, df, noncentrality) + stats.nct.cdf(-critical, df, noncentrality)
+
+
+def required_nobs(effect_size, power=POWER, alpha=ALPHA, ratio=1, iterations=100):
+    """Participants per group (not rounded) for `power`, as TTestIndPower.solve_power.
+    inf where the effect is 0."""
+    effect_size = np.abs(np.asarray(effect_size, dtype=float))
+    low = np.full(effect_size.shape, float(MIN_NOBS))
+    high = np.full(effect_size.shape, float(MIN_NOBS))
+    # Double the upper bound until every cell reaches the power
+    short = (effect_size > 0) & (analytic_power(effect_size, high, alpha, ratio) < power)
+    while short.any() and high.max() < MAX_NOBS:
+        high[short] *= 2
+        short &= analytic_power(effect_size, high, alpha, ratio) < power
+    low[effect_size > 0] = np.where(high > MIN_NOBS, high / 2, MIN_NOBS)[effect_size > 0]
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        reached = analytic_power(effect_size, middle, alpha, ratio) >= power
+        high = np.where(reached, middle, high)
+        low = np.where(reached, low, middle)
+    return np.where((effect_size > 0) & ~short, high, np.inf)
+
+
+def _simulate_cells(mean_before, mean_after, std, nobs1, nobs2, simulations, alpha, seeds):
+    power = np.full(len(seeds), np.nan)
+    for i, seed in enumerate(seeds):
+        if not (np.isfinite(nobs1[i]) and nobs1[i] >= MIN_NOBS):
+            continue
+        rng = np.random.default_rng(seed)
+        n1, n2 = int(nobs1[i]), int(nobs2[i])
+        mean1 = rng.normal(mean_before[i], std[i] / np.sqrt(n1), simulations)
+        mean2 = rng.normal(mean_after[i], std[i] / np.sqrt(n2), simulations)
+        squares = std[i] ** 2 * (rng.chisquare(n1 - 1, simulations) + rng.chisquare(n2 - 1, simulations))
+        df = n1 + n2 - 2
+        t = (mean2 - mean1) / np.sqrt(squares / df * (1 / n1 + 1 / n2))
+        power[i] = np.mean(np.abs(t) > stats.t.isf(alpha / 2, df))
+    return power
+
+
+def simulated_power(cells, nobs='nobs', simulations=SIMULATIONS, alpha=ALPHA, ratio=1, seed=0, workers=None):
+    """Share of `simulations` simulated experiments per cell where the t-test rejects, with
+    `nobs` (column or number, rounded up) participants per group."""
+    nobs1 = np.ceil(cells[nobs].to_numpy(dtype=float) if isinstance(nobs, str) else np.full(len(cells), float(nobs)))
+    nobs2 = np.ceil(nobs1 * ratio)
+    columns = [cells[column].to_numpy(dtype=float) for column in ('mean_before', 'mean_after', 'std')]
+    seeds = np.random.SeedSequence(seed).spawn(len(cells))
+    tasks = [
+        ([column[i:i + CELLS_PER_TASK] for column in columns] + [nobs1[i:i + CELLS_PER_TASK], nobs2[i:i + CELLS_PER_TASK]],
+         seeds[i:i + CELLS_PER_TASK])
+        for i in range(0, len(cells), CELLS_PER_TASK)
+    ]
+    if workers == 1 or len(tasks) <= 1:
+        return np.concatenate([_simulate_cells(*arrays, simulations, alpha, task_seeds) for arrays, task_seeds in tasks] or [[]])
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(_simulate_cells, *arrays, simulations, alpha, task_seeds) for arrays, task_seeds in tasks]
+        return np.concatenate([future.result() for future in futures])
+
+
+def sample_size(cells, power=POWER, alpha=ALPHA, ratio=1):
+    """The cells with `nobs`, the participants per group needed for `power`."""
+    return cells.assign(nobs=required_nobs(cells['effect_size'].to_numpy(), power, alpha, ratio))
+
+
+def power_grid(cells, alpha=ALPHA, ratio=1, simulations=0, seed=0, workers=None):
+    """The cells (with nobs) with their analytic `power` and, with `simulations`, `simulated_power`."""
+    cells = cells.assign(power=analytic_power(cells['effect_size'], cells['nobs'], alpha, ratio))
+    if simulations:
+        cells['simulated_power'] = simulated_power(cells, 'nobs', simulations, alpha, ratio, seed, workers)
+    return cells
+
+
+def table(cells, value, index='mean_difference', columns='percentage_effect'):
+    """`value` with `index` as rows and `columns` as columns, like interview_results.csv.
+    Grid dimensions besides those two become outer row levels."""
+    outer = [name for name in ('std', 'nobs') if name in cells.columns and name != value
+             and cells[name].nunique() > 1 and name not in (index, columns)]
+    result = cells.pivot_table(index=outer + [index], columns=columns, values=value, aggfunc='first', sort=False)
+    result.columns.name = None
+    if not outer:
+        result.index.name = None
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sample size or power over a grid of effect sizes")
+    parser.add_argument('--mean-difference', type=float, nargs='+', default=MEAN_DIFFERENCES)
+    parser.add_argument('--percentage-effect', type=float, nargs='+', default=PERCENTAGE_EFFECTS)
+    parser.add_argument('--std', type=float, nargs='+', default=[INTERVIEW_STD])
+    parser.add_argument('--base-mean', type=float, default=INTERVIEW_MEAN)
+    parser.add_argument('--nobs', type=float, nargs='+',
+                        help='participants per group; computes the power instead of the sample size')
+    parser.add_argument('--power', type=float, default=POWER)
+    parser.add_argument('--alpha', type=float, default=ALPHA)
+    parser.add_argument('--simulations', type=int, default=0,
+                        help='also simulate the power (at the required sample size, rounded up, without --nobs)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--output', help='csv to write the table to')
+    args = parser.parse_args()
+
+    cells = grid(args.mean_difference, args.percentage_effect, args.std, args.nobs, args.base_mean)
+    if args.nobs is None:
+        cells = sample_size(cells, args.power, args.alpha)
+    cells = power_grid(cells, args.alpha, simulations=args.simulations, seed=args.seed, workers=args.workers)
+
+    result = table(cells, 'power' if args.nobs else 'nobs')
+    print(result.to_string())
+    if args.simulations:
+        print("\nSimulated power:")
+        print(table(cells, 'simulated_power').to_string())
+    if args.output:
+        result.to_csv(args.output)
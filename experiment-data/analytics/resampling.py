@@ -0,0 +1,231 @@
+# Bootstrap confidence intervals and permutation p-values for the modal impact numbers.
+#
+# Sessions of the same user are not independent, so everything is resampled at the user
+# level: each user is reduced to a few totals (checkout sessions and purchases with and
+# without the modal), and a resample is a row of user indices drawn with replacement.
+# A block of resamples is one (resamples × users) index matrix, turned into draw counts
+# per user, and its statistics are one matrix product with the user totals, so there
+# is no Python loop per resample. Blocks are spread over a process pool, each with its
+# own seed from one SeedSequence, so results are reproducible for a given seed and
+# block size whatever the number of workers.
+#
+# Medians are resampled the same way, as medians of the sessions weighted by how often
+# their user was drawn (or, for the permutation test, which group each user's sessions
+# were swapped to).
+#
+#   from analytics.resampling import modal_impact_intervals
+#   conversion, median, purchase_time = modal_impact_intervals('analytics_store', resamples=100_000)
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analytics.store import load_events
+
+RESAMPLES = 10_000
+BLOCK_SIZE = 1000
+CONFIDENCE = 0.95
+COLUMNS = ['user_id', 'session_id', 'type', 'url', 'created_at']
+
+
+def user_totals(checkout_df, modal_df, purchase_df):
+    """Checkout sessions and purchases with and without the modal, per user."""
+    sessions = checkout_df.drop_duplicates('session_id')[['session_id', 'user_id']]
+    has_modal = sessions['session_id'].isin(modal_df['session_id'].unique()).to_numpy()
+    has_purchase = sessions['session_id'].isin(purchase_df['session_id'].unique()).to_numpy()
+    totals = pd.DataFrame({
+        'user_id': sessions['user_id'].astype(object).to_numpy(),
+        'with_modal': has_modal,
+        'purchases_with_modal': has_modal & has_purchase,
+        'without_modal': ~has_modal,
+        'purchases_without_modal': ~has_modal & has_purchase,
+    })
+    return totals.groupby('user_id').sum().astype(np.int64)
+
+
+def conversion_difference(totals):
+    """Conversion with the modal minus without, from (..., users, 4) totals summed over users."""
+    with_modal, purchases_with_modal, without_modal, purchases_without_modal = np.moveaxis(totals, -1, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return purchases_with_modal / with_modal - purchases_without_modal / without_modal
+
+
+def draw_counts(rng, users, resamples):
+    """How often each user is drawn in each resample, from a (resamples × users) index matrix."""
+    index = rng.integers(0, users, size=(resamples, users))
+    offsets = index + users * np.arange(resamples)[:, None]
+    return np.bincount(offsets.ravel(), minlength=resamples * users).reshape(resamples, users)
+
+
+def _bootstrap_conversion(totals, resamples, seed):
+    counts = draw_counts(np.random.default_rng(seed), len(totals), resamples)
+    # Float matrices, so the product runs through BLAS
+    return conversion_difference(counts.astype(np.float64) @ totals)
+
+
+def _permute_conversion(totals, resamples, seed):
+    # Under no effect, which of a user's sessions got the modal is exchangeable, so each
+    # user's with/without totals are swapped with probability 1/2
+    rng = np.random.default_rng(seed)
+    swap = (rng.random(size=(resamples, len(totals))) < 0.5).astype(np.float64)
+    swapped = totals[:, [2, 3, 0, 1]]
+    return conversion_difference(swap @ swapped + (1 - swap) @ totals)
+
+
+def weighted_median(times, weights):
+    """Median of the sorted `times` per row of session `weights`, NaN for a row without weight."""
+    cumulative = np.cumsum(weights, axis=-1, dtype=np.int32)
+    total = cumulative[..., -1:]
+    # `times` is sorted, so the median is the first session where half the weight is reached
+    medians = times[np.argmax(cumulative >= total / 2, axis=-1)]
+    return np.where(total[..., 0] > 0, medians, np.nan)
+
+
+def median_difference(times, weights, groups):
+    """Weighted median of the sessions in the group minus the median of the others."""
+    return weighted_median(times, weights * groups) - weighted_median(times, weights * ~groups)
+
+
+def _bootstrap_median(times, session_users, users, resamples, seed):
+    # A resampled user's sessions count as often as the user was drawn
+    counts = draw_counts(np.random.default_rng(seed), users, resamples)
+    return weighted_median(times, counts[:, session_users])
+
+
+def _bootstrap_median_difference(times, session_users, groups, users, resamples, seed):
+    counts = draw_counts(np.random.default_rng(seed), users, resamples)
+    return median_difference(times, counts[:, session_users], groups)
+
+
+def _permute_median_difference(times, session_users, groups, users, resamples, seed):
+    # Like _permute_conversion: each user's sessions swap groups with probability 1/2
+    rng = np.random.default_rng(seed)
+    swap = rng.random(size=(resamples, users)) < 0.5
+    return median_difference(times, np.ones(len(times), dtype=np.int32), groups ^ swap[:, session_users])
+
+
+def resample(function, args, resamples, seed=0, workers=None, block_size=BLOCK_SIZE):
+    """Concatenated results of `function(*args, n, seed)` over blocks of at most `block_size`
+    resamples, in a process pool unless `workers` is 1."""
+    blocks = [block_size] * (resamples // block_size) + ([resamples % block_size] if resamples % block_size else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(blocks))
+    if workers == 1 or len(blocks) == 1:
+        return np.concatenate([function(*args, n, block_seed) for n, block_seed in zip(blocks, seeds)])
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(function, *args, n, block_seed) for n, block_seed in zip(blocks, seeds)]
+        return np.concatenate([future.result() for future in futures])
+
+
+def interval(values, confidence=CONFIDENCE):
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return np.nan, np.nan
+    return tuple(np.quantile(values, [(1 - confidence) / 2, (1 + confidence) / 2]))
+
+
+def conversion_test(totals, resamples=RESAMPLES, seed=0, workers=None, confidence=CONFIDENCE):
+    """Difference in checkout to purchase conversion with and without the modal, with a
+    user-level bootstrap interval and a two-sided permutation p-value."""
+    values = totals[['with_modal', 'purchases_with_modal', 'without_modal', 'purchases_without_modal']].to_numpy(dtype=np.float64)
+    observed = float(conversion_difference(values.sum(axis=0)))
+    if not len(values):
+        # No checkout sessions, nothing to resample
+        return pd.Series({'difference': observed, 'ci_low': np.nan, 'ci_high': np.nan, 'p_value': np.nan,
+                          'users': 0, 'resamples': resamples})
+    bootstrap = resample(_bootstrap_conversion, (values,), resamples, seed, workers)
+    permuted = resample(_permute_conversion, (values,), resamples, seed + 1, workers)
+    permuted = permuted[np.isfinite(permuted)]
+    ci_low, ci_high = interval(bootstrap, confidence)
+    return pd.Series({
+        'difference': observed,
+        'ci_low': ci_low,
+        'ci_high': ci_high,
+        'p_value': (1 + np.sum(np.abs(permuted) >= abs(observed))) / (1 + len(permuted)) if np.isfinite(observed) else np.nan,
+        'users': len(totals),
+        'resamples': resamples,
+    })
+
+
+def median_interval(time_diff_df, column='minutes_to_purchase', resamples=RESAMPLES, seed=0, workers=None,
+                    confidence=CONFIDENCE):
+    """Median of `column` with a user-level bootstrap interval. `time_diff_df` needs user_id."""
+    df = time_diff_df.dropna(subset=[column]).sort_values(column)
+    session_users, users = pd.factorize(df['user_id'])
+    times = df[column].to_numpy()
+    if len(times):
+        medians = resample(_bootstrap_median, (times, session_users, len(users)), resamples, seed, workers)
+        ci_low, ci_high = interval(medians, confidence)
+    else:
+        # No session with both the modal and a purchase
+        ci_low = ci_high = np.nan
+    return pd.Series({
+        'median': float(np.median(times)) if len(times) else np.nan,
+        'ci_low': ci_low,
+        'ci_high': ci_high,
+        'sessions': len(times),
+        'users': len(users),
+        'resamples': resamples,
+    })
+
+
+def median_test(times_df, column='minutes_to_purchase', group='with_modal', resamples=RESAMPLES, seed=0,
+                workers=None, confidence=CONFIDENCE):
+    """Median of `column` in the sessions where `group` is true minus in the others, with a
+    user-level bootstrap interval and a two-sided permutation p-value. `times_df` needs user_id."""
+    df = times_df.dropna(subset=[column]).sort_values(column)
+    session_users, users = pd.factorize(df['user_id'])
+    times = df[column].to_numpy(dtype=np.float64)
+    groups = df[group].to_numpy(dtype=bool)
+    observed = float(median_difference(times, np.ones(len(times), dtype=np.int32), groups)) if len(times) else np.nan
+    if np.isfinite(observed):
+        args = (times, session_users, groups, len(users))
+        ci_low, ci_high = interval(resample(_bootstrap_median_difference, args, resamples, seed, workers), confidence)
+        permuted = resample(_permute_median_difference, args, resamples, seed + 1, workers)
+        permuted = permuted[np.isfinite(permuted)]
+        p_value = (1 + np.sum(np.abs(permuted) >= abs(observed))) / (1 + len(permuted))
+    else:
+        # One of the groups has no sessions
+        ci_low = ci_high = p_value = np.nan
+    return pd.Series({
+        'difference': observed,
+        'ci_low': ci_low,
+        'ci_high': ci_high,
+        'p_value': p_value,
+        'sessions': len(times),
+        'users': len(users),
+        'resamples': resamples,
+    })
+
+
+def checkout_to_purchase_times(checkout_df, modal_df, purchase_df):
+    """Minutes from the first checkout to the first purchase after it, per checkout
+    session that purchased, and whether the session saw the modal."""
+    first_checkout = checkout_df.groupby('session_id', observed=True).agg(
+        user_id=('user_id', 'first'), checkout_time=('created_at', 'min'))
+    first_purchase = purchase_df.groupby('session_id', observed=True)['created_at'].min().rename('purchase_time')
+    df = first_checkout.join(first_purchase, how='inner').reset_index()
+    df['minutes_to_purchase'] = (df['purchase_time'] - df['checkout_time']).dt.total_seconds() / 60
+    df = df[df['minutes_to_purchase'] >= 0]
+    df['user_id'] = df['user_id'].astype(object)
+    df['with_modal'] = df['session_id'].isin(modal_df['session_id'].unique())
+    return df.reset_index(drop=True)
+
+
+def modal_impact_intervals(source='analytics.csv', resamples=RESAMPLES, seed=0, workers=None):
+    """The modal_impact_analysis numbers with intervals: (conversion test, median time from
+    the modal to purchase, median time from checkout to purchase with minus without the modal)."""
+    # Imported here, modal_impact_analysis itself imports this module for its --resamples option
+    from modal_impact_analysis import modal_to_purchase_times, split_events
+
+    df = load_events(source, columns=COLUMNS)
+    checkout_df, modal_df, purchase_df = split_events(df)
+    conversion = conversion_test(user_totals(checkout_df, modal_df, purchase_df), resamples, seed, workers)
+
+    time_diff_df = modal_to_purchase_times(modal_df, purchase_df)
+    users = df.drop_duplicates('session_id').set_index('session_id')['user_id']
+    time_diff_df['user_id'] = time_diff_df['session_id'].map(users).astype(object)
+    median = median_interval(time_diff_df, resamples=resamples, seed=seed, workers=workers)
+    purchase_time = median_test(checkout_to_purchase_times(checkout_df, modal_df, purchase_df), resamples=resamples,
+                                seed=seed, workers=workers)
+    return conversion, median, purchase_time
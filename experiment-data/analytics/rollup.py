@@ -0,0 +1,182 @@
+# Pre-aggregated user × domain × day × type cube over the columnar store.
+#
+# Every row holds, for one user, domain, day and event type: the number of events, the
+# number of distinct sessions with such an event and their ids, and the summed
+# `time-spent` duration. Events without a domain are kept, with a null domain.
+# The cube is stored as Parquet partitioned by day next to the store. `update` only
+# rebuilds the days that received events since the previous run (by `received_at`,
+# so late events for older days are picked up), and `rollup` derives coarser tables,
+# e.g. checkouts per domain per week, from the daily rows.
+#
+#   python -m analytics.rollup update
+#
+#   from analytics.rollup import load_cube, rollup
+#   cube = load_cube(types=['time-spent'])
+#   weekly = rollup(cube, by=['domain'], freq='W')
+#
+# Sessions cannot be summed, a session active on two days or domains would be counted
+# twice, so `rollup` counts the distinct session ids of the rows it combines instead.
+import argparse
+import os
+import shutil
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from analytics.domains import tag_events
+from analytics.store import PARTITION_COLUMN, STORE_PATH, dataset, read_watermark, write_watermark
+
+ROLLUP_PATH = 'analytics_rollup'
+KEYS = ['user_id', 'domain', PARTITION_COLUMN, 'type']
+# Summed by `rollup`, sessions are counted from session_ids
+MEASURES = ['events', 'time_spent_ms']
+DICTIONARY_COLUMNS = ['user_id', 'domain', 'type']
+TIME_SPENT_TYPE = 'time-spent'
+DURATION_PATTERN = r'"duration"\s*:\s*(-?\d+(?:\.\d+)?)'
+DAYS_PER_BATCH = 7
+
+
+def durations(df):
+    """`duration` in milliseconds from the payload of time-spent events, 0 for others."""
+    time_spent = (df['type'] == TIME_SPENT_TYPE).to_numpy()
+    ms = pd.Series(0.0, index=df.index)
+    if time_spent.any():
+        extracted = df.loc[time_spent, 'payload'].astype('string').str.extract(DURATION_PATTERN, expand=False)
+        ms[time_spent] = pd.to_numeric(extracted, errors='coerce').fillna(0).to_numpy()
+    return ms
+
+
+def aggregate(df):
+    """Cube rows for a frame of events with user_id, domain, session_id, type, payload and day."""
+    df = df.assign(time_spent_ms=durations(df))
+    table = pa.Table.from_pandas(df[KEYS + ['session_id', 'time_spent_ms']], preserve_index=False)
+    # Arrow's group by keeps null keys and collects the distinct session ids in one pass
+    cube = table.group_by(KEYS, use_threads=False).aggregate([
+        ([], 'count_all'),
+        ('session_id', 'count_distinct'),
+        ('session_id', 'distinct'),
+        ('time_spent_ms', 'sum'),
+    ])
+    return cube.rename_columns(KEYS + ['events', 'sessions', 'session_ids', 'time_spent_ms']).to_pandas()
+
+
+def changed_days(store_path, since):
+    """Days with events received after `since`, all days when `since` is None."""
+    store = dataset(store_path)
+    if since is None or 'received_at' not in store.schema.names:
+        table = store.to_table(columns=[PARTITION_COLUMN])
+    else:
+        since = pa.scalar(pd.Timestamp(since).to_pydatetime(), pa.timestamp('ns', 'UTC'))
+        table = store.to_table(columns=[PARTITION_COLUMN], filter=ds.field('received_at') > since)
+    return sorted(pd.unique(table[PARTITION_COLUMN].to_pandas().astype(str)))
+
+
+def read_days(store_path, days):
+    store = dataset(store_path)
+    names = store.schema.names
+    # Without a domain column the domain is derived from the url
+    wanted = ['user_id', 'session_id', 'type', 'payload', 'domain' if 'domain' in names else 'url', PARTITION_COLUMN]
+    columns = [column for column in wanted if column in names]
+    df = store.to_table(columns=columns, filter=ds.field(PARTITION_COLUMN).isin(days)).to_pandas()
+    if 'domain' not in df.columns:
+        df = tag_events(df).drop(columns=['url', 'shop', 'category'])
+    if 'payload' not in df.columns:
+        df['payload'] = None
+    df[PARTITION_COLUMN] = df[PARTITION_COLUMN].astype(str)
+    return df
+
+
+def write_days(cube, days, rollup_path=ROLLUP_PATH):
+    """Replace the partitions of `days` with the rows of `cube`."""
+    for day in days:
+        shutil.rmtree(os.path.join(rollup_path, f'{PARTITION_COLUMN}={day}'), ignore_errors=True)
+    if len(cube) == 0:
+        return
+    table = pa.Table.from_pandas(cube, preserve_index=False)
+    for column in DICTIONARY_COLUMNS:
+        index = table.column_names.index(column)
+        table = table.set_column(index, column, table[column].cast(pa.string()).dictionary_encode().cast(pa.dictionary(pa.int32(), pa.string())))
+    index = table.column_names.index('session_ids')
+    table = table.set_column(index, 'session_ids', table['session_ids'].cast(pa.list_(pa.string())))
+    pq.write_to_dataset(
+        table,
+        rollup_path,
+        partition_cols=[PARTITION_COLUMN],
+        basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        compression='zstd',
+    )
+
+
+def update(store_path=STORE_PATH, rollup_path=ROLLUP_PATH, days_per_batch=DAYS_PER_BATCH, rebuild=False):
+    """Rebuild the cube for every day that changed since the last update. Returns those days."""
+    watermark = None if rebuild else read_watermark(rollup_path)
+    store = dataset(store_path)
+    latest = None
+    if 'received_at' in store.schema.names:
+        latest = pc.max(store.to_table(columns=['received_at'])['received_at']).as_py()
+
+    days = changed_days(store_path, watermark and watermark['received_at'])
+    for i in range(0, len(days), days_per_batch):
+        batch = days[i:i + days_per_batch]
+        write_days(aggregate(read_days(store_path, batch)), batch, rollup_path)
+
+    if latest is not None:
+        write_watermark({'received_at': pd.Timestamp(latest).isoformat()}, rollup_path)
+    return days
+
+
+def load_cube(rollup_path=ROLLUP_PATH, types=None, users=None, domains=None, start=None, end=None):
+    """Load the daily cube rows, filtered on type, user, domain and a day range (end exclusive)."""
+    conditions = []
+    if types is not None:
+        conditions.append(ds.field('type').isin(list(types)))
+    if users is not None:
+        conditions.append(ds.field('user_id').isin(list(users)))
+    if domains is not None:
+        conditions.append(ds.field('domain').isin(list(domains)))
+    if start is not None:
+        conditions.append(ds.field(PARTITION_COLUMN) >= pd.Timestamp(start).strftime('%Y-%m-%d'))
+    if end is not None:
+        conditions.append(ds.field(PARTITION_COLUMN) < pd.Timestamp(end).strftime('%Y-%m-%d'))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    cube = ds.dataset(rollup_path, format='parquet', partitioning='hive').to_table(filter=expression).to_pandas()
+    cube[PARTITION_COLUMN] = pd.to_datetime(cube[PARTITION_COLUMN].astype(str))
+    return cube
+
+
+def rollup(cube, by=('domain',), freq='D'):
+    """Sum the cube over everything but `by` and the `freq` period ('D', 'W', 'M', or
+    None for no time column), and count the distinct sessions of every group. The period
+    column holds the period start."""
+    keys = list(by)
+    if freq is not None:
+        day = pd.to_datetime(cube[PARTITION_COLUMN].astype(str))
+        cube = cube.assign(period=day.dt.to_period(freq).dt.start_time)
+        keys.append('period')
+    result = cube.groupby(keys, observed=True, dropna=False)[MEASURES].sum()
+    if 'session_ids' in cube.columns:
+        sessions = cube[keys + ['session_ids']].explode('session_ids')
+        result['sessions'] = sessions.groupby(keys, observed=True, dropna=False)['session_ids'].nunique()
+    return result.reset_index()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="User × domain × day rollup cube over the columnar store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update_parser = subparsers.add_parser('update', help='rebuild the days that changed since the last update')
+    update_parser.add_argument('--store', default=STORE_PATH)
+    update_parser.add_argument('--rollup', default=ROLLUP_PATH)
+    update_parser.add_argument('--rebuild', action='store_true', help='rebuild every day')
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        days = update(args.store, args.rollup, rebuild=args.rebuild)
+        print(f"Updated {len(days)} days in {args.rollup}")
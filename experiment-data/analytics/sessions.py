@@ -0,0 +1,172 @@
+# Session summaries for the notebooks that rebuild sessions from the raw events.
+#
+# One row per session with the same columns purchase_journey_analysis.ipynb builds in
+# its `for session_id, session_df in session_groups` loop: user, start/end time,
+# duration, the funnel flags, their counts and the order they first happened in.
+# Events are sorted once by session and time, and every column is a reduction over the
+# contiguous session slices. Event types are mapped to flags through a lookup table
+# over the distinct types, so matching (including substring matching) is done once per
+# type instead of once per event.
+#
+#   from analytics.sessions import summarize_sessions, JOURNEY_FLAG_TYPES
+#   sessions_df = summarize_sessions(df)   # or 'analytics.csv' / 'analytics_store'
+#   sessions_df = summarize_sessions(df, JOURNEY_FLAG_TYPES, contains='purchase')  # modal counts as purchase
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from analytics.store import load_events
+
+# Same definitions as enhanced_comparison.ipynb and the catcher's sessionizer
+FLAG_TYPES = {
+    'add_to_cart': ('add-to-cart',),
+    'checkout': ('checkout',),
+    'modal': ('enforce_wait_modal_shown',),
+    'purchase': ('place-order',),
+}
+# purchase_journey_analysis.ipynb treats the modal as the purchase indicator
+JOURNEY_FLAG_TYPES = {
+    'add_to_cart': ('add-to-cart',),
+    'checkout': ('checkout',),
+    'purchase': ('enforce_wait_modal_shown',),
+}
+EXCLUDED_USERS = ('none', 'less-website')
+EXCLUDED_SESSIONS = ('none',)
+COLUMNS = ['session_id', 'user_id', 'type', 'created_at']
+NEVER = np.iinfo(np.int64).max  # first time of a flag that did not happen
+
+
+def type_lookup(types, flag_types=FLAG_TYPES, contains=False):
+    """Flag bitmask for each of the distinct `types`, bit i for the i-th flag.
+
+    For the flags named in `contains` (one name or a list, True for all) a type matches
+    when one of the flag's types is a case insensitive substring, like
+    `is_purchase_event` in purchase_journey_analysis; the other flags match exactly."""
+    if isinstance(contains, str):
+        contains = (contains,)
+    lookup = np.zeros(len(types), dtype=np.int64)
+    for bit, (flag, patterns) in enumerate(flag_types.items()):
+        if contains is True or (contains and flag in contains):
+            matches = [any(pattern.lower() in str(t).lower() for pattern in patterns) for t in types]
+        else:
+            matches = [t in patterns for t in types]
+        lookup[np.asarray(matches, dtype=bool)] |= 1 << bit
+    return lookup
+
+
+def first_sequences(first_times, names):
+    """' → ' joined flag names in order of first occurrence, built once per distinct order."""
+    present = first_times < NEVER
+    order = np.argsort(first_times, axis=1, kind='stable')
+    # Absent flags sort last, mark them so sessions with the same order share a key
+    keys = np.where(np.take_along_axis(present, order, axis=1), order, -1)
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    labels = np.array([' → '.join(names[i] for i in key if i >= 0) or 'no_events' for key in unique_keys], dtype=object)
+    return labels[inverse.reshape(-1)]
+
+
+def summarize_sessions(source, flag_types=FLAG_TYPES, contains=False,
+                       excluded_users=EXCLUDED_USERS, excluded_sessions=EXCLUDED_SESSIONS):
+    """One row per session: session_id, user_id, start_time, end_time, duration_minutes,
+    event_count, has_<flag>, <flag>_count, first_<flag>_time and event_sequence.
+
+    `source` is a DataFrame, a csv export or the columnar store folder."""
+    df = load_events(source, columns=COLUMNS)
+    df = df[~df['user_id'].isin(excluded_users) & ~df['session_id'].isin(excluded_sessions)]
+    df = df.dropna(subset=['session_id', 'created_at'])
+
+    sessions = df['session_id'].astype('category')
+    types = df['type'].astype('category')
+    times = df['created_at'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+    # One sort by session, then time; ties keep their original order
+    order = np.lexsort((times, sessions.cat.codes.to_numpy()))
+    session_codes = sessions.cat.codes.to_numpy()[order]
+    times = times[order]
+    # The extra 0 is what code -1 (a missing type) indexes
+    lookup = np.append(type_lookup(types.cat.categories, flag_types, contains), 0)
+    bits = lookup[types.cat.codes.to_numpy()[order]]
+
+    starts = np.flatnonzero(np.diff(session_codes, prepend=-1) != 0)
+    ends = np.append(starts[1:], len(order)) if len(starts) else starts
+
+    start_time = times[starts]
+    end_time = times[ends - 1]
+    summary = pd.DataFrame({
+        'session_id': sessions.cat.categories[session_codes[starts]],
+        'user_id': df['user_id'].to_numpy()[order][starts],
+        'start_time': pd.to_datetime(start_time.view('datetime64[ns]'), utc=True),
+        'end_time': pd.to_datetime(end_time.view('datetime64[ns]'), utc=True),
+        'duration_minutes': (end_time - start_time) / 60e9,
+        'event_count': ends - starts,
+    })
+
+    names = list(flag_types)
+    first_times = np.empty((len(starts), len(names)), dtype=np.int64)
+    for i, name in enumerate(names):
+        flagged = (bits & (1 << i)) != 0
+        counts = np.add.reduceat(flagged.astype(np.int64), starts)
+        first_times[:, i] = np.minimum.reduceat(np.where(flagged, times, NEVER), starts)
+        summary[f'has_{name}'] = counts > 0
+        summary[f'{name}_count'] = counts
+    for i, name in enumerate(names):
+        # NaT is the smallest int64, so absent flags become NaT
+        first = np.where(first_times[:, i] == NEVER, np.iinfo(np.int64).min, first_times[:, i])
+        summary[f'first_{name}_time'] = pd.to_datetime(first.view('datetime64[ns]'), utc=True)
+    summary['event_sequence'] = first_sequences(first_times, names)
+    return summary
+
+
+def flow_categories(sessions_df):
+    """The `categorize_flow` labels of purchase_journey_analysis.ipynb."""
+    cart, checkout, purchase = (sessions_df[f'has_{flag}'] for flag in ('add_to_cart', 'checkout', 'purchase'))
+    return pd.Series(np.select(
+        [
+            cart & checkout & purchase,
+            cart & checkout & ~purchase,
+            ~cart & checkout & purchase,
+            cart & ~checkout & ~purchase,
+            ~cart & checkout & ~purchase,
+            ~cart & ~checkout & purchase,
+        ],
+        [
+            'Complete Flow',
+            'Add-to-Cart then Checkout',
+            'Checkout then Purchase',
+            'Add-to-Cart',
+            'Checkout',
+            'Direct Purchase',
+        ],
+        default='Just Looking',
+    ), index=sessions_df.index)
+
+
+def session_categories(sessions_df, looking_minutes=20):
+    """The `categorize_session` labels of purchase_journey_analysis.ipynb."""
+    return pd.Series(np.select(
+        [~sessions_df['has_purchase'], sessions_df['duration_minutes'] >= looking_minutes],
+        ['Just Looking', 'Looking Then Purchasing'],
+        default='Quick Purchase',
+    ), index=sessions_df.index)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build one summary row per session")
+    parser.add_argument('source', nargs='?', default='analytics.csv', help='analytics export (csv) or columnar store folder')
+    parser.add_argument('--journey', action='store_true', help='count the modal as purchase, like purchase_journey_analysis')
+    parser.add_argument('--output', default='sessions.csv')
+    args = parser.parse_args()
+
+    if args.journey:
+        sessions_df = summarize_sessions(args.source, JOURNEY_FLAG_TYPES, contains='purchase')
+    else:
+        sessions_df = summarize_sessions(args.source)
+    sessions_df['flow_category'] = flow_categories(sessions_df)
+    sessions_df['category'] = session_categories(sessions_df)
+    sessions_df.to_csv(args.output, index=False)
+
+    print(f"Total sessions: {len(sessions_df)}")
+    print(f"Sessions with purchases: {sessions_df['has_purchase'].sum()}")
+    print(f"Unique users: {sessions_df['user_id'].nunique()}")
+    print(sessions_df['flow_category'].value_counts().to_string())
@@ -0,0 +1,216 @@
+# Columnar store for the analytics export.
+#
+# `convert` turns analytics.csv into a Parquet dataset partitioned by day, with the
+# timestamps already parsed and user_id/session_id/type/domain dictionary encoded.
+# `load` reads it back, only the requested columns, and pushes filters on type, day
+# and time down to Parquet, so unrelated partitions and row groups are never read.
+#
+#   python -m analytics.store convert analytics.csv
+#   python -m analytics.store convert analytics.csv --overwrite   # a newer export
+#
+#   from analytics.store import load
+#   df = load(columns=['session_id', 'type', 'created_at'],
+#             types=['checkout', 'enforce_wait_modal_shown'])
+import argparse
+import json
+import os
+import shutil
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+STORE_PATH = 'analytics_store'
+DICTIONARY_COLUMNS = ['user_id', 'session_id', 'type', 'domain']
+TIMESTAMP_COLUMNS = ['created_at', 'received_at']
+PARTITION_COLUMN = 'day'
+CHUNK_SIZE = 500_000
+WATERMARK_FILE = '_watermark.json'  # pyarrow ignores files starting with _
+# Column types of the analytics table. Every file is written with them, whatever the
+# values of a single write are (a day whose payloads are all empty would otherwise get a
+# null column, which the other days' strings cannot be read together with)
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('type', pa.dictionary(pa.int32(), pa.string())),
+    ('url', pa.string()),
+    ('payload', pa.string()),
+    ('user_id', pa.dictionary(pa.int32(), pa.string())),
+    ('session_id', pa.dictionary(pa.int32(), pa.string())),
+    ('received_at', pa.timestamp('ns', 'UTC')),
+    ('created_at', pa.timestamp('ns', 'UTC')),
+    ('domain', pa.dictionary(pa.int32(), pa.string())),
+    (PARTITION_COLUMN, pa.string()),
+])
+
+
+def prepare(df):
+    """Parse timestamps and encode the repeated string columns of a raw export frame."""
+    df = df.copy()
+    for column in TIMESTAMP_COLUMNS:
+        if column in df.columns and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], format='ISO8601', utc=True)
+    for column in DICTIONARY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    if 'payload' in df.columns:
+        # The REST API returns json payloads parsed, the csv export as text
+        df['payload'] = df['payload'].map(lambda value: value if isinstance(value, str) else json.dumps(value),
+                                          na_action='ignore')
+    df[PARTITION_COLUMN] = df['created_at'].dt.strftime('%Y-%m-%d')
+    return df
+
+
+def append(df, store_path=STORE_PATH):
+    """Write a frame of new events to the store. Existing files are never rewritten."""
+    if len(df) == 0:
+        return
+    table = pa.Table.from_pandas(prepare(df), preserve_index=False)
+    # The same types in every file, columns that are not in the analytics table keep theirs
+    table = table.cast(pa.schema([SCHEMA.field(name) if name in SCHEMA.names else table.schema.field(name)
+                                  for name in table.column_names]))
+    pq.write_to_dataset(
+        table,
+        store_path,
+        partition_cols=[PARTITION_COLUMN],
+        basename_template=f'part-{uuid.uuid4().hex}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        use_dictionary=DICTIONARY_COLUMNS,
+        compression='zstd',
+    )
+
+
+def convert(csv_path='analytics.csv', store_path=STORE_PATH, chunk_size=CHUNK_SIZE, if_exists='fail'):
+    """Convert a csv export into the store, chunk by chunk to keep memory flat.
+
+    A store that already has data is left alone unless `if_exists` is 'replace' (it is
+    deleted first, with its fetch watermark) or 'append' (the rows are added, so converting
+    the same export twice stores every event twice).
+    """
+    if if_exists not in ('fail', 'replace', 'append'):
+        raise ValueError(f"Unknown if_exists {if_exists!r}")
+    if os.path.isdir(store_path) and os.listdir(store_path):
+        if if_exists == 'fail':
+            raise ValueError(f"Store {store_path} is not empty, replace or append to it explicitly")
+        if if_exists == 'replace':
+            shutil.rmtree(store_path)
+    rows = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        append(chunk, store_path)
+        rows += len(chunk)
+    return rows
+
+
+def read_watermark(path=STORE_PATH):
+    """Progress marker of an incremental job (fetch, rollup) kept next to its data."""
+    try:
+        with open(os.path.join(path, WATERMARK_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_watermark(watermark, path=STORE_PATH):
+    os.makedirs(path, exist_ok=True)
+    file_path = os.path.join(path, WATERMARK_FILE)
+    with open(file_path + '.tmp', 'w') as file:
+        json.dump(watermark, file)
+    os.replace(file_path + '.tmp', file_path)
+
+
+def dataset(store_path=STORE_PATH):
+    return ds.dataset(store_path, format='parquet', partitioning='hive')
+
+
+def to_utc(value):
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
+
+
+def build_filter(types=None, start=None, end=None, users=None, sessions=None):
+    conditions = []
+    if types is not None:
+        conditions.append(ds.field('type').isin(list(types)))
+    if users is not None:
+        conditions.append(ds.field('user_id').isin(list(users)))
+    if sessions is not None:
+        conditions.append(ds.field('session_id').isin(list(sessions)))
+    if start is not None:
+        start = to_utc(start)
+        # The day partition lets whole directories be skipped
+        conditions.append(ds.field(PARTITION_COLUMN) >= start.strftime('%Y-%m-%d'))
+        conditions.append(ds.field('created_at') >= pa.scalar(start.to_pydatetime(), pa.timestamp('ns', 'UTC')))
+    if end is not None:
+        end = to_utc(end)
+        conditions.append(ds.field(PARTITION_COLUMN) <= end.strftime('%Y-%m-%d'))
+        conditions.append(ds.field('created_at') < pa.scalar(end.to_pydatetime(), pa.timestamp('ns', 'UTC')))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def load(store_path=STORE_PATH, columns=None, types=None, start=None, end=None, users=None, sessions=None):
+    """Load events from the store.
+
+    `columns` selects the columns to read, `types` the event types, `start`/`end`
+    a created_at range (end exclusive) and `users`/`sessions` specific ids.
+    """
+    table = dataset(store_path).to_table(
+        columns=columns,
+        filter=build_filter(types, start, end, users, sessions),
+    )
+    df = table.to_pandas()
+    if columns is None and PARTITION_COLUMN in df.columns:
+        df = df.drop(columns=[PARTITION_COLUMN])
+    if 'created_at' in df.columns:
+        df = df.sort_values('created_at', kind='stable').reset_index(drop=True)
+    return df
+
+
+def load_events(source=None, columns=None, types=None, start=None, end=None, users=None, sessions=None):
+    """Shared entry point for the notebooks: a DataFrame is passed through, a csv path is
+    read and parsed like the notebooks did, anything else is loaded from the store.
+    The filters of `load` apply to all three."""
+    if isinstance(source, pd.DataFrame):
+        df = source
+    elif isinstance(source, str) and source.endswith('.csv'):
+        df = pd.read_csv(source, usecols=columns)
+    else:
+        return load(source or STORE_PATH, columns, types, start, end, users, sessions)
+
+    if 'created_at' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['created_at']):
+        df = df.assign(created_at=pd.to_datetime(df['created_at'], format='ISO8601', utc=True))
+
+    mask = pd.Series(True, index=df.index)
+    if types is not None:
+        mask &= df['type'].isin(list(types))
+    if users is not None:
+        mask &= df['user_id'].isin(list(users))
+    if sessions is not None:
+        mask &= df['session_id'].isin(list(sessions))
+    if start is not None:
+        mask &= df['created_at'] >= to_utc(start)
+    if end is not None:
+        mask &= df['created_at'] < to_utc(end)
+    return df if mask.all() else df[mask]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Columnar store for the analytics export")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help='convert a csv export into the store')
+    convert_parser.add_argument('csv', nargs='?', default='analytics.csv')
+    convert_parser.add_argument('--store', default=STORE_PATH)
+    existing = convert_parser.add_mutually_exclusive_group()
+    existing.add_argument('--overwrite', action='store_const', dest='if_exists', const='replace',
+                          help='delete the events already in the store first')
+    existing.add_argument('--append', action='store_const', dest='if_exists', const='append',
+                          help='add the events to the ones already in the store')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        rows = convert(args.csv, args.store, if_exists=args.if_exists or 'fail')
+        print(f"Converted {rows} events into {args.store}")
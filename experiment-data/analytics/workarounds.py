@@ -0,0 +1,72 @@
+# Work-around sessions over the whole dataset, with the same detector the catcher runs
+# on live events (catcher/patterns.py).
+#
+# Only the event types that appear in a pattern are read from the store, which leaves
+# a small fraction of the events, and those are fed through the detector once in
+# created_at order.
+#
+#   python -m analytics.workarounds analytics_store --output workarounds.jsonl
+#
+#   from analytics.workarounds import detect
+#   matches_df = detect(df)   # or 'analytics.csv' / 'analytics_store'
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from analytics.store import load_events
+from catcher.patterns import PATTERNS, Pattern, PatternDetector
+
+COLUMNS = ['session_id', 'user_id', 'type', 'payload', 'created_at']
+
+
+def detect(source, patterns=PATTERNS):
+    """One row per match: pattern, session_id, user_id, start, end and step_times."""
+    detector = PatternDetector(patterns)
+    df = load_events(source, columns=COLUMNS, types=sorted(detector.types))
+    df = df.dropna(subset=['created_at']).sort_values('created_at', kind='stable')
+
+    seconds = df['created_at'].to_numpy(dtype='datetime64[ns]').view(np.int64) / 1e9
+    columns = [df[column].astype(object).tolist() for column in ('session_id', 'user_id', 'type', 'payload')]
+    events = [
+        {'session_id': session_id, 'user_id': user_id, 'type': event_type, 'payload': payload, 'created_at': created_at}
+        for session_id, user_id, event_type, payload, created_at in zip(*columns, seconds.tolist())
+    ]
+    matches = detector.add_batch(events)
+
+    matches_df = pd.DataFrame(matches, columns=['pattern', 'session_id', 'user_id', 'start', 'end', 'step_times'])
+    for column in ('start', 'end'):
+        matches_df[column] = pd.to_datetime(matches_df[column], unit='s', utc=True)
+    matches_df['minutes'] = (matches_df['end'] - matches_df['start']).dt.total_seconds() / 60
+    return matches_df
+
+
+def print_session(df, session_id):
+    """The events of a session, like `printEvents` in work-around-sessions.ipynb."""
+    events = df[(df['session_id'] == session_id) & (df['type'] != 'time-spent')].sort_values('created_at')
+    for row in events.itertuples():
+        print(f"{str(row.created_at)[5:19]}    {row.type}   U{str(row.user_id)[:5]}, S{str(row.session_id)[:5]} - {row.url}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find sessions where the user worked around the modal")
+    parser.add_argument('source', nargs='?', default='analytics.csv', help='analytics export (csv) or columnar store folder')
+    parser.add_argument('--pattern', nargs='+', metavar='STEP',
+                        help="custom ordered pattern, e.g. enforce_wait_modal_shown active=false place-order")
+    parser.add_argument('--within', type=float, default=30, help='minutes for the custom pattern')
+    parser.add_argument('--output', help='file to write the matches to as JSON lines')
+    args = parser.parse_args()
+
+    patterns = [Pattern('custom', args.pattern, within=args.within * 60)] if args.pattern else PATTERNS
+    matches_df = detect(args.source, patterns)
+
+    print(f"{len(matches_df)} matches in {matches_df['session_id'].nunique()} sessions")
+    print(matches_df.groupby('pattern').agg(
+        matches=('session_id', 'size'),
+        sessions=('session_id', 'nunique'),
+        users=('user_id', 'nunique'),
+        median_minutes=('minutes', 'median'),
+    ).to_string())
+
+    if args.output:
+        matches_df.to_json(args.output, orient='records', lines=True, date_format='iso')
@@ -0,0 +1 @@
+# Building blocks for event-catcher.py: the ingestion queue and the on-disk event log.
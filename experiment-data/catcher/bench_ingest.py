@@ -0,0 +1,219 @@
+# Load generator and latency benchmark for a running event catcher.
+#
+# Generates synthetic extension traffic with the same fields as the analytics edge
+# function (type, url, payload, user_id, session_id, created_at) and fires it
+# concurrently at the catcher. Every worker replays the sessions of its own users in
+# order, like the extension does. The result is printed as JSON and can be saved and
+# compared against an earlier run to catch regressions.
+#
+#   python event-catcher.py &
+#   python -m catcher.bench_ingest --users 200 --workers 32 --output run.json
+#   python -m catcher.bench_ingest --users 200 --workers 32 --bulk 50 --baseline run.json
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from catcher.bench_wal import percentile
+
+# Rough event mix of the experiment, tuned with --mix
+DEFAULT_MIX = {
+    'page-view': 0.55,
+    'time-spent': 0.30,
+    'add-to-cart': 0.05,
+    'checkout': 0.04,
+    'enforce_wait_modal_shown': 0.03,
+    'place-order': 0.01,
+    'active': 0.02,
+}
+DOMAINS = ['zalando.dk', 'amazon.com', 'hm.com', 'boozt.com', 'temu.com',
+           'shein.com', 'elgiganten.dk', 'ikea.com', 'matas.dk', 'asos.com']
+PATHS = ['/', '/products/item', '/collections/sale', '/search', '/women/shoes']
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        event_type, weight = part.split('=')
+        mix[event_type.strip()] = float(weight)
+    return mix
+
+
+def make_event(event_type, domain, user_id, session_id, created_at, rng):
+    path = rng.choice(PATHS)
+    payload = None
+    if event_type == 'time-spent':
+        payload = {'duration': rng.randint(1_000, 600_000)}
+    elif event_type == 'checkout':
+        path = '/checkout'
+    elif event_type == 'enforce_wait_modal_shown':
+        path = '/checkout'
+        payload = {'permitExists': False, 'permitIsValid': False, 'timeUntilValid': 86_400_000}
+    elif event_type == 'place-order':
+        path = '/checkout/thank-you'
+        payload = [{'price': round(rng.uniform(5, 200), 2), 'quantity': rng.randint(1, 3)}
+                   for _ in range(rng.randint(1, 4))]
+    elif event_type == 'active':
+        payload = rng.random() < 0.8
+
+    return {
+        'type': event_type,
+        'url': domain + path,
+        'payload': json.dumps(payload),
+        'user_id': user_id,
+        'session_id': session_id,
+        'created_at': created_at.isoformat().replace('+00:00', 'Z'),
+    }
+
+
+def generate_traffic(users, sessions_per_user, session_length, mix, seed):
+    """Returns one list of events per user, ordered by time."""
+    rng = random.Random(seed)
+    types = list(mix)
+    weights = [mix[event_type] for event_type in types]
+    start = datetime.now(timezone.utc)
+
+    traffic = []
+    for _ in range(users):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        events = []
+        created_at = start
+        for _ in range(max(1, round(rng.expovariate(1 / sessions_per_user)))):
+            session_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            domain = rng.choice(DOMAINS)
+            # Geometric session lengths with the given mean
+            length = 1
+            while rng.random() > 1 / session_length:
+                length += 1
+            for event_type in rng.choices(types, weights, k=length):
+                created_at += timedelta(seconds=rng.expovariate(1 / 20))
+                events.append(make_event(event_type, domain, user_id, session_id, created_at, rng))
+            created_at += timedelta(hours=rng.expovariate(1 / 12))
+        traffic.append(events)
+    return traffic
+
+
+def run(url, traffic, workers, bulk, timeout):
+    target = urlsplit(url)
+    path = target.path.rstrip('/') + ('/endpoint/bulk' if bulk else '/endpoint')
+
+    # Every worker owns a fixed set of users, so a session is always sent in order
+    assignments = [[] for _ in range(workers)]
+    for i, events in enumerate(traffic):
+        assignments[i % workers].extend(events)
+
+    latencies = [[] for _ in range(workers)]
+    statuses = [Counter() for _ in range(workers)]
+
+    def work(worker):
+        connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=timeout)
+        events = assignments[worker]
+        step = bulk or 1
+        for i in range(0, len(events), step):
+            body = json.dumps(events[i:i + step] if bulk else events[i]).encode('utf-8')
+            start = time.perf_counter()
+            try:
+                connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=timeout)
+            latencies[worker].append(time.perf_counter() - start)
+            statuses[worker][status] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_latencies = sorted(latency for worker in latencies for latency in worker)
+    all_statuses = sum(statuses, Counter())
+    requests = len(all_latencies)
+    events = sum(len(events) for events in traffic)
+    errors = requests - all_statuses.get(200, 0)
+
+    return {
+        'url': f'{target.scheme}://{target.netloc}{path}',
+        'workers': workers,
+        'bulk': bulk,
+        'events': events,
+        'requests': requests,
+        'seconds': round(elapsed, 3),
+        'events_per_sec': round(events / elapsed, 1),
+        'requests_per_sec': round(requests / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(all_latencies, 50) * 1000, 3),
+            'p95': round(percentile(all_latencies, 95) * 1000, 3),
+            'p99': round(percentile(all_latencies, 99) * 1000, 3),
+            'max': round(all_latencies[-1] * 1000, 3) if all_latencies else 0.0,
+        },
+        'error_rate': round(errors / requests, 5) if requests else 0.0,
+        'statuses': {str(status): n for status, n in sorted(all_statuses.items(), key=str)},
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Returns the regressions of `result` against `baseline` as readable strings."""
+    regressions = []
+    if result['events_per_sec'] < baseline['events_per_sec'] * (1 - tolerance):
+        regressions.append(f"throughput {result['events_per_sec']} < {baseline['events_per_sec']} events/sec")
+    for q in ('p50', 'p95', 'p99'):
+        if result['latency_ms'][q] > baseline['latency_ms'][q] * (1 + tolerance):
+            regressions.append(f"{q} latency {result['latency_ms'][q]} > {baseline['latency_ms'][q]} ms")
+    if result['error_rate'] > baseline['error_rate']:
+        regressions.append(f"error rate {result['error_rate']} > {baseline['error_rate']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fire synthetic analytics traffic at the event catcher")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--sessions', type=float, default=5, help='mean sessions per user')
+    parser.add_argument('--session-length', type=float, default=20, help='mean events per session')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='event type weights, e.g. page-view=0.7,time-spent=0.3')
+    parser.add_argument('--workers', type=int, default=16, help='concurrent connections')
+    parser.add_argument('--bulk', type=int, default=0, help='events per request to /endpoint/bulk (0 = single events)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the result to this file')
+    parser.add_argument('--baseline', help='result of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative regression')
+    args = parser.parse_args()
+
+    traffic = generate_traffic(args.users, args.sessions, args.session_length, args.mix, args.seed)
+    result = run(args.url, traffic, args.workers, args.bulk, args.timeout)
+    result['config'] = {'users': args.users, 'sessions': args.sessions,
+                        'session_length': args.session_length, 'mix': args.mix, 'seed': args.seed}
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            result['regressions'] = compare(result, json.load(file), args.tolerance)
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+
+    if result.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
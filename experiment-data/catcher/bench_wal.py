@@ -0,0 +1,85 @@
+# Benchmark of the group commit log for different commit intervals.
+#
+# Every producer thread plays a request handler: it queues one event and waits for the
+# acknowledgement before sending the next. Reports events/sec and ack latencies per
+# commit interval as JSON.
+#
+#   python -m catcher.bench_wal --producers 32 --events 200 --intervals 0 1 5 10 50
+import argparse
+import json
+import tempfile
+import threading
+import time
+
+from catcher.ingest import IngestQueue
+from catcher.segment_log import SegmentedLog
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(interval_ms, producers, events_per_producer, max_events, durable=True):
+    with tempfile.TemporaryDirectory() as directory:
+        ingest = IngestQueue(SegmentedLog(directory), batch_size=max_events,
+                             batch_wait=interval_ms / 1000, durable=durable)
+        batches = []
+        ingest.add_listener(lambda batch: batches.append(len(batch)))
+        ingest.start()
+
+        latencies = [[] for _ in range(producers)]
+
+        def produce(worker):
+            for i in range(events_per_producer):
+                event = {"type": "page-view", "url": "example.com/", "user_id": f"u{worker}",
+                         "session_id": f"s{worker}", "created_at": str(i)}
+                start = time.perf_counter()
+                ingest.put([event]).wait()
+                latencies[worker].append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=produce, args=(worker,)) for worker in range(producers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        ingest.stop()
+
+    all_latencies = sorted(latency for worker in latencies for latency in worker)
+    return {
+        "commit_interval_ms": interval_ms,
+        "commit_max_events": max_events,
+        "durable": durable,
+        "events": len(all_latencies),
+        "commits": len(batches),
+        "events_per_sec": round(len(all_latencies) / elapsed, 1),
+        "ack_p50_ms": round(percentile(all_latencies, 50) * 1000, 3),
+        "ack_p99_ms": round(percentile(all_latencies, 99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark group commit intervals of the event log")
+    parser.add_argument("--producers", type=int, default=32)
+    parser.add_argument("--events", type=int, default=200, help="events per producer")
+    parser.add_argument("--intervals", type=float, nargs="+", default=[0, 1, 5, 10, 50],
+                        help="commit intervals in ms")
+    parser.add_argument("--max-events", type=int, default=1000, help="events per commit")
+    args = parser.parse_args()
+
+    results = []
+    # Baseline: one fsync per event
+    results.append(run(0, args.producers, args.events, max_events=1))
+    for interval in args.intervals:
+        results.append(run(interval, args.producers, args.events, args.max_events))
+    # Upper bound: no fsync at all
+    results.append(run(0, args.producers, args.events, args.max_events, durable=False))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
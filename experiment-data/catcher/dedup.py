@@ -0,0 +1,72 @@
+# Idempotent ingestion: drop events that were already received within a time window.
+#
+# The extension retries analytics posts on flaky connections, and without this a
+# retried add-to-cart or place-order would be counted twice. Every event gets a key,
+# either the `idempotency_key` sent by the client or a hash of the fields that identify
+# it. Keys live in an insertion ordered LRU that forgets keys after `window` seconds
+# and never holds more than `max_keys`, so the check is O(1) with bounded memory.
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+KEY_FIELDS = ("user_id", "session_id", "type", "created_at", "url")
+
+
+def event_key(event, client_key=None):
+    client_key = client_key or event.get("idempotency_key")
+    if client_key:
+        value = f"client\x1f{client_key}"
+    else:
+        value = "\x1f".join(str(event.get(field)) for field in KEY_FIELDS)
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+
+
+class DedupCache:
+    def __init__(self, window=24 * 60 * 60, max_keys=200_000):
+        self.window = window
+        self.max_keys = max_keys
+        self.keys = OrderedDict()  # key -> time it was first seen
+        self.lock = threading.Lock()
+
+    def seen(self, key, now=None):
+        """Returns True if `key` was seen within the window, otherwise remembers it."""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._expire(now)
+            if key in self.keys:
+                return True
+            self.keys[key] = now
+            if len(self.keys) > self.max_keys:
+                self.keys.popitem(last=False)
+            return False
+
+    def forget(self, keys):
+        """Undo `seen` for events that could not be stored, so a retry is accepted."""
+        with self.lock:
+            for key in keys:
+                self.keys.pop(key, None)
+
+    def forget_on_failure(self, commit, keys):
+        """For a write whose acknowledgement timed out: it can still succeed, then a retry
+        is a duplicate, so the keys are only forgotten once the ingest `commit` fails."""
+        commit.on_done(lambda error: error is not None and self.forget(keys))
+
+    def add_batch(self, events):
+        # Used to warm the cache from the replayed event log
+        for event in events:
+            received_at = event.get("received_at")
+            try:
+                now = datetime.fromisoformat(received_at).timestamp()
+            except (TypeError, ValueError):
+                now = None
+            self.seen(event_key(event), now)
+
+    def _expire(self, now):
+        keys = self.keys
+        while keys:
+            key, first_seen = next(iter(keys.items()))
+            if now - first_seen < self.window:
+                return
+            del keys[key]
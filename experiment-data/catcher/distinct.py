@@ -0,0 +1,225 @@
+# Approximate distinct counting of users and sessions with HyperLogLog sketches.
+#
+# A sketch uses 2^p one byte registers, so memory does not depend on how many ids are
+# seen. The relative standard error is about 1.04 / sqrt(2^p). Sketches with the same
+# precision can be merged, which lets several catcher processes be combined.
+#
+# At the default error `DistinctCounters` holds two 4096 register sketches, 8 KB. The
+# per-day and per-domain counts are opt-in (`keyed=True`): they add two 512 register
+# sketches for each of at most MAX_DAYS days and MAX_DOMAINS + 1 domains, up to about
+# 270 KB more.
+import base64
+import hashlib
+import math
+import threading
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+# The per-day and per-domain sketches are coarser and their number is capped,
+# which keeps the total size of `DistinctCounters` bounded
+KEYED_ERROR = 0.05
+MAX_DAYS = 62
+MAX_DOMAINS = 200
+OTHER_DOMAINS = "(other)"
+
+
+def precision_for_error(error):
+    m = (1.04 / error) ** 2
+    return min(MAX_PRECISION, max(MIN_PRECISION, math.ceil(math.log2(m))))
+
+
+def hash64(value):
+    # Ids are not type checked at ingest, a numeric user_id counts like its string
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    def __init__(self, error=0.02, p=None):
+        self.p = p if p is not None else precision_for_error(error)
+        self.m = 1 << self.p
+        self.registers = bytearray(self.m)
+        # Kept up to date on every register change so `count` is O(1)
+        self.inverse_sum = float(self.m)
+        self.zeros = self.m
+
+    @property
+    def error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, value):
+        h = hash64(value)
+        bits = 64 - self.p
+        index = h >> bits
+        rest = h & ((1 << bits) - 1)
+        rank = bits - rest.bit_length() + 1
+
+        old = self.registers[index]
+        if rank > old:
+            self._set(index, old, rank)
+
+    def count(self):
+        m = self.m
+        estimate = self._alpha() * m * m / self.inverse_sum
+        if estimate <= 2.5 * m and self.zeros:
+            # Small range correction (linear counting)
+            estimate = m * math.log(m / self.zeros)
+        return round(estimate)
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError(f"Cannot merge sketches with precision {self.p} and {other.p}")
+        for index, rank in enumerate(other.registers):
+            old = self.registers[index]
+            if rank > old:
+                self._set(index, old, rank)
+
+    def to_dict(self):
+        return {"p": self.p, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(p=data["p"])
+        sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        sketch.inverse_sum = sum(2.0 ** -rank for rank in sketch.registers)
+        sketch.zeros = sketch.registers.count(0)
+        return sketch
+
+    def _set(self, index, old, rank):
+        self.registers[index] = rank
+        self.inverse_sum += 2.0 ** -rank - 2.0 ** -old
+        if old == 0:
+            self.zeros -= 1
+
+    def _alpha(self):
+        if self.m == 16:
+            return 0.673
+        if self.m == 32:
+            return 0.697
+        if self.m == 64:
+            return 0.709
+        return 0.7213 / (1 + 1.079 / self.m)
+
+
+def event_day(event):
+    created_at = event.get("created_at") or event.get("received_at") or ""
+    return created_at[:10]
+
+
+def event_domain(event):
+    host = (event.get("url") or "").split("/")[0].lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class DistinctCounters:
+    """Distinct users and sessions in total, and per day and per domain with `keyed`."""
+
+    def __init__(self, error=0.02, keyed_error=KEYED_ERROR, keyed=False):
+        self.error = error
+        self.keyed_error = keyed_error
+        self.keyed = keyed
+        self.users = HyperLogLog(error)
+        self.sessions = HyperLogLog(error)
+        self.days = {}
+        self.domains = {}
+        self.lock = threading.Lock()
+
+    def add(self, event):
+        with self.lock:
+            self._add(event)
+
+    def add_batch(self, events):
+        with self.lock:
+            for event in events:
+                self._add(event)
+
+    def totals(self):
+        return {"users": self.users.count(), "sessions": self.sessions.count()}
+
+    def summary(self):
+        with self.lock:
+            return {
+                **self.totals(),
+                "error": round(self.users.error, 4),
+                "keyed_error": round(HyperLogLog(self.keyed_error).error, 4) if self.keyed else None,
+                "days": {day: self._counts(pair) for day, pair in sorted(self.days.items())},
+                "domains": {domain: self._counts(pair) for domain, pair in sorted(self.domains.items())},
+            }
+
+    def merge(self, other):
+        with self.lock:
+            self.users.merge(other.users)
+            self.sessions.merge(other.sessions)
+            if not self.keyed:
+                return
+            for day, (users, sessions) in other.days.items():
+                pair = self._keyed(self.days, day, MAX_DAYS, keep_latest=True)
+                if pair is not None:
+                    pair[0].merge(users)
+                    pair[1].merge(sessions)
+            for domain, (users, sessions) in other.domains.items():
+                pair = self._keyed(self.domains, domain, MAX_DOMAINS)
+                pair[0].merge(users)
+                pair[1].merge(sessions)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "error": self.error,
+                "keyed_error": self.keyed_error,
+                "keyed": self.keyed,
+                "users": self.users.to_dict(),
+                "sessions": self.sessions.to_dict(),
+                "days": {day: [s.to_dict() for s in pair] for day, pair in self.days.items()},
+                "domains": {domain: [s.to_dict() for s in pair] for domain, pair in self.domains.items()},
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        counters = cls(data["error"], data["keyed_error"], data.get("keyed", bool(data["days"] or data["domains"])))
+        counters.users = HyperLogLog.from_dict(data["users"])
+        counters.sessions = HyperLogLog.from_dict(data["sessions"])
+        for day, pair in data["days"].items():
+            counters.days[day] = [HyperLogLog.from_dict(s) for s in pair]
+        for domain, pair in data["domains"].items():
+            counters.domains[domain] = [HyperLogLog.from_dict(s) for s in pair]
+        return counters
+
+    def _add(self, event):
+        user_id = event["user_id"]
+        session_id = event["session_id"]
+        self.users.add(user_id)
+        self.sessions.add(session_id)
+        if not self.keyed:
+            return
+
+        for pair in (self._keyed(self.days, event_day(event), MAX_DAYS, keep_latest=True),
+                     self._keyed(self.domains, event_domain(event), MAX_DOMAINS)):
+            if pair is not None:
+                pair[0].add(user_id)
+                pair[1].add(session_id)
+
+    def _keyed(self, sketches, key, limit, keep_latest=False):
+        pair = sketches.get(key)
+        if pair is not None:
+            return pair
+
+        if len(sketches) >= limit:
+            if not keep_latest:
+                # Domains past the limit share a single sketch
+                key = OTHER_DOMAINS
+                pair = sketches.get(key)
+                if pair is not None:
+                    return pair
+            else:
+                # Only the most recent days are kept, late events for dropped days are ignored
+                oldest = min(sketches)
+                if key < oldest:
+                    return None
+                del sketches[oldest]
+
+        pair = sketches[key] = [HyperLogLog(self.keyed_error), HyperLogLog(self.keyed_error)]
+        return pair
+
+    def _counts(self, pair):
+        return {"users": pair[0].count(), "sessions": pair[1].count()}
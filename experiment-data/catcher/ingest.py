@@ -0,0 +1,154 @@
+# Ingestion queue for the event catcher.
+#
+# Request handlers only put parsed events on the queue. A single background writer
+# drains the queue in batches, appends each batch to the segmented log and hands it to
+# the registered listeners (console echo, counters, ...). The queue is bounded, so when
+# the writer falls behind the handlers block instead of events being dropped.
+#
+# With `durable=True` the log works as a write-ahead log with group commit: every batch
+# (at most `batch_size` events, or whatever arrived within `batch_wait` seconds) is made
+# durable with a single fsync, and `put` returns a `Commit` that is only marked done
+# after that fsync. On restart `recover` replays the log into the listeners.
+import json
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class Commit:
+    """Acknowledgement for a group of queued events."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.error = None
+
+    def wait(self, timeout=None):
+        """Returns True once the events are written (and synced when durable)."""
+        return self._done.wait(timeout) and self.error is None
+
+    def on_done(self, callback):
+        """Call `callback(error)` once the write finished, right away if it already did.
+        `error` is None when the events were written."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self.error)
+
+    def _resolve(self, error=None):
+        with self._lock:
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(error)
+
+
+class IngestQueue:
+    def __init__(self, log, max_pending=10_000, batch_size=1000, batch_wait=0.05, durable=False):
+        self.log = log
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.durable = durable
+        self.listeners = []
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = None
+
+    def add_listener(self, listener, replay=True, live=True):
+        """`listener` is called from the writer thread with every written batch of events.
+        With `replay=True` it also receives the events replayed by `recover`, with
+        `live=False` it only receives those."""
+        self.listeners.append((listener, replay, live))
+
+    def recover(self, batch_size=1000):
+        """Feed every event already in the log to the replay listeners. Call before `start`."""
+        replayed = 0
+        for batch in self.log.replay(batch_size):
+            replayed += len(batch)
+            self._notify(batch, replaying=True)
+        return replayed
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self.thread.start()
+
+    def put(self, events):
+        """Queue a list of events. Blocks while the queue is full."""
+        commit = Commit()
+        if events:
+            self.queue.put((events, commit))
+        else:
+            commit._resolve()
+        return commit
+
+    def stop(self):
+        """Write everything still queued and close the log."""
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join()
+            self.thread = None
+        self.log.close()
+
+    def _run(self):
+        while True:
+            batch, commits, stopping = self._next_batch()
+            if batch:
+                self._write(batch, commits)
+            if stopping:
+                return
+
+    def _next_batch(self):
+        # Block for the first item, then keep collecting until the batch is full
+        # or `batch_wait` has passed since the first item arrived
+        item = self.queue.get()
+        if item is _STOP:
+            return [], [], True
+
+        events, commit = item
+        batch = list(events)
+        commits = [commit]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, commits, True
+            events, commit = item
+            batch.extend(events)
+            commits.append(commit)
+        return batch, commits, False
+
+    def _write(self, batch, commits):
+        try:
+            self.log.append([json.dumps(event, separators=(",", ":")).encode("utf-8") for event in batch])
+            if self.durable:
+                self.log.sync()
+            else:
+                self.log.flush()
+        except OSError as e:
+            print("Failed to write batch:", e)
+            for commit in commits:
+                commit._resolve(e)
+            return
+
+        for commit in commits:
+            commit._resolve()
+        self._notify(batch)
+
+    def _notify(self, batch, replaying=False):
+        for listener, replay, live in self.listeners:
+            if not (replay if replaying else live):
+                continue
+            try:
+                listener(batch)
+            except Exception as e:
+                print("Ingest listener failed:", e)
@@ -0,0 +1,109 @@
+# Low overhead request metrics for the event catcher, rendered in the Prometheus text format.
+#
+# Histograms have fixed bucket bounds, so recording a value is a bisect and two additions.
+# Labels are capped (`MAX_LABELS`), clients cannot grow the registry without limit.
+import threading
+from bisect import bisect_left
+
+# Seconds, from 10 microseconds up to 10 seconds
+TIME_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes, powers of four from 16 B up to 4 MB
+SIZE_BUCKETS = tuple(16 * 4 ** i for i in range(10))
+
+MAX_LABELS = 64
+OTHER_LABEL = "other"
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # The last bucket is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}  # (name, label value) -> Histogram
+        self.help = {}  # name -> (help, label name, bounds)
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # name -> (help, function)
+        self.label_values = {}  # name -> set of label values seen
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help, label, bounds=TIME_BUCKETS):
+        self.help[name] = (help, label, bounds)
+
+    def gauge(self, name, help, function):
+        """`function` is called when the metrics are rendered."""
+        self.gauges[name] = (help, function)
+
+    def observe(self, name, label_value, value):
+        with self.lock:
+            key = (name, self._label(name, str(label_value)))
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.help[name][2])
+            histogram.observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help, label, bounds) in self.help.items():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} histogram")
+                for (key_name, label_value), histogram in sorted(self.histograms.items()):
+                    if key_name != name:
+                        continue
+                    labels = f'{label}="{escape(label_value)}"'
+                    cumulative = 0
+                    for bound, count in zip(bounds + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+                    lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE {name} counter")
+                for (key_name, labels), value in sorted(self.counters.items()):
+                    if key_name == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for name, (help, function) in self.gauges.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {function()}")
+        return "\n".join(lines) + "\n"
+
+    def _label(self, name, value):
+        seen = self.label_values.setdefault(name, set())
+        if value in seen:
+            return value
+        if len(seen) >= MAX_LABELS:
+            return OTHER_LABEL
+        seen.add(value)
+        return value
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
@@ -0,0 +1,180 @@
+# Detection of work-around sessions, e.g. the modal was shown and the user then turned
+# the extension off.
+#
+# A pattern is an ordered list of steps (an event type, optionally with a payload)
+# that must all happen in one session within `within` seconds of the first step. The
+# detector makes a single pass over time-ordered events and keeps, per live session
+# and pattern, the latest starting partial match that reached each step. An
+# event that matches step k extends the partial match of step k - 1, so a match is
+# found whenever the steps occur in order within the window, whatever else happens in
+# between. A completed match is written as one compact JSON line and the session
+# starts over for that pattern.
+#
+# The same detector runs as a listener on the catcher's ingest queue and as a batch job
+# over the columnar store (analytics/workarounds.py).
+import json
+import threading
+import time
+
+from catcher.sessions import SESSION_TIMEOUT, SWEEP_INTERVAL, parse_time
+
+ANY = object()
+
+
+def decode_payload(payload):
+    # The extension sends the payload JSON encoded
+    if isinstance(payload, str):
+        try:
+            return json.loads(payload)
+        except ValueError:
+            pass
+    return payload
+
+
+def event_time(value):
+    # Batch jobs pass epoch seconds, the catcher ISO strings
+    return float(value) if isinstance(value, (int, float)) else parse_time(value)
+
+
+class Step:
+    __slots__ = ('type', 'payload')
+
+    def __init__(self, type, payload=ANY):
+        self.type = type
+        self.payload = payload
+
+    @classmethod
+    def parse(cls, text):
+        """'active=false' is an `active` event with payload false, 'place-order' any payload."""
+        event_type, sep, payload = text.partition('=')
+        return cls(event_type, json.loads(payload) if sep else ANY)
+
+    def matches(self, event_type, payload):
+        return event_type == self.type and (self.payload is ANY or payload == self.payload)
+
+    def __str__(self):
+        return self.type if self.payload is ANY else f'{self.type}={json.dumps(self.payload)}'
+
+
+class Pattern:
+    def __init__(self, name, steps, within=30 * 60):
+        self.name = name
+        self.steps = [step if isinstance(step, Step) else Step.parse(step) for step in steps]
+        self.within = within
+        self.types = {step.type for step in self.steps}
+
+
+# place-order is only sent while the extension is active, so after a deactivate it
+# only shows up when the user turned the extension back on before buying
+PATTERNS = [
+    Pattern('modal_then_deactivate', ['enforce_wait_modal_shown', 'active=false'], within=30 * 60),
+    Pattern('deactivate_and_reactivate', ['enforce_wait_modal_shown', 'active=false', 'active=true'], within=60 * 60),
+    Pattern('deactivate_then_purchase', ['enforce_wait_modal_shown', 'active=false', 'place-order'], within=60 * 60),
+]
+
+
+class PatternState:
+    __slots__ = ('partial', 'last_received')
+
+    def __init__(self, patterns):
+        # partial[p][k]: step times of the latest starting partial match of pattern p up to step k
+        self.partial = [[None] * len(pattern.steps) for pattern in patterns]
+        self.last_received = 0.0
+
+
+class PatternDetector:
+    def __init__(self, patterns=PATTERNS, match_path=None, idle_timeout=SESSION_TIMEOUT):
+        self.patterns = list(patterns)
+        self.types = set().union(*(pattern.types for pattern in self.patterns))
+        # Only these need their payload decoded
+        self.payload_types = {step.type for pattern in self.patterns for step in pattern.steps if step.payload is not ANY}
+        # A session is kept at least as long as its longest pattern window
+        self.idle_timeout = max([idle_timeout] + [pattern.within for pattern in self.patterns])
+        self.live = {}
+        self.match_counts = {pattern.name: 0 for pattern in self.patterns}
+        # Event time: the latest received_at seen, as in the Sessionizer. Idleness is judged
+        # by it rather than the wall clock, so replaying an old log does not evict sessions
+        # halfway, and not by created_at, which the client sets: one event with its clock
+        # ahead would evict every other session's partial matches
+        self.clock = 0.0
+        self.last_sweep = 0.0
+        self.lock = threading.Lock()
+        # Like the session summaries, the matches are rebuilt from the replayed log on every start
+        self.match_file = open(match_path, 'w', encoding='utf-8') if match_path else None
+
+    def add_batch(self, events):
+        """Feed a batch of events, returns the matches they completed."""
+        with self.lock:
+            matches = []
+            for event in events:
+                matches.extend(self._add(event))
+            if self.match_file is not None and matches:
+                for match in matches:
+                    self.match_file.write(json.dumps(match, separators=(',', ':')) + '\n')
+                self.match_file.flush()
+            if time.time() - self.last_sweep >= SWEEP_INTERVAL:
+                self._sweep(self.clock)
+            return matches
+
+    def sweep(self, now=None):
+        # By the wall clock unless `now` is given, for sessions that went quiet
+        with self.lock:
+            self._sweep(time.time() if now is None else now)
+
+    def stats(self):
+        with self.lock:
+            return {'live': len(self.live), **self.match_counts}
+
+    def close(self):
+        with self.lock:
+            if self.match_file is not None:
+                self.match_file.close()
+
+    def _add(self, event):
+        event_type = event.get('type')
+        if event_type not in self.types:
+            return []
+        session_id = event.get('session_id')
+        created_at = event_time(event.get('created_at'))
+        if not session_id or session_id == 'none' or created_at is None:
+            return []
+
+        state = self.live.get(session_id)
+        if state is None:
+            state = self.live[session_id] = PatternState(self.patterns)
+        state.last_received = event_time(event.get('received_at')) or time.time()
+        self.clock = max(self.clock, state.last_received)
+        payload = decode_payload(event.get('payload')) if event_type in self.payload_types else None
+
+        matches = []
+        for p, pattern in enumerate(self.patterns):
+            partial = state.partial[p]
+            # From the last step back, so one event never fills two steps
+            for k in range(len(pattern.steps) - 1, -1, -1):
+                if not pattern.steps[k].matches(event_type, payload):
+                    continue
+                if k == 0:
+                    partial[0] = [created_at]
+                elif partial[k - 1] is not None and created_at - partial[k - 1][0] <= pattern.within:
+                    # Keep the latest start, it leaves the most time for the remaining steps
+                    if partial[k] is None or partial[k - 1][0] >= partial[k][0]:
+                        partial[k] = partial[k - 1] + [created_at]
+
+            if partial[-1] is not None:
+                matches.append({
+                    'pattern': pattern.name,
+                    'session_id': session_id,
+                    'user_id': event.get('user_id'),
+                    'start': partial[-1][0],
+                    'end': partial[-1][-1],
+                    'step_times': partial[-1],
+                })
+                self.match_counts[pattern.name] += 1
+                state.partial[p] = [None] * len(pattern.steps)
+        return matches
+
+    def _sweep(self, now):
+        self.last_sweep = time.time()
+        idle = [session_id for session_id, state in self.live.items() if now - state.last_received >= self.idle_timeout]
+        for session_id in idle:
+            del self.live[session_id]
@@ -0,0 +1,105 @@
+# Append-only event log split into JSONL segments.
+#
+# A new segment is started when the current one grows past `max_bytes` or gets
+# older than `max_age` seconds. Closed segments are never written to again, so they
+# can be copied or loaded by the notebooks while the catcher is still running.
+# Rotation is checked once per batch, so a segment can overshoot by at most one batch.
+import json
+import os
+import re
+import time
+
+SEGMENT_PATTERN = re.compile(r"^(?P<prefix>.+)-(?P<seq>\d{6})\.jsonl$")
+
+
+class SegmentedLog:
+    def __init__(self, directory, prefix="events", max_bytes=64 * 1024 * 1024, max_age=60 * 60):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self.file = None
+        self.size = 0
+        self.opened_at = 0.0
+        self.new_segment = False
+
+        os.makedirs(directory, exist_ok=True)
+        existing = self.segments()
+        # Never reopen an old segment, always continue with the next sequence number
+        self.seq = self._seq_of(existing[-1]) + 1 if existing else 0
+
+    def segments(self):
+        names = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match and match.group("prefix") == self.prefix:
+                names.append(name)
+        return [os.path.join(self.directory, name) for name in sorted(names)]
+
+    def append(self, lines):
+        """Write a batch of already encoded lines (bytes, without newline)."""
+        if not lines:
+            return
+        if self.file is None or self._should_rotate():
+            self.rotate()
+
+        data = b"\n".join(lines) + b"\n"
+        self.file.write(data)
+        self.size += len(data)
+
+    def rotate(self):
+        self.close()
+        path = os.path.join(self.directory, f"{self.prefix}-{self.seq:06d}.jsonl")
+        self.file = open(path, "ab")
+        self.size = 0
+        self.opened_at = time.monotonic()
+        self.seq += 1
+        self.new_segment = True
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def sync(self):
+        """Flush and fsync the current segment, so everything appended so far survives a crash."""
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.new_segment:
+            # The directory entry of a new segment has to be synced as well
+            fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.new_segment = False
+
+    def replay(self, batch_size=1000):
+        """Yield the logged events of all existing segments in write order, in batches."""
+        batch = []
+        for path in self.segments():
+            with open(path, "rb") as file:
+                for line in file:
+                    try:
+                        batch.append(json.loads(line))
+                    except ValueError:
+                        # A line torn by a crash, it was never acknowledged
+                        continue
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _should_rotate(self):
+        return self.size >= self.max_bytes or time.monotonic() - self.opened_at >= self.max_age
+
+    def _seq_of(self, path):
+        return int(SEGMENT_PATTERN.match(os.path.basename(path)).group("seq"))
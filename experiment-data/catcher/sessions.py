@@ -0,0 +1,151 @@
+# Streaming sessionizer for the event catcher.
+#
+# Keeps a small state machine per live session (start/end time and the funnel flags)
+# and updates it as events arrive. Sessions without new events for `idle_timeout`
+# seconds are evicted into a JSONL file with one summary per session. The number of
+# sessions per flag combination is maintained on every flag change, so questions like
+# "how many sessions saw the modal and purchased" are answered without a rescan.
+import json
+import threading
+import time
+from datetime import datetime
+
+# Same definitions as the notebooks (see data_X.ipynb and enhanced_comparison.ipynb)
+CHECKOUT_KEYWORDS = ('/checkout', '/cart', '/shoppingcart', '/bag', '/Basket')
+FLAG_TYPES = {
+    'add-to-cart': 'add_to_cart',
+    'checkout': 'checkout',
+    'enforce_wait_modal_shown': 'modal',
+    'place-order': 'purchase',
+}
+FLAGS = ('add_to_cart', 'checkout', 'modal', 'purchase')
+FLAG_BITS = {flag: 1 << i for i, flag in enumerate(FLAGS)}
+
+SESSION_TIMEOUT = 30 * 60  # seconds, same as the session split in data_X.ipynb
+SWEEP_INTERVAL = 5  # seconds
+
+
+def parse_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def event_flag(event):
+    flag = FLAG_TYPES.get(event['type'])
+    if flag is None and event['type'] == 'page-view':
+        url = event.get('url') or ''
+        if any(keyword in url for keyword in CHECKOUT_KEYWORDS):
+            flag = 'checkout'
+    return flag
+
+
+class SessionState:
+    __slots__ = ('session_id', 'user_id', 'start', 'end', 'events', 'mask', 'last_received')
+
+    def __init__(self, session_id, user_id):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.start = None
+        self.end = None
+        self.events = 0
+        self.mask = 0
+        self.last_received = 0.0
+
+    def summary(self):
+        return {
+            'session_id': self.session_id,
+            'user_id': self.user_id,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.end - self.start if self.start is not None else 0,
+            'events': self.events,
+            **{flag: bool(self.mask & bit) for flag, bit in FLAG_BITS.items()},
+        }
+
+
+class Sessionizer:
+    def __init__(self, summary_path, idle_timeout=SESSION_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.live = {}
+        # Number of sessions (live and evicted) per combination of flags
+        self.mask_counts = [0] * (1 << len(FLAGS))
+        # Event time: the latest received_at seen. The sweeps after a batch judge idleness
+        # by it, so replaying an old log in `recover` does not evict sessions halfway
+        self.clock = 0.0
+        self.last_sweep = 0.0
+        self.lock = threading.Lock()
+        # The summaries are rebuilt from the replayed event log on every start
+        self.summary_file = open(summary_path, 'w', encoding='utf-8')
+
+    def add_batch(self, events):
+        with self.lock:
+            for event in events:
+                self._add(event)
+            if time.time() - self.last_sweep >= SWEEP_INTERVAL:
+                self._sweep(self.clock)
+
+    def sweep(self, now=None):
+        # By the wall clock unless `now` is given, for sessions that went quiet
+        with self.lock:
+            self._sweep(time.time() if now is None else now)
+
+    def count(self, **flags):
+        """Number of sessions having (True) or lacking (False) each of the given flags."""
+        required = sum(FLAG_BITS[flag] for flag, value in flags.items() if value)
+        excluded = sum(FLAG_BITS[flag] for flag, value in flags.items() if not value)
+        return sum(n for mask, n in enumerate(self.mask_counts)
+                   if mask & required == required and not mask & excluded)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'sessions': sum(self.mask_counts),
+                'live': len(self.live),
+                **{flag: self.count(**{flag: True}) for flag in FLAGS},
+                'modal_and_purchase': self.count(modal=True, purchase=True),
+                'checkout_without_modal': self.count(checkout=True, modal=False),
+                'checkout_without_modal_and_purchase': self.count(checkout=True, modal=False, purchase=True),
+            }
+
+    def close(self):
+        with self.lock:
+            self.summary_file.close()
+
+    def _add(self, event):
+        session_id = event['session_id']
+        if not session_id or session_id == 'none':
+            return
+
+        state = self.live.get(session_id)
+        if state is None:
+            state = self.live[session_id] = SessionState(session_id, event['user_id'])
+            self.mask_counts[0] += 1
+
+        created_at = parse_time(event.get('created_at'))
+        if created_at is not None:
+            if state.start is None or created_at < state.start:
+                state.start = created_at
+            if state.end is None or created_at > state.end:
+                state.end = created_at
+        state.events += 1
+        state.last_received = parse_time(event.get('received_at')) or time.time()
+        self.clock = max(self.clock, state.last_received)
+
+        flag = event_flag(event)
+        if flag is not None:
+            mask = state.mask | FLAG_BITS[flag]
+            if mask != state.mask:
+                self.mask_counts[state.mask] -= 1
+                self.mask_counts[mask] += 1
+                state.mask = mask
+
+    def _sweep(self, now):
+        self.last_sweep = time.time()
+        idle = [state for state in self.live.values() if now - state.last_received >= self.idle_timeout]
+        for state in idle:
+            del self.live[state.session_id]
+            self.summary_file.write(json.dumps(state.summary(), separators=(',', ':')) + '\n')
+        if idle:
+            self.summary_file.flush()
@@ -1,8 +1,40 @@
+import atexit
 import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import logging
 
+from catcher.dedup import DedupCache, event_key
+from catcher.distinct import DistinctCounters
+from catcher.ingest import IngestQueue
+from catcher.metrics import SIZE_BUCKETS, Metrics
+from catcher.patterns import PatternDetector
+from catcher.segment_log import SegmentedLog
+from catcher.sessions import FLAGS, SESSION_TIMEOUT, Sessionizer
+
+LOG_DIR = os.getenv("CATCHER_LOG_DIR", "events")
+SEGMENT_MAX_BYTES = int(os.getenv("CATCHER_SEGMENT_MAX_BYTES", 64 * 1024 * 1024))
+SEGMENT_MAX_AGE = int(os.getenv("CATCHER_SEGMENT_MAX_AGE", 60 * 60))  # seconds
+ECHO_EVENTS = os.getenv("CATCHER_ECHO", "1") == "1"
+DISTINCT_ERROR = float(os.getenv("CATCHER_DISTINCT_ERROR", 0.02))
+# Per-day and per-domain distinct counts, up to about 270 KB more sketches
+DISTINCT_KEYED = os.getenv("CATCHER_DISTINCT_KEYED", "0") == "1"
+# Group commit: a batch is synced every COMMIT_INTERVAL_MS or every COMMIT_MAX_EVENTS events
+DURABLE = os.getenv("CATCHER_DURABLE", "1") == "1"
+COMMIT_INTERVAL_MS = float(os.getenv("CATCHER_COMMIT_INTERVAL_MS", 5))
+COMMIT_MAX_EVENTS = int(os.getenv("CATCHER_COMMIT_MAX_EVENTS", 1000))
+ACK_TIMEOUT = 10  # seconds
+DEDUP_WINDOW = int(os.getenv("CATCHER_DEDUP_WINDOW", 24 * 60 * 60))  # seconds
+DEDUP_MAX_KEYS = int(os.getenv("CATCHER_DEDUP_MAX_KEYS", 200_000))
+SESSION_IDLE_TIMEOUT = int(os.getenv("CATCHER_SESSION_IDLE_TIMEOUT", SESSION_TIMEOUT))  # seconds
+
+REQUIRED_KEYS = ("type", "url", "user_id", "session_id")
+BULK_LABEL = "(bulk)"
+
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)  # Only log errors, ignore regular requests
 
@@ -10,37 +42,206 @@ app = Flask(__name__)
 
 CORS(app, supports_credentials=True, origins="*", allow_headers="*", methods="*")
 
+ingest = IngestQueue(SegmentedLog(LOG_DIR, max_bytes=SEGMENT_MAX_BYTES, max_age=SEGMENT_MAX_AGE),
+                     batch_size=COMMIT_MAX_EVENTS,
+                     batch_wait=COMMIT_INTERVAL_MS / 1000,
+                     durable=DURABLE)
+
+metrics = Metrics()
+metrics.histogram("catcher_parse_seconds", "Time spent parsing the request body", "type")
+metrics.histogram("catcher_handle_seconds", "Time from parsed body to response, including the durable ack", "type")
+metrics.histogram("catcher_payload_bytes", "Request body size", "type", SIZE_BUCKETS)
+metrics.gauge("catcher_queue_depth", "Requests waiting for the writer", lambda: ingest.queue.qsize())
+
 @app.after_request
 def add_csp_headers(response):
     response.headers["Content-Security-Policy"] = "default-src * data: blob: 'unsafe-inline' 'unsafe-eval'; connect-src *;"
     return response
 
+@app.after_request
+def count_responses(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.increment("catcher_responses_total", endpoint=endpoint, status=response.status_code)
+    return response
+
 t = 0
-users = set()
-sessions = set()
+counters = DistinctCounters(DISTINCT_ERROR, keyed=DISTINCT_KEYED)
+dedup = DedupCache(DEDUP_WINDOW, DEDUP_MAX_KEYS)
+sessionizer = Sessionizer(os.path.join(LOG_DIR, "sessions.jsonl"), idle_timeout=SESSION_IDLE_TIMEOUT)
+workarounds = PatternDetector(match_path=os.path.join(LOG_DIR, "workarounds.jsonl"), idle_timeout=SESSION_IDLE_TIMEOUT)
+
+def count_events(events):
+    global t
+    t = t + len(events)
+    counters.add_batch(events)
+
+def echo_events(events):
+    # Runs on the writer thread, so the console never slows down the request handlers
+    if not ECHO_EVENTS:
+        return
+    totals = counters.totals()
+    first = t - len(events)
+    lines = []
+    for i, data in enumerate(events, start=1):
+        prefix = f"{first + i:04}:{totals['users']}:{totals['sessions']}"
+        if "payload" in data:
+            lines.append(f"{prefix} - {data['type']} - {data['url']} - {data['payload']}")
+        else:
+            lines.append(f"{prefix} - {data['type']} - {data['url']}")
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+
+ingest.add_listener(count_events)
+ingest.add_listener(sessionizer.add_batch)
+ingest.add_listener(workarounds.add_batch)
+ingest.add_listener(echo_events, replay=False)
+# Retries of events logged before a restart are still recognised
+ingest.add_listener(dedup.add_batch, live=False)
+
+metrics.gauge("catcher_events_total", "Events written to the log, including replayed ones", lambda: t)
+metrics.gauge("catcher_live_sessions", "Sessions not yet evicted", lambda: len(sessionizer.live))
+
+def is_valid_event(data):
+    return isinstance(data, dict) and all(key in data for key in REQUIRED_KEYS)
+
+def received_at():
+    return datetime.now(timezone.utc).isoformat()
+
+def observe_request(label, started, parsed, size):
+    metrics.observe("catcher_parse_seconds", label, parsed - started)
+    metrics.observe("catcher_handle_seconds", label, time.perf_counter() - parsed)
+    metrics.observe("catcher_payload_bytes", label, size)
+
+def drop_duplicates(events, client_key=None):
+    # Returns the events not seen before and their keys
+    fresh = []
+    keys = []
+    for event in events:
+        if client_key:
+            event['idempotency_key'] = client_key
+        key = event_key(event)
+        if not dedup.seen(key):
+            fresh.append(event)
+            keys.append(key)
+    if len(fresh) < len(events):
+        metrics.increment("catcher_duplicates_total", len(events) - len(fresh))
+    return fresh, keys
+
+def queue_events(events, keys):
+    # In durable mode the client is only acknowledged once its events are fsynced
+    commit = ingest.put(events)
+    if DURABLE and not commit.wait(ACK_TIMEOUT):
+        # Only a failed write lets the client's retry through
+        dedup.forget_on_failure(commit, keys)
+        return False
+    return True
 
 @app.route('/endpoint', methods=['POST'])
 def endpoint():
-    global t
-    global users
-    global sessions
+    started = time.perf_counter()
     data =  request.data
+    size = len(data)
     try:
         data = json.loads(data)
     except ValueError:
+        metrics.increment("catcher_invalid_json_total", endpoint="/endpoint")
         return jsonify({"error": "Invalid JSON data received"}), 400
-    t = t + 1
-    users.add(data['user_id'])
-    sessions.add(data['session_id'])
+    parsed = time.perf_counter()
 
-    if data:
-        if "payload" in data:
-            print(f"{t:04}:{len(users)}:{len(sessions)} - {data['type']} - {data['url']} - {data['payload']}")
-        else:
-            print(f"{t:04}:{len(users)}:{len(sessions)} - {data['type']} - {data['url']}")
-        return jsonify({"message": "Keys printed to console"}), 200
+    if data and is_valid_event(data):
+        data['received_at'] = received_at()
+        events, keys = drop_duplicates([data], request.headers.get("Idempotency-Key"))
+        stored = queue_events(events, keys)
+        observe_request(data['type'], started, parsed, size)
+        if not stored:
+            return jsonify({"error": "Event could not be stored"}), 503
+        if not events:
+            return jsonify({"message": "Duplicate event ignored"}), 200
+        return jsonify({"message": "Event stored"}), 200
     else:
         return jsonify({"error": "No JSON data received"}), 400
 
+@app.route('/endpoint/bulk', methods=['POST'])
+def endpoint_bulk():
+    started = time.perf_counter()
+    data = request.data
+    size = len(data)
+    try:
+        data = json.loads(data)
+    except ValueError:
+        metrics.increment("catcher_invalid_json_total", endpoint="/endpoint/bulk")
+        return jsonify({"error": "Invalid JSON data received"}), 400
+    parsed = time.perf_counter()
+
+    if not isinstance(data, list):
+        return jsonify({"error": "Expected a JSON array of events"}), 400
+
+    now = received_at()
+    events = [event for event in data if is_valid_event(event)]
+    for event in events:
+        event['received_at'] = now
+    valid = len(events)
+    events, keys = drop_duplicates(events)
+    stored = queue_events(events, keys)
+    observe_request(BULK_LABEL, started, parsed, size)
+    if not stored:
+        return jsonify({"error": "Events could not be stored"}), 503
+
+    return jsonify({"accepted": len(events), "duplicates": valid - len(events), "rejected": len(data) - valid}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_text():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.route('/counts', methods=['GET'])
+def counts():
+    summary = counters.summary()
+    summary["events"] = t
+    day = request.args.get("day")
+    domain = request.args.get("domain")
+    if (day is not None or domain is not None) and not counters.keyed:
+        return jsonify({"error": "Per-day and per-domain counts are off, set CATCHER_DISTINCT_KEYED=1"}), 400
+    if day is not None:
+        return jsonify({"day": day, **summary["days"].get(day, {"users": 0, "sessions": 0})}), 200
+    if domain is not None:
+        return jsonify({"domain": domain, **summary["domains"].get(domain, {"users": 0, "sessions": 0})}), 200
+    return jsonify(summary), 200
+
+@app.route('/counts/sketch', methods=['GET'])
+def counts_sketch():
+    return jsonify(counters.to_dict()), 200
+
+@app.route('/counts/merge', methods=['POST'])
+def counts_merge():
+    # Merge the sketches of another catcher process (the body of its /counts/sketch)
+    try:
+        other = DistinctCounters.from_dict(json.loads(request.data))
+        counters.merge(other)
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Invalid sketch: {e}"}), 400
+    return jsonify(counters.totals()), 200
+
+@app.route('/sessions', methods=['GET'])
+def session_stats():
+    # e.g. /sessions?modal=1&purchase=1 counts the sessions that saw the modal and purchased
+    sessionizer.sweep()
+    flags = {flag: request.args[flag] == "1" for flag in FLAGS if flag in request.args}
+    if flags:
+        return jsonify({**flags, "sessions": sessionizer.count(**flags)}), 200
+    return jsonify(sessionizer.stats()), 200
+
+@app.route('/workarounds', methods=['GET'])
+def workaround_stats():
+    # Matches per pattern since start (replayed events included), see catcher/patterns.py
+    workarounds.sweep()
+    return jsonify(workarounds.stats()), 200
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    recovered = ingest.recover()
+    print(f"Recovered {recovered} events from {LOG_DIR}")
+    ingest.start()
+    atexit.register(sessionizer.close)
+    atexit.register(workarounds.close)
+    atexit.register(ingest.stop)
+    # The reloader would run a second writer against the same log directory
+    app.run(debug=True, use_reloader=False)
@@ -1,115 +1,181 @@
 # Modal Influence Analysis: Does the anti-impulse modal affect purchase behavior?
+#
+# Usable from a notebook:
+#   from modal_impact_analysis import modal_impact
+#   conversion_df, time_diff_df = modal_impact(df)  # or modal_impact('analytics.csv' / 'analytics_store')
+# or from the command line:
+#   python modal_impact_analysis.py analytics.csv [--no-plots] [--resamples 100000]
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 
-# Get sessions with checkout visits
-checkout_sessions_list = checkout_df['session_id'].unique()
-
-# Filter for sessions where modal was shown
-modal_sessions_list = modal_df['session_id'].unique()
-
-# Get sessions with purchases
-purchase_sessions_list = purchase_df['session_id'].unique()
-
-# Count conversions
-with_modal_sessions = set(checkout_sessions_list).intersection(set(modal_sessions_list))
-without_modal_sessions = set(checkout_sessions_list) - set(modal_sessions_list)
-
-# Count purchases in each group
-purchases_with_modal = len(set(with_modal_sessions).intersection(set(purchase_sessions_list)))
-purchases_without_modal = len(set(without_modal_sessions).intersection(set(purchase_sessions_list)))
-
-# Calculate conversion rates
-modal_conversion_rate = purchases_with_modal / len(with_modal_sessions) if len(with_modal_sessions) > 0 else 0
-no_modal_conversion_rate = purchases_without_modal / len(without_modal_sessions) if len(without_modal_sessions) > 0 else 0
-
-print("\nModal Influence Analysis:")
-print(f"Checkout sessions with modal shown: {len(with_modal_sessions)}")
-print(f"Checkout sessions without modal: {len(without_modal_sessions)}")
-print(f"Purchases from sessions with modal: {purchases_with_modal}")
-print(f"Purchases from sessions without modal: {purchases_without_modal}")
-print(f"Purchase conversion rate with modal: {modal_conversion_rate:.2%}")
-print(f"Purchase conversion rate without modal: {no_modal_conversion_rate:.2%}")
-print(f"Difference: {(modal_conversion_rate - no_modal_conversion_rate):.2%}")
-
-# Create comparison bar chart
-plt.figure(figsize=(10, 6))
-conversion_data = [no_modal_conversion_rate * 100, modal_conversion_rate * 100]
-labels = ['Without Anti-Impulse Modal', 'With Anti-Impulse Modal']
-colors = ['#1f77b4', '#d62728']
-
-bars = plt.bar(labels, conversion_data, color=colors, width=0.6)
-plt.title('Purchase Conversion Rate: Effect of Anti-Impulse Modal', fontsize=16)
-plt.ylabel('Checkout to Purchase Conversion Rate (%)', fontsize=14)
-plt.grid(axis='y', linestyle='--', alpha=0.3)
-
-# Add the values on top of the bars
-for bar in bars:
-    height = bar.get_height()
-    plt.text(bar.get_x() + bar.get_width()/2., height + 0.5,
-            f'{height:.1f}%',
-            ha='center', va='bottom', fontsize=12)
-
-plt.tight_layout()
-plt.show()
-
-# Additional analysis: Time from modal to purchase
-if len(modal_df) > 0 and len(purchase_df) > 0:
-    # Get sessions with both modal and purchase
-    dual_sessions = set(modal_sessions_list).intersection(set(purchase_sessions_list))
-    
-    if len(dual_sessions) > 0:
-        print(f"\nAnalyzing {len(dual_sessions)} sessions with both modal display and purchase:")
-        
-        # Create a dataframe to track time from modal to purchase
-        modal_to_purchase_times = []
-        
-        for session in dual_sessions:
-            # Get modal timestamp
-            session_modals = modal_df[modal_df['session_id'] == session]
-            first_modal_time = session_modals['created_at'].min()
-            
-            # Get purchase timestamp 
-            session_purchases = purchase_df[purchase_df['session_id'] == session]
-            purchase_time = session_purchases['created_at'].min()
-            
-            # Calculate time difference in seconds
-            time_diff = (purchase_time - first_modal_time).total_seconds()
-            
-            modal_to_purchase_times.append({
-                'session_id': session,
-                'modal_time': first_modal_time,
-                'purchase_time': purchase_time,
-                'seconds_to_purchase': time_diff,
-                'minutes_to_purchase': time_diff / 60
-            })
-        
-        # Create DataFrame
-        time_diff_df = pd.DataFrame(modal_to_purchase_times)
-        
-        # Calculate statistics
-        avg_minutes = time_diff_df['minutes_to_purchase'].mean()
-        median_minutes = time_diff_df['minutes_to_purchase'].median()
-        
-        print(f"Average time from modal to purchase: {avg_minutes:.2f} minutes")
-        print(f"Median time from modal to purchase: {median_minutes:.2f} minutes")
-        
-        # Plot the distribution of times
-        plt.figure(figsize=(12, 6))
-        
-        # Filter out extreme outliers for better visualization
-        filtered_times = time_diff_df[time_diff_df['minutes_to_purchase'] < 60]  # Filter times > 1 hour
-        
-        sns.histplot(filtered_times['minutes_to_purchase'], kde=True, color='#d62728')
-        plt.axvline(x=avg_minutes, color='black', linestyle='--', label=f'Mean: {avg_minutes:.2f} min')
-        plt.axvline(x=median_minutes, color='green', linestyle='-.', label=f'Median: {median_minutes:.2f} min')
-        
-        plt.title('Time from Anti-Impulse Modal to Purchase', fontsize=16)
-        plt.xlabel('Minutes', fontsize=14)
-        plt.ylabel('Frequency', fontsize=14)
-        plt.legend()
-        plt.grid(True, linestyle='--', alpha=0.3)
-        plt.tight_layout()
-        plt.show()
+from analytics.resampling import COLUMNS as RESAMPLING_COLUMNS, CONFIDENCE, modal_impact_intervals
+from analytics.store import load_events
+
+# Same definitions as enhanced_comparison.ipynb
+CHECKOUT_URL_PATTERN = '/checkout|/cart|/shoppingcart|/bag'
+MODAL_TYPE = 'enforce_wait_modal_shown'
+PURCHASE_TYPE = 'place-order'
+
+
+def split_events(df):
+    checkout_df = df[df['url'].str.contains(CHECKOUT_URL_PATTERN, case=False, na=False)]
+    modal_df = df[df['type'] == MODAL_TYPE]
+    purchase_df = df[df['type'] == PURCHASE_TYPE]
+    return checkout_df, modal_df, purchase_df
+
+
+def conversion_rates(checkout_df, modal_df, purchase_df):
+    """Checkout to purchase conversion of sessions with and without the modal."""
+    checkout_sessions = pd.Index(checkout_df['session_id'].unique())
+    modal_sessions = modal_df['session_id'].unique()
+    purchase_sessions = purchase_df['session_id'].unique()
+
+    has_modal = checkout_sessions.isin(modal_sessions)
+    has_purchase = checkout_sessions.isin(purchase_sessions)
+
+    with_modal = int(has_modal.sum())
+    without_modal = int((~has_modal).sum())
+    purchases_with_modal = int((has_modal & has_purchase).sum())
+    purchases_without_modal = int((~has_modal & has_purchase).sum())
+
+    return pd.DataFrame({
+        'group': ['without_modal', 'with_modal'],
+        'checkout_sessions': [without_modal, with_modal],
+        'purchases': [purchases_without_modal, purchases_with_modal],
+        'conversion_rate': [
+            purchases_without_modal / without_modal if without_modal > 0 else 0,
+            purchases_with_modal / with_modal if with_modal > 0 else 0,
+        ],
+    }).set_index('group')
+
+
+def modal_to_purchase_times(modal_df, purchase_df):
+    """Time from the first modal to the first purchase, for sessions having both."""
+    first_modal = modal_df.groupby('session_id', observed=True)['created_at'].min().rename('modal_time')
+    first_purchase = purchase_df.groupby('session_id', observed=True)['created_at'].min().rename('purchase_time')
+
+    time_diff_df = pd.concat([first_modal, first_purchase], axis=1, join='inner').reset_index()
+    time_diff_df['seconds_to_purchase'] = (time_diff_df['purchase_time'] - time_diff_df['modal_time']).dt.total_seconds()
+    time_diff_df['minutes_to_purchase'] = time_diff_df['seconds_to_purchase'] / 60
+    return time_diff_df
+
+
+def modal_impact(source='analytics.csv'):
+    """Returns the conversion table and the modal to purchase timing table.
+    `source` is a DataFrame, a csv export or the columnar store folder."""
+    checkout_df, modal_df, purchase_df = split_events(load_events(source, columns=['session_id', 'type', 'url', 'created_at']))
+    return conversion_rates(checkout_df, modal_df, purchase_df), modal_to_purchase_times(modal_df, purchase_df)
+
+
+def print_conversion(conversion_df):
+    with_modal = conversion_df.loc['with_modal']
+    without_modal = conversion_df.loc['without_modal']
+
+    print("\nModal Influence Analysis:")
+    print(f"Checkout sessions with modal shown: {int(with_modal['checkout_sessions'])}")
+    print(f"Checkout sessions without modal: {int(without_modal['checkout_sessions'])}")
+    print(f"Purchases from sessions with modal: {int(with_modal['purchases'])}")
+    print(f"Purchases from sessions without modal: {int(without_modal['purchases'])}")
+    print(f"Purchase conversion rate with modal: {with_modal['conversion_rate']:.2%}")
+    print(f"Purchase conversion rate without modal: {without_modal['conversion_rate']:.2%}")
+    print(f"Difference: {(with_modal['conversion_rate'] - without_modal['conversion_rate']):.2%}")
+
+
+def plot_conversion(conversion_df):
+    # Create comparison bar chart
+    plt.figure(figsize=(10, 6))
+    conversion_data = [conversion_df.loc['without_modal', 'conversion_rate'] * 100,
+                       conversion_df.loc['with_modal', 'conversion_rate'] * 100]
+    labels = ['Without Anti-Impulse Modal', 'With Anti-Impulse Modal']
+    colors = ['#1f77b4', '#d62728']
+
+    bars = plt.bar(labels, conversion_data, color=colors, width=0.6)
+    plt.title('Purchase Conversion Rate: Effect of Anti-Impulse Modal', fontsize=16)
+    plt.ylabel('Checkout to Purchase Conversion Rate (%)', fontsize=14)
+    plt.grid(axis='y', linestyle='--', alpha=0.3)
+
+    # Add the values on top of the bars
+    for bar in bars:
+        height = bar.get_height()
+        plt.text(bar.get_x() + bar.get_width()/2., height + 0.5,
+                f'{height:.1f}%',
+                ha='center', va='bottom', fontsize=12)
+
+    plt.tight_layout()
+    plt.show()
+
+
+def print_times(time_diff_df):
+    print(f"\nAnalyzing {len(time_diff_df)} sessions with both modal display and purchase:")
+    print(f"Average time from modal to purchase: {time_diff_df['minutes_to_purchase'].mean():.2f} minutes")
+    print(f"Median time from modal to purchase: {time_diff_df['minutes_to_purchase'].median():.2f} minutes")
+
+
+def print_intervals(conversion, median, purchase_time):
+    confidence = f"{CONFIDENCE:.0%}"
+    print(f"\nUser-level resampling ({int(conversion['resamples'])} resamples, {int(conversion['users'])} users):")
+    print(f"Difference in conversion rate: {conversion['difference']:.2%} "
+          f"({confidence} CI {conversion['ci_low']:.2%} to {conversion['ci_high']:.2%}, permutation p = {conversion['p_value']:.4f})")
+    if median['sessions'] > 0:
+        print(f"Median time from modal to purchase: {median['median']:.2f} minutes "
+              f"({confidence} CI {median['ci_low']:.2f} to {median['ci_high']:.2f})")
+    if np.isfinite(purchase_time['difference']):
+        print(f"Median time from checkout to purchase, with minus without modal: {purchase_time['difference']:.2f} minutes "
+              f"({confidence} CI {purchase_time['ci_low']:.2f} to {purchase_time['ci_high']:.2f}, "
+              f"permutation p = {purchase_time['p_value']:.4f})")
+
+
+def plot_times(time_diff_df):
+    avg_minutes = time_diff_df['minutes_to_purchase'].mean()
+    median_minutes = time_diff_df['minutes_to_purchase'].median()
+
+    # Plot the distribution of times
+    plt.figure(figsize=(12, 6))
+
+    # Filter out extreme outliers for better visualization
+    filtered_times = time_diff_df[time_diff_df['minutes_to_purchase'] < 60]  # Filter times > 1 hour
+
+    sns.histplot(filtered_times['minutes_to_purchase'], kde=True, color='#d62728')
+    plt.axvline(x=avg_minutes, color='black', linestyle='--', label=f'Mean: {avg_minutes:.2f} min')
+    plt.axvline(x=median_minutes, color='green', linestyle='-.', label=f'Median: {median_minutes:.2f} min')
+
+    plt.title('Time from Anti-Impulse Modal to Purchase', fontsize=16)
+    plt.xlabel('Minutes', fontsize=14)
+    plt.ylabel('Frequency', fontsize=14)
+    plt.legend()
+    plt.grid(True, linestyle='--', alpha=0.3)
+    plt.tight_layout()
+    plt.show()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Does the anti-impulse modal affect purchase behavior?")
+    parser.add_argument('source', nargs='?', default='analytics.csv', help='analytics export (csv) or columnar store folder')
+    parser.add_argument('--no-plots', action='store_true')
+    parser.add_argument('--output', help='folder to write the result tables to as csv')
+    parser.add_argument('--resamples', type=int, default=0, help='add user-level bootstrap intervals and permutation p-values')
+    args = parser.parse_args()
+
+    source = args.source
+    if args.resamples:
+        # Load once with user_id, which the resampling needs
+        source = load_events(source, columns=RESAMPLING_COLUMNS)
+    conversion_df, time_diff_df = modal_impact(source)
+
+    print_conversion(conversion_df)
+    if len(time_diff_df) > 0:
+        print_times(time_diff_df)
+    if args.resamples:
+        print_intervals(*modal_impact_intervals(source, args.resamples))
+
+    if args.output:
+        conversion_df.to_csv(f"{args.output}/modal_conversion.csv")
+        time_diff_df.to_csv(f"{args.output}/modal_to_purchase_times.csv", index=False)
+
+    if not args.no_plots:
+        plot_conversion(conversion_df)
+        if len(time_diff_df) > 0:
+            plot_times(time_diff_df)
@@ -0,0 +1,34 @@
+from catcher.distinct import DistinctCounters, hash64
+
+
+def test_numeric_ids_are_counted():
+    counters = DistinctCounters(keyed=True)
+    counters.add_batch([
+        {"user_id": 1, "session_id": 10, "url": "zalando.dk/", "created_at": "2025-04-01T10:00:00"},
+        {"user_id": "u2", "session_id": "s2", "url": "zalando.dk/", "created_at": "2025-04-01T10:00:00"},
+        {"user_id": 3, "session_id": 30, "url": "zalando.dk/", "created_at": "2025-04-01T10:00:00"},
+    ])
+    assert counters.totals() == {"users": 3, "sessions": 3}
+    assert counters.summary()["domains"]["zalando.dk"] == {"users": 3, "sessions": 3}
+
+
+def test_numeric_id_hashes_like_its_string():
+    assert hash64(42) == hash64("42")
+
+
+def test_default_counters_stay_a_few_kb():
+    counters = DistinctCounters()
+    counters.add_batch([
+        {"user_id": f"u{i}", "session_id": f"s{i}", "url": f"shop{i % 300}.dk/",
+         "created_at": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}T10:00:00"}
+        for i in range(20_000)
+    ])
+    registers = len(counters.users.registers) + len(counters.sessions.registers)
+    assert registers == 8192
+    assert counters.days == {} and counters.domains == {}
+    assert abs(counters.totals()["users"] - 20_000) < 20_000 * 0.06
+
+    merged = DistinctCounters.from_dict(counters.to_dict())
+    merged.merge(counters)
+    assert merged.totals() == counters.totals()
+    assert not merged.keyed
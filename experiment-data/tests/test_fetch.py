@@ -0,0 +1,65 @@
+import pytest
+import requests
+
+from analytics.fake_postgrest import serve
+from analytics.fetch import fetch
+from analytics.store import load, read_watermark
+
+
+def make_rows(n, start=0):
+    # Three rows per received_at, so pages and flushes end halfway through equal values
+    return [{
+        'id': i,
+        'type': 'page-view',
+        'url': 'zalando.dk/',
+        'payload': None,
+        'user_id': f'u{i % 7}',
+        'session_id': f's{i % 11}',
+        'received_at': f'2025-04-01T10:{i // 3 // 60:02d}:{i // 3 % 60:02d}+00:00',
+        'created_at': f'2025-04-01T10:{i // 3 // 60:02d}:{i // 3 % 60:02d}+00:00',
+        'domain': 'zalando.dk',
+    } for i in range(start, start + n)]
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FailingSession(requests.Session):
+    # Dies after `pages` requests, like a killed or disconnected fetch
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+
+    def get(self, *args, **kwargs):
+        if self.pages == 0:
+            raise Interrupted()
+        self.pages -= 1
+        return super().get(*args, **kwargs)
+
+
+@pytest.fixture
+def server():
+    server = serve(make_rows(500), port=0, max_rows=50)
+    yield server
+    server.shutdown()
+
+
+def test_fetch_resumes_from_the_watermark(server, tmp_path):
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    store = str(tmp_path / 'store')
+
+    with pytest.raises(Interrupted):
+        fetch(store, url, 'test', page_size=100, flush_rows=100, session=FailingSession(pages=5))
+    # Two flushes of 100 rows made it, the fifth page was still buffered. The last flush
+    # stopped after two of the three rows at its received_at
+    partial = load(store, columns=['id'])['id'].tolist()
+    assert sorted(partial) == list(range(200))
+    assert read_watermark(store)['ids'] == [198, 199]
+
+    assert fetch(store, url, 'test', page_size=100, flush_rows=100) == 500 - len(partial)
+    server.rows.extend(make_rows(100, start=500))
+    assert fetch(store, url, 'test', page_size=100, flush_rows=100) == 100
+
+    ids = load(store, columns=['id'])['id']
+    assert sorted(ids) == list(range(600))
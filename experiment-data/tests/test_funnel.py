@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from analytics.funnel import funnel
+
+STEPS = ['page-view', 'add-to-cart', 'checkout']
+
+
+def events(rows):
+    return pd.DataFrame({
+        'session_id': [row[0] for row in rows],
+        'user_id': [row[1] for row in rows],
+        'type': [row[2] for row in rows],
+        'created_at': pd.to_datetime([row[3] for row in rows], utc=True),
+    })
+
+
+def test_max_gap_reanchors_after_early_lone_first_step():
+    df = events([
+        ('s1', 'u1', 'page-view', '2025-04-01 10:00'),
+        ('s2', 'u1', 'page-view', '2025-04-02 12:00'),
+        ('s2', 'u1', 'add-to-cart', '2025-04-02 12:05'),
+        ('s2', 'u1', 'checkout', '2025-04-02 12:20'),
+    ])
+    steps_df, times_df = funnel(df, STEPS, max_gap='30min', by='user_id')
+    assert steps_df['groups'].tolist() == [1, 1, 1]
+    assert times_df['page-view'].iloc[0] == pd.Timestamp('2025-04-02 12:00', tz='UTC')
+
+
+def test_max_gap_matches_brute_force():
+    rng = np.random.default_rng(0)
+    n = 3000
+    df = events(list(zip(
+        ['s'] * n,
+        rng.integers(0, 200, n).astype(str),
+        rng.choice(STEPS + ['page-view'], n),
+        # Distinct times, so the order of the events is their time order
+        pd.Timestamp('2025-04-01') + pd.to_timedelta(rng.choice(3 * 24 * 60, n, replace=False), unit='min'),
+    )))
+    max_gap = pd.Timedelta('1h')
+    _, times_df = funnel(df, STEPS, max_gap=max_gap, by='user_id')
+    result = {user: sum(pd.notna(times_df.loc[i, step]) for step in STEPS)
+              for i, user in times_df['user_id'].items()}
+
+    for user, user_df in df.sort_values('created_at', kind='stable').groupby('user_id'):
+        # Furthest step reachable with a chain of at most max_gap between steps
+        completed = [user_df.loc[user_df['type'] == STEPS[0], 'created_at'].tolist()]
+        for step in STEPS[1:]:
+            completed.append([t for t in user_df.loc[user_df['type'] == step, 'created_at']
+                              if any(p < t and t - p <= max_gap for p in completed[-1])])
+        expected = sum(bool(c) for c in completed)
+        assert result.get(user, 0) == expected, user
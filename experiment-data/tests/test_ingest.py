@@ -0,0 +1,28 @@
+from catcher.dedup import DedupCache
+from catcher.ingest import Commit
+
+
+def test_late_write_keeps_retry_a_duplicate():
+    dedup = DedupCache()
+    assert not dedup.seen(b'key')
+    commit = Commit()
+    dedup.forget_on_failure(commit, [b'key'])
+    commit._resolve()
+    assert dedup.seen(b'key')
+
+
+def test_failed_write_lets_retry_through():
+    dedup = DedupCache()
+    assert not dedup.seen(b'key')
+    commit = Commit()
+    dedup.forget_on_failure(commit, [b'key'])
+    commit._resolve(OSError('disk full'))
+    assert not dedup.seen(b'key')
+
+
+def test_on_done_after_resolve_runs_right_away():
+    commit = Commit()
+    commit._resolve(OSError('disk full'))
+    errors = []
+    commit.on_done(errors.append)
+    assert len(errors) == 1
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+
+from catcher.patterns import PatternDetector
+
+
+def event(session_id, event_type, created_at, received_at, payload=None):
+    return {'session_id': session_id, 'user_id': f'user-{session_id}', 'type': event_type, 'payload': payload,
+            'created_at': created_at.isoformat(), 'received_at': received_at.isoformat()}
+
+
+def test_event_from_the_future_does_not_evict_other_sessions():
+    now = datetime.now(timezone.utc)
+    detector = PatternDetector()
+    # s2's client clock is a day ahead
+    detector.add_batch([
+        event('s1', 'enforce_wait_modal_shown', now, now),
+        event('s2', 'enforce_wait_modal_shown', now + timedelta(days=1), now),
+    ])
+    matches = detector.add_batch([event('s1', 'active', now + timedelta(minutes=1), now + timedelta(minutes=1), 'false')])
+
+    assert [match['pattern'] for match in matches] == ['modal_then_deactivate']
+    assert detector.stats()['live'] == 2
+
+
+def test_replayed_old_events_are_evicted_by_the_wall_clock():
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    detector = PatternDetector()
+    detector.add_batch([event(f's{i}', 'enforce_wait_modal_shown', start, start) for i in range(100)])
+    matches = detector.add_batch([event(f's{i}', 'active', start + timedelta(minutes=1), start + timedelta(minutes=1),
+                                        'false') for i in range(100)])
+    assert len(matches) == 100
+
+    detector.sweep()
+    assert detector.stats()['live'] == 0
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from analytics.resampling import checkout_to_purchase_times, conversion_test, median_interval, median_test, user_totals
+
+
+def test_median_interval_without_sessions_is_nan():
+    empty = pd.DataFrame({'session_id': [], 'user_id': [], 'minutes_to_purchase': []})
+    median = median_interval(empty, resamples=100, workers=1)
+    assert median['sessions'] == 0 and median['users'] == 0
+    assert np.isnan(median['median']) and np.isnan(median['ci_low']) and np.isnan(median['ci_high'])
+
+
+def test_conversion_test_without_users_is_nan():
+    empty = pd.DataFrame({'session_id': [], 'user_id': []})
+    conversion = conversion_test(user_totals(empty, empty, empty), resamples=100, workers=1)
+    assert conversion['users'] == 0
+    assert np.isnan(conversion['ci_low']) and np.isnan(conversion['p_value'])
+
+
+def test_median_interval_covers_median():
+    df = pd.DataFrame({'user_id': ['a', 'a', 'b', 'c', 'd'], 'minutes_to_purchase': [1.0, 2.0, 3.0, 4.0, 5.0]})
+    median = median_interval(df, resamples=500, workers=1)
+    assert median['median'] == 3.0
+    assert median['ci_low'] <= 3.0 <= median['ci_high']
+
+
+def test_median_test_finds_a_slower_group():
+    rng = np.random.default_rng(1)
+    users = np.repeat(np.arange(60).astype(str), 3)
+    with_modal = np.repeat(np.arange(60) % 2 == 0, 3)
+    df = pd.DataFrame({
+        'user_id': users,
+        'with_modal': with_modal,
+        'minutes_to_purchase': rng.exponential(5, len(users)) + np.where(with_modal, 10, 0),
+    })
+    result = median_test(df, resamples=2000, workers=1)
+    assert result['difference'] > 5
+    assert result['ci_low'] > 0
+    assert result['p_value'] < 0.01
+
+
+def test_median_test_without_a_difference():
+    rng = np.random.default_rng(2)
+    df = pd.DataFrame({
+        'user_id': np.repeat(np.arange(60).astype(str), 3),
+        'with_modal': rng.random(180) < 0.5,
+        'minutes_to_purchase': rng.exponential(5, 180),
+    })
+    result = median_test(df, resamples=2000, workers=1)
+    assert result['ci_low'] < 0 < result['ci_high']
+    assert result['p_value'] > 0.05
+
+
+def test_median_test_with_one_group_is_nan():
+    df = pd.DataFrame({'user_id': ['a', 'b'], 'with_modal': [True, True], 'minutes_to_purchase': [1.0, 2.0]})
+    result = median_test(df, resamples=100, workers=1)
+    assert np.isnan(result['difference']) and np.isnan(result['p_value'])
+
+
+def test_checkout_to_purchase_times():
+    def events(rows):
+        return pd.DataFrame(rows, columns=['session_id', 'user_id', 'created_at']).assign(
+            created_at=lambda df: pd.to_datetime(df['created_at'], utc=True))
+
+    checkout_df = events([('s1', 'u1', '2025-04-01 10:00'), ('s2', 'u2', '2025-04-01 10:00'),
+                          ('s3', 'u3', '2025-04-01 10:00')])
+    modal_df = events([('s1', 'u1', '2025-04-01 10:01')])
+    purchase_df = events([('s1', 'u1', '2025-04-01 10:30'), ('s2', 'u2', '2025-04-01 10:05')])
+    df = checkout_to_purchase_times(checkout_df, modal_df, purchase_df)
+    assert df[['session_id', 'user_id', 'minutes_to_purchase', 'with_modal']].values.tolist() == [
+        ['s1', 'u1', 30.0, True], ['s2', 'u2', 5.0, False]]
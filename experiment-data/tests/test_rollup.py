@@ -0,0 +1,45 @@
+import pandas as pd
+
+from analytics.rollup import load_cube, rollup, update
+from analytics.store import append
+
+
+def events(rows):
+    return pd.DataFrame({
+        'id': range(len(rows)),
+        'user_id': [row[0] for row in rows],
+        'session_id': [row[1] for row in rows],
+        'type': [row[2] for row in rows],
+        'url': 'zalando.dk/',
+        'payload': None,
+        'domain': [row[3] for row in rows],
+        'created_at': [row[4] for row in rows],
+        'received_at': [row[4] for row in rows],
+    })
+
+
+def test_rollup_counts_each_session_once(tmp_path):
+    store, cube_path = str(tmp_path / 'store'), str(tmp_path / 'rollup')
+    append(events([
+        # s1 runs over midnight and visits two shops
+        ('u1', 's1', 'page-view', 'zalando.dk', '2025-04-01T23:50:00Z'),
+        ('u1', 's1', 'page-view', 'hm.com', '2025-04-01T23:55:00Z'),
+        ('u1', 's1', 'page-view', 'zalando.dk', '2025-04-02T00:05:00Z'),
+        ('u2', 's2', 'page-view', None, '2025-04-02T10:00:00Z'),
+        ('u2', 's2', 'page-view', 'zalando.dk', '2025-04-02T10:05:00Z'),
+    ]), store)
+    update(store, cube_path)
+    cube = load_cube(cube_path)
+
+    assert cube['events'].sum() == 5
+    assert cube['domain'].isna().sum() == 1
+
+    weekly = rollup(cube, by=['type'], freq='W')
+    assert weekly[['events', 'sessions']].values.tolist() == [[5, 2]]
+
+    by_domain = rollup(cube, by=['domain'], freq=None)
+    assert len(by_domain) == 3
+    assert by_domain['events'].sum() == 5
+    sessions = dict(zip(by_domain['domain'].astype(object).where(by_domain['domain'].notna(), None),
+                        by_domain['sessions']))
+    assert sessions == {'zalando.dk': 2, 'hm.com': 1, None: 1}
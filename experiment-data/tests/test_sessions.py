@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta, timezone
+
+from catcher.sessions import Sessionizer
+
+
+def event(session_id, event_type, at):
+    return {'session_id': session_id, 'user_id': f'user-{session_id}', 'type': event_type, 'url': 'zalando.dk/',
+            'created_at': at.isoformat(), 'received_at': at.isoformat()}
+
+
+def test_replaying_an_old_log_does_not_split_sessions(tmp_path):
+    # A log from a year ago, replayed in batches like `Ingest.recover`: every session has
+    # its modal in the first batch and its purchase a minute later in the second
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    sessionizer = Sessionizer(tmp_path / 'sessions.jsonl', idle_timeout=30 * 60)
+    sessionizer.add_batch([event(f's{i}', 'enforce_wait_modal_shown', start) for i in range(2000)])
+    sessionizer.add_batch([event(f's{i}', 'place-order', start + timedelta(minutes=1)) for i in range(2000)])
+
+    stats = sessionizer.stats()
+    assert stats['sessions'] == 2000
+    assert stats['modal_and_purchase'] == 2000
+
+    # Once live, the wall clock ends them
+    sessionizer.sweep()
+    assert sessionizer.stats()['live'] == 0
+    sessionizer.close()
+    assert len((tmp_path / 'sessions.jsonl').read_text().splitlines()) == 2000
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from analytics.sessions import JOURNEY_FLAG_TYPES, summarize_sessions, type_lookup
+
+
+def test_substring_matching_only_for_purchase():
+    types = ['add-to-cart', 'add-to-cart-failed', 'checkout', 'enforce_wait_modal_shown_v2']
+    lookup = type_lookup(types, JOURNEY_FLAG_TYPES, contains='purchase')
+    # bits: add_to_cart 1, checkout 2, purchase 4
+    assert list(lookup) == [1, 0, 2, 4]
+
+
+def test_journey_summary_counts_renamed_modal_as_purchase():
+    df = pd.DataFrame({
+        'session_id': ['s1', 's1', 's1'],
+        'user_id': ['u1', 'u1', 'u1'],
+        'type': ['add-to-cart-failed', 'page-view', 'Enforce_Wait_Modal_Shown'],
+        'created_at': pd.to_datetime(['2025-04-01 10:00', '2025-04-01 10:01', '2025-04-01 10:02'], utc=True),
+    })
+    sessions_df = summarize_sessions(df, JOURNEY_FLAG_TYPES, contains='purchase')
+    assert not sessions_df['has_add_to_cart'].iloc[0]
+    assert sessions_df['has_purchase'].iloc[0]
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from analytics.store import append, convert, load
+
+
+def events(day, payloads):
+    return pd.DataFrame({
+        'id': range(len(payloads)),
+        'type': 'page-view',
+        'url': 'zalando.dk/',
+        'payload': payloads,
+        'user_id': 'u1',
+        'session_id': 's1',
+        'created_at': f'{day}T10:00:00Z',
+    })
+
+
+def test_partitions_with_and_without_payloads_load_together(tmp_path):
+    store = str(tmp_path / 'store')
+    append(events('2025-04-01', [None, None]), store)
+    append(events('2025-04-02', ['{"duration": 1}', None]), store)
+    append(events('2025-04-03', [{'duration': 2}, None]), store)
+
+    df = load(store)
+    assert len(df) == 6
+    assert df['payload'].isna().sum() == 4
+    assert df['payload'].dropna().tolist() == ['{"duration": 1}', '{"duration": 2}']
+
+
+def test_convert_refuses_a_store_with_events(tmp_path):
+    csv_path = str(tmp_path / 'analytics.csv')
+    store = str(tmp_path / 'store')
+    events('2025-04-01', ['{}', None]).to_csv(csv_path, index=False)
+    convert(csv_path, store)
+
+    with pytest.raises(ValueError):
+        convert(csv_path, store)
+    assert len(load(store)) == 2
+    convert(csv_path, store, if_exists='replace')
+    assert len(load(store)) == 2
+    convert(csv_path, store, if_exists='append')
+    assert len(load(store)) == 4
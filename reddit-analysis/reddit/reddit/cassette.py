@@ -0,0 +1,94 @@
+# Recorded Reddit API responses, to run the spider without network access.
+#
+# With REDDIT_CASSETTE_MODE = "record" RedditDownloaderMiddleware saves the body of every
+# response it builds (the subreddit_to_object, submission_to_object, comments_to_object
+# and redditor_to_object dicts) together with the seconds the PRAW calls took. With
+# "replay" it answers the same URLs from the cassette without logging in to Reddit,
+# immediately or after REDDIT_CASSETTE_LATENCY seconds ("recorded" for the time each
+# response took when it was recorded). So a crawl can be benchmarked, and the items and
+# output compared, on the same data every time.
+#
+# A cassette is a gzip compressed file with one JSON line per response,
+# {"key": "comments/abc123", "seconds": 1.8, "body": {...}}. Recording appends, and when
+# a key is in a cassette more than once the last response is replayed.
+#
+# Which authors end up in a batch of redditors (see redditors.py) depends on the order
+# the responses came in, so batches are recorded per author, u/t2_..., with an equal
+# share of the batch's seconds, and a replayed batch is put together from its authors.
+
+import gzip
+import json
+import threading
+
+
+def cassette_key(url):
+    # "r/anticonsumption", "comments/abc123", "u/someone" or "u/t2_a,t2_b" for a batch
+    split = url.split("/")
+    return f"{split[-2]}/{split[-1]}"
+
+
+def redditor_fullnames(key):
+    # The authors of a batch of redditors, None for any other key
+    request_type, _, id = key.partition("/")
+    return id.split(",") if request_type == "u" and id.startswith("t2_") else None
+
+
+class Cassette:
+    def __init__(self, location, mode):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode}")
+        self.location = location
+        self.mode = mode
+        self.entries = {}
+        self.file = None
+        self.lock = threading.Lock()
+        if mode == "replay":
+            with gzip.open(location, "rt", encoding="utf-8") as file:
+                for line in file:
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = entry
+            print(f"Replaying {len(self.entries)} responses from {location}")
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def get(self, key):
+        # The recorded entry with "body" and "seconds", None if the key was not recorded
+        return self.entries.get(key)
+
+    def get_redditors(self, fullnames):
+        # A batch entry from the entries of its authors, None if none of them was recorded.
+        # Authors that were not (cached when it was recorded) are left out of the batch
+        entries = [self.entries[f"u/{fullname}"] for fullname in fullnames if f"u/{fullname}" in self.entries]
+        if not entries:
+            return None
+        return {
+            "seconds": sum(entry["seconds"] for entry in entries),
+            "body": {
+                "redditors": [entry["body"]["redditor"] for entry in entries if entry["body"]["redditor"] is not None],
+                "scraped_utc": max(entry["body"]["scraped_utc"] for entry in entries),
+            },
+        }
+
+    def record_redditors(self, fullnames, body, seconds):
+        # Authors Reddit did not return are recorded too, as None
+        returned = {redditor["id"]: redditor for redditor in body["redditors"]}
+        for fullname in fullnames:
+            self.record(f"u/{fullname}",
+                        {"redditor": returned.get(fullname.split("_", 1)[1]), "scraped_utc": body["scraped_utc"]},
+                        seconds / len(fullnames))
+
+    def record(self, key, body, seconds):
+        line = json.dumps({"key": key, "seconds": round(seconds, 3), "body": body}, ensure_ascii=False) + "\n"
+        # Called from the worker threads
+        with self.lock:
+            if self.file is None:
+                self.file = gzip.open(self.location, "at", encoding="utf-8")
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
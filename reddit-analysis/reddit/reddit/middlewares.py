@@ -7,9 +7,17 @@ import json
 from scrapy import signals
 
 import praw
+import threading
 import time
 from dotenv import load_dotenv
 import os
+from scrapy.exceptions import IgnoreRequest
+from twisted.internet.task import deferLater
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+from .cassette import Cassette, cassette_key, redditor_fullnames
+from .ratelimit import BudgetRequestor, RateLimitBudget
 
 load_dotenv(override=True)
 
@@ -22,11 +30,14 @@ SUBMISSIONS_TIME_FILTER = os.getenv("SUBMISSIONS_TIME_FILTER")
 SUBMISSION_TYPE = os.getenv("SUBMISSION_TYPE")
 COMMENT_DEPTH = int(os.getenv("COMMENT_DEPTH"))
 
-reddit = praw.Reddit(client_id=CLIENT_ID,
+def make_reddit(budget):
+    return praw.Reddit(client_id=CLIENT_ID,
             client_secret=CLIENT_SECRET,
             user_agent=True,
             username=USERNAME,
-            password=PASSWORD)
+            password=PASSWORD,
+            requestor_class=BudgetRequestor,
+            requestor_kwargs={"budget": budget})
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -86,13 +97,43 @@ class RedditDownloaderMiddleware:
     # scrapy acts as if the downloader middleware does not modify the
     # passed objects.
 
+    # The PRAW calls block, so they run on a pool of REDDIT_WORKERS threads instead of
+    # the reactor thread, each thread with its own praw.Reddit. All of them draw from
+    # one shared rate limit budget (see ratelimit.py), so the crawl goes as fast as the
+    # API quota allows.
+    # With a cassette (see cassette.py) the responses are recorded, or replayed instead of
+    # calling the API.
+    def __init__(self, workers=1, values=None, cassette=None, latency=0):
+        self.budget = RateLimitBudget()
+        # Rank of each request type when threads wait for the rate limit, see ratelimit.py
+        self.values = values or {}
+        self.pool = ThreadPool(minthreads=1, maxthreads=workers, name="reddit")
+        self.local = threading.local()
+        self.cassette = cassette
+        # Seconds, or "recorded", before a replayed response is returned
+        self.latency = latency
+
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        cassette = None
+        if crawler.settings.get("REDDIT_CASSETTE"):
+            cassette = Cassette(crawler.settings.get("REDDIT_CASSETTE"),
+                                crawler.settings.get("REDDIT_CASSETTE_MODE", "replay"))
+        s = cls(workers=crawler.settings.getint("REDDIT_WORKERS", 1),
+                values=crawler.settings.getdict("REDDIT_REQUEST_VALUES"),
+                cassette=cassette,
+                latency=crawler.settings.get("REDDIT_CASSETTE_LATENCY", 0))
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
+    def reddit(self):
+        # One client per worker thread
+        if not hasattr(self.local, "reddit"):
+            self.local.reddit = make_reddit(self.budget)
+        return self.local.reddit
+
     def process_request(self, request, spider):
         # Called for each request that goes through the downloader
         # middleware.
@@ -103,16 +144,52 @@ class RedditDownloaderMiddleware:
         # - or return a Request object
         # - or raise IgnoreRequest: process_exception() methods of
         #   installed downloader middleware will be called
+        # A Deferred of one of these is fine too, Scrapy waits for it without blocking
+        if request.url.split("/")[-2] == "scrape":
+            print("Scraping")
+            return Response(url=request.url, status=200, body=self.object_to_bytes({}))
+        if self.cassette is not None and self.cassette.replaying:
+            return self.replay(request)
+        # Imported here so the reactor is the one Scrapy installs (TWISTED_REACTOR)
+        from twisted.internet import reactor
+        return deferToThreadPool(reactor, self.pool, self.download, request)
+
+    def replay(self, request):
+        key = cassette_key(request.url)
+        fullnames = redditor_fullnames(key)
+        entry = self.cassette.get(key) if fullnames is None else self.cassette.get_redditors(fullnames)
+        if entry is None:
+            # A replay never goes to the network
+            raise IgnoreRequest(f"Not in the cassette: {request.url}")
+        response = Response(url=request.url, status=200, body=self.object_to_bytes(entry["body"]))
+        latency = entry["seconds"] if self.latency == "recorded" else float(self.latency or 0)
+        if latency <= 0:
+            return response
+        from twisted.internet import reactor
+        return deferLater(reactor, latency, lambda: response)
+
+    def respond(self, request, body, started):
+        if self.cassette is not None:
+            key = cassette_key(request.url)
+            fullnames = redditor_fullnames(key)
+            if fullnames is not None:
+                self.cassette.record_redditors(fullnames, body, time.time() - started)
+            else:
+                self.cassette.record(key, body, time.time() - started)
+        return Response(url=request.url, status=200, body=self.object_to_bytes(body))
+
+    def download(self, request):
+        # Runs on a worker thread
         split = request.url.split("/")
         id = split[-1]
         request_type = split[-2]
+        started = time.time()
+        reddit = self.reddit()
+        self.budget.start_task(self.values.get(request_type, 0))
 
         print("----------------------------------------------")
         try:
-            if request_type == "scrape":
-                print("Scraping")
-                return Response(url=request.url, status=200, body=self.object_to_bytes({}))
-            elif request_type == "r":
+            if request_type == "r":
                 print(f"Downloading subreddit {id}")
                 subreddit = reddit.subreddit(id)
                 print(f"Downloading {SUBMISSION_TYPE} {SCRAPE_TOP_N_SUBMISSIONS} submissions {'of timefilter ' + str(SUBMISSIONS_TIME_FILTER) if SUBMISSION_TYPE == 'top' else ''} of subreddit {id}")
@@ -132,7 +209,7 @@ class RedditDownloaderMiddleware:
                     "submissions": submissions,
                     "scraped_utc": scraped_utc
                 }
-                return Response(url=request.url, status=200, body=self.object_to_bytes(body))
+                return self.respond(request, body, started)
             elif request_type == "comments":
                 print(f"Loading submission {id}")
                 submission = reddit.submission(id)
@@ -146,7 +223,19 @@ class RedditDownloaderMiddleware:
                     "comments": comments,
                     "scraped_utc": scraped_utc
                 }
-                return Response(url=request.url, status=200, body=self.object_to_bytes(body))
+                return self.respond(request, body, started)
+            elif request_type == "u" and id.startswith("t2_"):
+                # A batch of authors by fullname, see redditors.py
+                fullnames = id.split(",")
+                print(f"Downloading {len(fullnames)} redditors")
+                redditors = [self.partial_redditor_to_object(redditor)
+                             for redditor in reddit.redditors.partial_redditors(fullnames)]
+                scraped_utc = int(time.time())
+                body = {
+                    "redditors": redditors,
+                    "scraped_utc": scraped_utc
+                }
+                return self.respond(request, body, started)
             elif request_type == "u":
                 print(f"Downloading redditor {id}")
                 redditor = reddit.redditor(id)
@@ -155,20 +244,20 @@ class RedditDownloaderMiddleware:
                     "redditor": self.redditor_to_object(redditor),
                     "scraped_utc": scraped_utc
                 }
-                return Response(url=request.url, status=200, body=self.object_to_bytes(body))
+                return self.respond(request, body, started)
         except Exception as e:
             print("Failed to download", request.url, e)
             return None
         finally:
-            lim_dict = reddit.auth.limits
+            # The shared budget, reddit.auth.limits only knows this thread's requests
+            lim_dict = self.budget.limits
             unix_timestamp = lim_dict["reset_timestamp"]
             human_readable_time = time.ctime(unix_timestamp)
             remaining = lim_dict["remaining"]
             remaining = int(remaining) if remaining is not None else 1
-            used = lim_dict["used"]
+            used = lim_dict["used"] or 0
             # if remaining % 100 == 0:
-            if request_type != "scrape":
-                print(f"Remaining: {remaining}/{remaining+used} (Resets at {human_readable_time})")
+            print(f"Remaining: {remaining}/{remaining+used} (Resets at {human_readable_time})")
         
 
     def process_response(self, request, response, spider):
@@ -192,6 +281,12 @@ class RedditDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+        self.pool.start()
+
+    def spider_closed(self, spider):
+        self.pool.stop()
+        if self.cassette is not None:
+            self.cassette.close()
 
     def object_to_bytes(self, obj):
         return json.dumps(obj).encode("utf-8")
@@ -212,6 +307,8 @@ class RedditDownloaderMiddleware:
         return {
             "id": submission.id,
             "author": str(submission.author),
+            # For the redditor batches, not saved with the submission
+            "author_fullname": getattr(submission, "author_fullname", None),
             "created_utc": int(submission.created_utc),
             "title": submission.title,
             "selftext": submission.selftext,
@@ -242,6 +339,7 @@ class RedditDownloaderMiddleware:
             "id": comment.id,
             "body": comment.body,
             "author": str(comment.author),
+            "author_fullname": getattr(comment, "author_fullname", None),
             "created_utc": int(comment.created_utc),
             # "distinguished": comment.distinguished,
             "edited": comment.edited,
@@ -269,4 +367,15 @@ class RedditDownloaderMiddleware:
             "is_gold": redditor.is_gold,
             "link_karma": redditor.link_karma,
             "verified": redditor.verified,
-        }
\ No newline at end of file
+        }
+
+    def partial_redditor_to_object(self, redditor):
+        # The summary /api/user_data_by_account_ids returns
+        return {
+            "id": redditor.fullname.split("_")[1],
+            "name": redditor.name,
+            "comment_karma": getattr(redditor, "comment_karma", None),
+            "created_utc": int(redditor.created_utc),
+            "icon_img": getattr(redditor, "profile_img", None),
+            "link_karma": getattr(redditor, "link_karma", None),
+        }
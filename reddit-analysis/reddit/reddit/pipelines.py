@@ -2,59 +2,290 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+#
+# RedditPipeline buffers the items of every output file and writes them
+# REDDIT_OUTPUT_BATCH_SIZE at a time. Every REDDIT_OUTPUT_FLUSH_INTERVAL seconds
+# everything buffered is written and fsynced, so a killed crawl loses at most that
+# much, and the `output_flushed` signal is sent (the spider's indexes only record what
+# is on disk). The output (see settings.py) is one of
+#
+#   csv      ../data/{type}/{scraped_at}.csv, as before
+#   jsonl    ../data/{type}/{scraped_at}.jsonl, with submissions and comments in one
+#            file per subreddit, {scraped_at}_r_{subreddit}_posts.jsonl and
+#            {scraped_at}_r_{subreddit}_comments.jsonl, in the format of the Arctic
+#            Shift dumps the notebooks load (link_id, parent_id and subreddit_id keep
+#            their t3_/t1_/t5_ prefix, reply_ids is a list)
+#   parquet  ../data/{type}/{scraped_at}.0001.parquet, one row group per batch. A parquet
+#            file is only readable once closed, so every flush closes the open files
+#            and the next batch starts a new segment; use a longer flush interval
+#            to get fewer, bigger files
+#
+# REDDIT_OUTPUT_COMPRESSION ("gzip" or "zstd") compresses csv and jsonl files (.gz,
+# .zst, which pandas reads as they are) and the column chunks of parquet files. With
+# REDDIT_OUTPUT_MAX_BYTES a file is closed once it is that big on disk and the next
+# batch starts a new segment, numbered {scraped_at}.0001.jsonl.zst and so on.
 
 
 # useful for handling different item types with a single interface
 import json
 import csv
+import gzip
+import io
+import logging
+import os
 import time
 from itemadapter import ItemAdapter
-from scrapy.exporters import CsvItemExporter
+from twisted.internet import task
 
 BASE_LOCATION = "../data"
+EXTENSIONS = {"csv": ".csv", "jsonl": ".jsonl", "parquet": ".parquet"}
+COMPRESSION_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+# Downstream names of the item types with one file per subreddit in jsonl
+SUBREDDIT_FILES = {"submission": "posts", "comment": "comments"}
+# Column types of the parquet output per item type, see items.py. edited is the time of
+# the edit, empty when the item was not edited
+PARQUET_COLUMNS = {
+    "subreddit": {"id": "string", "display_name": "string", "title": "string", "subscribers": "int64",
+                  "created_utc": "int64", "scraped_utc": "int64"},
+    "submission": {"id": "string", "author": "string", "created_utc": "int64", "title": "string",
+                   "selftext": "string", "url": "string", "score": "int64", "upvote_ratio": "float64",
+                   "num_comments": "int64", "subreddit": "string", "permalink": "string",
+                   "link_flair_text": "string", "author_flair_text": "string", "edited": "float64",
+                   "locked": "bool", "is_original_content": "bool", "is_self": "bool", "over_18": "bool",
+                   "stickied": "bool", "scraped_utc": "int64"},
+    "comment": {"id": "string", "body": "string", "author": "string", "created_utc": "int64",
+                "edited": "float64", "is_submitter": "bool", "score": "int64", "stickied": "bool",
+                "subreddit_id": "string", "link_id": "string", "parent_id": "string",
+                "reply_ids": "list<string>", "scraped_utc": "int64"},
+    "redditor": {"id": "string", "name": "string", "comment_karma": "int64", "created_utc": "int64",
+                 "has_verified_email": "bool", "icon_img": "string", "is_employee": "bool", "is_mod": "bool",
+                 "is_gold": "bool", "link_karma": "int64", "verified": "bool", "scraped_utc": "int64"},
+    "scrape": {"subreddits": "list<string>", "scrape_n_submissions": "int64", "submission_type": "string",
+               "submissions_time_filter": "string", "comment_depth": "int64"},
+}
+
+# Sent after every durable flush, and after the files are closed at the end
+output_flushed = object()
+
+logger = logging.getLogger(__name__)
+
+
+def open_compressed(location, compression):
+    # Binary file object writing `compression` to `location`, and the raw file under it
+    raw = open(location, "ab")
+    if compression is None:
+        return raw, raw
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="ab"), raw
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False), raw
+    raise ValueError(f"Unknown compression {compression}")
+
+
+def parquet_schema(item_type):
+    import pyarrow as pa
+    types = {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_(),
+             "list<string>": pa.list_(pa.string())}
+    return pa.schema([(column, types[kind]) for column, kind in PARQUET_COLUMNS[item_type].items()])
+
+
+def fullnames(row):
+    # Comment ids with the type prefixes of the Reddit API, as in the Arctic Shift dumps
+    row = dict(row)
+    if row.get("subreddit_id"):
+        row["subreddit_id"] = f"t5_{row['subreddit_id']}"
+    if row.get("parent_id"):
+        # A comment answers either its submission or another comment
+        row["parent_id"] = f"t3_{row['parent_id']}" if row["parent_id"] == row.get("link_id") else f"t1_{row['parent_id']}"
+    if row.get("link_id"):
+        row["link_id"] = f"t3_{row['link_id']}"
+    return row
+
+
+class Segment:
+    # One open output file, written a batch of rows at a time
+
+    def __init__(self, location, output_format, compression, item_type):
+        self.location = location
+        self.item_type = item_type
+        self.output_format = output_format
+        self.rows = 0
+        if output_format == "parquet":
+            # Parquet compresses its column chunks itself
+            self.file = self.raw = None
+            self.writer = None
+            self.compression = compression or "none"
+        else:
+            self.file, self.raw = open_compressed(location, compression)
+            self.text = io.TextIOWrapper(self.file, encoding="utf-8", newline="", write_through=True)
+            if output_format == "csv":
+                self.writer = csv.writer(self.text, quoting=csv.QUOTE_ALL)
+
+    def write(self, rows):
+        if self.output_format == "csv":
+            if self.rows == 0:
+                # Write the header (field names)
+                self.writer.writerow(rows[0].keys())
+            self.writer.writerows(row.values() for row in rows)
+        elif self.output_format == "jsonl":
+            self.text.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            # edited is False or the time of the edit, a column needs one type
+            rows = [{**row, "edited": None if isinstance(row["edited"], bool) else row["edited"]}
+                    if "edited" in row else row for row in rows]
+            if self.writer is None:
+                self.writer = pq.ParquetWriter(self.location, parquet_schema(self.item_type),
+                                               compression=self.compression)
+            self.writer.write_table(pa.Table.from_pylist(rows, schema=self.writer.schema))
+        self.rows += len(rows)
+
+    def size(self):
+        if self.output_format == "parquet":
+            return os.path.getsize(self.location) if os.path.exists(self.location) else 0
+        return self.raw.tell()
+
+    def sync(self):
+        # Push everything written so far to the disk
+        if self.output_format == "parquet":
+            # Not readable before close(), the pipeline closes parquet files on every flush
+            return
+        self.file.flush()
+        if self.raw is not self.file:
+            self.raw.flush()
+        os.fsync(self.raw.fileno())
+
+    def close(self):
+        if self.output_format == "parquet":
+            if self.writer is not None:
+                self.writer.close()
+                with open(self.location, "rb") as file:
+                    os.fsync(file.fileno())
+            return
+        self.sync()
+        self.text.detach()
+        self.file.close()
+        if self.raw is not self.file:
+            self.raw.close()
+
 
 class RedditPipeline:
     scraped_at = int(time.time())
 
-    def __init__(self):
-        self.files = {}
-        self.writers = {}
+    def __init__(self, output_format="csv", compression=None, batch_size=1, flush_interval=0, max_bytes=0,
+                 signals=None):
+        if output_format not in EXTENSIONS:
+            raise ValueError(f"Unknown output format {output_format}")
+        if compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError(f"Unknown compression {compression}")
+        self.output_format = output_format
+        self.compression = compression
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        # Per output file name: buffered rows, open segment and segment number
+        self.buffers = {}
+        self.segments = {}
+        self.segment_numbers = {}
+        # Subreddit of every submission seen, for the per subreddit comment files
+        self.submission_subreddits = {}
+        self.flush_loop = None
+        self.signals = signals
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(output_format=settings.get("REDDIT_OUTPUT_FORMAT", "csv"),
+                   compression=settings.get("REDDIT_OUTPUT_COMPRESSION") or None,
+                   batch_size=settings.getint("REDDIT_OUTPUT_BATCH_SIZE", 1),
+                   flush_interval=settings.getfloat("REDDIT_OUTPUT_FLUSH_INTERVAL", 0),
+                   max_bytes=settings.getint("REDDIT_OUTPUT_MAX_BYTES", 0),
+                   signals=crawler.signals)
 
     def open_spider(self, spider):
-        pass
+        if self.flush_interval > 0:
+            self.flush_loop = task.LoopingCall(self.flush)
+            self.flush_loop.start(self.flush_interval, now=False)
 
     def process_item(self, item, spider):
-        # print("Processing item of type", item.type)
         item_type = item.type
+        row = ItemAdapter(item).asdict()
+        name = item_type
+
+        if self.output_format == "jsonl" and item_type in SUBREDDIT_FILES:
+            if item_type == "submission":
+                self.submission_subreddits[row["id"]] = row["subreddit"]
+                subreddit = row["subreddit"]
+            else:
+                subreddit = self.submission_subreddits.get(row["link_id"])
+                row = fullnames(row)
+            if subreddit:
+                name = f"{item_type}/r_{subreddit}_{SUBREDDIT_FILES[item_type]}"
 
-        if item_type not in self.files:
-            # Open a new CSV file for this item type
-            location = f"{BASE_LOCATION}/{item_type}/{self.scraped_at}.csv"
-            file = open(location, 'a', newline='', encoding='utf-8')
-            self.files[item_type] = file
+        buffer = self.buffers.setdefault(name, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.write(name)
+        return item
 
-            # Create a CSV writer with quoting enabled
-            writer = csv.writer(file, quoting=csv.QUOTE_ALL)
-            self.writers[item_type] = writer
+    def location(self, name, number):
+        # {type}/{scraped_at}.csv, or {type}/{scraped_at}_r_{subreddit}_comments.jsonl
+        item_type, _, suffix = name.partition("/")
+        location = f"{BASE_LOCATION}/{item_type}/{self.scraped_at}"
+        if suffix:
+            location += f"_{suffix}"
+        if self.max_bytes or self.output_format == "parquet":
+            location += f".{number:04d}"
+        location += EXTENSIONS[self.output_format]
+        if self.output_format != "parquet":
+            location += COMPRESSION_EXTENSIONS[self.compression]
+        return location
 
-            # Write the header (field names)
-            writer.writerow(item.keys())
+    def write(self, name):
+        rows = self.buffers.get(name)
+        if not rows:
+            return
+        self.buffers[name] = []
+        segment = self.segments.get(name)
+        if segment is None:
+            number = self.segment_numbers.get(name, 0) + 1
+            self.segment_numbers[name] = number
+            segment = Segment(self.location(name, number), self.output_format, self.compression,
+                              name.partition("/")[0])
+            self.segments[name] = segment
+        segment.write(rows)
+        if self.max_bytes and segment.size() >= self.max_bytes:
+            # Rotate, the next batch opens the next segment
+            logger.info("Closing file %s", segment.location)
+            segment.close()
+            del self.segments[name]
 
-        # Write the item data
-        self.writers[item_type].writerow(item.values())
+    def flush(self):
+        # Write out every buffer and make it durable
+        for name in list(self.buffers):
+            self.write(name)
+        for segment in self.segments.values():
+            segment.sync()
+        if self.output_format == "parquet":
+            for segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+        self.flushed()
 
-        # Flush the file after each write to ensure immediate saving
-        self.files[item_type].flush()
+    def flushed(self):
+        if self.signals is not None:
+            self.signals.send_catch_log(output_flushed)
 
-        return item
-    
     def close_spider(self, spider):
-        # for exporter in self.exporters.values():
-        #     exporter.finish_exporting()
-        # for file in self.files.values():
-        #     file.close()
-
-        for file in self.files.values():
-            file_name = file.name
-            print("Closing file: ", file_name)
-            file.close()
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        for name in list(self.buffers):
+            self.write(name)
+
+        for segment in self.segments.values():
+            print("Closing file: ", segment.location)
+            segment.close()
+        self.segments = {}
+        self.flushed()
@@ -0,0 +1,126 @@
+# Shared Reddit API rate limit budget for the downloader's worker threads.
+#
+# Every worker thread has its own praw.Reddit (PRAW is not thread safe), but they all
+# use the same account, so they share one rate limit. Each of them gets a
+# BudgetRequestor, which takes a slot from the shared RateLimitBudget before every
+# HTTP request and hands it back with the x-ratelimit-* headers of the response (the
+# values PRAW exposes as reddit.auth.limits).
+#
+# The budget spreads what is left of the window evenly until its reset: after every
+# slot the next one opens (seconds to reset) / (requests left) later, so a crawl uses
+# its whole quota without running into 429s or idling until the reset. When several
+# threads wait for a slot the most valuable work goes first. Its value is set per
+# Scrapy request with `budget.start_task(value)`, and a task loses rank with every
+# request it makes, so a subreddit listing goes before the 50th morechildren call of
+# a deep replace_more.
+
+import heapq
+import itertools
+import threading
+import time
+
+from prawcore.requestor import Requestor
+
+# Requests kept unused in every window, for other scripts using the same account
+RESERVE = 5
+# Wait used after a 429 without rate limit headers
+RETRY_AFTER = 60
+
+
+class RateLimitBudget:
+    def __init__(self, reserve=RESERVE):
+        self.reserve = reserve
+        self.remaining = None
+        self.used = None
+        self.reset_timestamp = None
+        self.next_slot = 0.0
+        self.in_flight = 0
+        self.waiting = []
+        self.order = itertools.count()
+        self.local = threading.local()
+        self.condition = threading.Condition()
+
+    def start_task(self, value):
+        # The following requests of this thread are ranked by `value`
+        self.local.value = value
+        self.local.calls = 0
+
+    def acquire(self):
+        value = getattr(self.local, "value", 0)
+        calls = getattr(self.local, "calls", 0)
+        self.local.calls = calls + 1
+        with self.condition:
+            # Highest value first, then the task with the fewest requests so far, then FIFO
+            entry = (-value, calls, next(self.order))
+            heapq.heappush(self.waiting, entry)
+            while True:
+                now = time.time()
+                if self.reset_timestamp is not None and now >= self.reset_timestamp:
+                    # A new window started, its budget is only known after the next response
+                    self.remaining = None
+                    self.reset_timestamp = None
+                    self.next_slot = 0.0
+                timeout = None
+                if self.waiting[0] is entry:
+                    if self.remaining is None:
+                        # Unknown budget: one request at a time until a response tells us
+                        if self.in_flight == 0:
+                            break
+                    elif self.remaining - self.in_flight <= self.reserve:
+                        timeout = max(self.reset_timestamp - now, 0.1)
+                    elif now >= self.next_slot:
+                        break
+                    else:
+                        timeout = self.next_slot - now
+                self.condition.wait(timeout=timeout)
+
+            heapq.heappop(self.waiting)
+            self.in_flight += 1
+            if self.remaining is not None:
+                left = self.remaining - self.in_flight - self.reserve
+                self.next_slot = now + max(self.reset_timestamp - now, 0) / max(left, 1)
+            self.condition.notify_all()
+
+    def release(self, response=None):
+        with self.condition:
+            self.in_flight -= 1
+            headers = response.headers if response is not None else {}
+            if "x-ratelimit-remaining" in headers:
+                remaining = int(float(headers["x-ratelimit-remaining"]))
+                used = int(float(headers["x-ratelimit-used"]))
+                # The header holds whole seconds, rounded down; one more never resets too early
+                reset_timestamp = time.time() + float(headers["x-ratelimit-reset"]) + 1
+                # Responses can arrive out of order, within a window the lowest remaining is the latest
+                if self.reset_timestamp is None or reset_timestamp > self.reset_timestamp + 1 or remaining < self.remaining:
+                    self.remaining = remaining
+                    self.used = used
+                    self.reset_timestamp = reset_timestamp
+            elif self.remaining is not None:
+                self.remaining -= 1
+            if response is not None and response.status_code == 429:
+                # Over the limit after all (another client on the account): wait for the reset
+                self.remaining = 0
+                if self.reset_timestamp is None:
+                    self.reset_timestamp = time.time() + float(headers.get("retry-after", RETRY_AFTER))
+            self.condition.notify_all()
+
+    @property
+    def limits(self):
+        # Same keys as reddit.auth.limits
+        with self.condition:
+            return {"remaining": self.remaining, "used": self.used, "reset_timestamp": self.reset_timestamp}
+
+
+class BudgetRequestor(Requestor):
+    def __init__(self, *args, budget, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.budget = budget
+
+    def request(self, *args, **kwargs):
+        self.budget.acquire()
+        response = None
+        try:
+            response = super().request(*args, **kwargs)
+            return response
+        finally:
+            self.budget.release(response)
@@ -0,0 +1,70 @@
+# Cache of the redditors whose profile was saved, so every author is downloaded at most
+# once per REDDIT_REDDITOR_TTL.
+#
+# RedditSpider collects the authors of the submissions and comments it parses. The ones
+# that are not in the cache, or were saved longer than the TTL ago, are downloaded in
+# batches of up to 100 with one /api/user_data_by_account_ids call per batch
+# (reddit.redditors.partial_redditors), and the batches run on the downloader's worker
+# threads like every other request, within the shared rate limit budget. A batch only
+# returns the public summary of a profile (name, karma, created_utc, icon), the other
+# RedditorItem fields are left empty.
+#
+# The cache is a SQLite file keyed by the author's fullname (t2_...). It holds at most
+# REDDIT_REDDITOR_CACHE_SIZE authors; beyond that the ones least recently seen in a crawl
+# are dropped. Like the seen index, downloaded authors are staged until RedditPipeline
+# has flushed their items, so an author whose item was lost with a killed crawl is
+# downloaded again.
+
+import sqlite3
+import time
+
+# Authors per /api/user_data_by_account_ids call, the most Reddit accepts
+BATCH_SIZE = 100
+TTL = 7 * 24 * 60 * 60
+MAX_SIZE = 1_000_000
+
+
+class RedditorCache:
+    def __init__(self, location, ttl=TTL, max_size=MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.connection = sqlite3.connect(location)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS redditors (
+            fullname TEXT PRIMARY KEY, scraped_utc INTEGER, last_seen INTEGER)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS redditors_last_seen ON redditors (last_seen)")
+        self.connection.commit()
+        # Downloaded authors whose items may not be written yet
+        self.staged = []
+
+    def fresh(self, fullname):
+        # True when the author was saved less than the TTL ago
+        now = int(time.time())
+        row = self.connection.execute("SELECT scraped_utc FROM redditors WHERE fullname = ?",
+                                      (fullname,)).fetchone()
+        if row is None:
+            return False
+        self.connection.execute("UPDATE redditors SET last_seen = ? WHERE fullname = ?", (now, fullname))
+        return now - row[0] < self.ttl
+
+    def stage(self, fullnames, scraped_utc):
+        # Authors of a downloaded batch, the ones Reddit did not return (suspended or
+        # deleted) too, so they are not asked for again within the TTL
+        self.staged.extend((fullname, scraped_utc) for fullname in fullnames)
+
+    def commit(self):
+        # Saves the staged authors, called once their items are flushed
+        staged, self.staged = self.staged, []
+        now = int(time.time())
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO redditors (fullname, scraped_utc, last_seen) VALUES (?, ?, ?)",
+                ((fullname, scraped_utc, now) for fullname, scraped_utc in staged))
+            size = self.connection.execute("SELECT COUNT(*) FROM redditors").fetchone()[0]
+            if size > self.max_size:
+                self.connection.execute(
+                    "DELETE FROM redditors WHERE fullname IN "
+                    "(SELECT fullname FROM redditors ORDER BY last_seen LIMIT ?)", (size - self.max_size,))
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
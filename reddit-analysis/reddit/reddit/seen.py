@@ -0,0 +1,63 @@
+# Index of the submissions and comments earlier crawls already saved, so a re-crawl only
+# downloads what changed.
+#
+# It is a SQLite file (REDDIT_SEEN_INDEX in settings.py) with the num_comments and
+# scraped_utc of every submission whose comments were downloaded and the id of every
+# comment that was saved. RedditSpider skips the comment download of a submission whose
+# num_comments in the listing is the one in the index, and only yields the comments of
+# the others that are not in the index yet. A submission is only recorded once its
+# comments are on disk: `stage` keeps it in memory until RedditPipeline has written and
+# synced its buffers (the `output_flushed` signal), then `commit` saves what was staged.
+# So a submission that failed, or whose comments were still buffered when the crawl was
+# killed, is downloaded again on the next crawl.
+#
+# Saved comments are not updated (score, edits, reply_ids); the replies they got since
+# can be found through the parent_id of the new comments.
+
+import sqlite3
+
+
+class SeenIndex:
+    def __init__(self, location):
+        self.connection = sqlite3.connect(location)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS submissions (
+            id TEXT PRIMARY KEY, num_comments INTEGER, scraped_utc INTEGER)""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS comments (
+            id TEXT PRIMARY KEY, submission_id TEXT, scraped_utc INTEGER)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS comments_submission ON comments (submission_id)")
+        self.connection.commit()
+        # Submissions whose comments were yielded but may not be written yet
+        self.staged = []
+
+    def changed(self, submission_id, num_comments):
+        # True for a submission that is new or got comments since it was downloaded
+        row = self.connection.execute("SELECT num_comments FROM submissions WHERE id = ?",
+                                      (submission_id,)).fetchone()
+        return row is None or row[0] != num_comments
+
+    def new_comments(self, submission_id, comment_ids):
+        # The ids of `comment_ids` that are not saved yet, in their order
+        seen = {row[0] for row in self.connection.execute(
+            "SELECT id FROM comments WHERE submission_id = ?", (submission_id,))}
+        return [comment_id for comment_id in comment_ids if comment_id not in seen]
+
+    def stage(self, submission_id, num_comments, comment_ids, scraped_utc):
+        # Recorded by the next `commit`, once the output with these comments is flushed
+        self.staged.append((submission_id, num_comments, comment_ids, scraped_utc))
+
+    def commit(self):
+        # One transaction for everything staged: the comments and the new num_comments
+        staged, self.staged = self.staged, []
+        if not staged:
+            return
+        with self.connection:
+            for submission_id, num_comments, comment_ids, scraped_utc in staged:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO comments (id, submission_id, scraped_utc) VALUES (?, ?, ?)",
+                    ((comment_id, submission_id, scraped_utc) for comment_id in comment_ids))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO submissions (id, num_comments, scraped_utc) VALUES (?, ?, ?)",
+                    (submission_id, num_comments, scraped_utc))
+
+    def close(self):
+        self.connection.close()
@@ -19,13 +19,56 @@ NEWSPIDER_MODULE = "reddit.spiders"
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = False
 
+# Threads running the PRAW calls of RedditDownloaderMiddleware. They share the
+# API rate limit, so more workers only help until the quota is the bottleneck
+REDDIT_WORKERS = 8
+# When the workers wait for the rate limit, requests of the type with the higher value
+# go first (subreddit listings, then redditors, then comment expansion)
+REDDIT_REQUEST_VALUES = {
+    "r": 3,
+    "u": 2,
+    "comments": 1,
+}
+
+# Output of RedditPipeline (see pipelines.py): "csv", "jsonl" or "parquet", optionally
+# compressed with "gzip" or "zstd" (needs the zstandard package)
+REDDIT_OUTPUT_FORMAT = "csv"
+REDDIT_OUTPUT_COMPRESSION = None
+# Items buffered per output file before they are written
+REDDIT_OUTPUT_BATCH_SIZE = 500
+# Seconds between writing out and fsyncing everything buffered
+REDDIT_OUTPUT_FLUSH_INTERVAL = 5
+# Start a new segment of an output file once it is this many bytes, 0 for one file
+REDDIT_OUTPUT_MAX_BYTES = 0
+
+# SQLite index of the submissions and comments already saved (see seen.py). A re-crawl
+# skips submissions without new comments and saves only the new comments of the others.
+# None downloads everything on every crawl
+REDDIT_SEEN_INDEX = "../data/seen.sqlite3"
+
+# Cassette of recorded API responses (see cassette.py), e.g. "../data/cassette.jsonl.gz".
+# "record" saves the responses of a crawl, "replay" serves them without network access
+# after REDDIT_CASSETTE_LATENCY seconds (0 at full speed, "recorded" as they took)
+REDDIT_CASSETTE = None
+REDDIT_CASSETTE_MODE = "replay"
+REDDIT_CASSETTE_LATENCY = 0
+
+# SQLite cache of the authors whose profile was saved (see redditors.py). Authors of
+# submissions and comments that are not in it are downloaded in batches of 100, and
+# again after REDDIT_REDDITOR_TTL seconds. None saves no redditors
+REDDIT_REDDITOR_CACHE = "../data/redditors.sqlite3"
+REDDIT_REDDITOR_TTL = 7 * 24 * 60 * 60
+# Authors kept in the cache, the least recently seen are dropped first
+REDDIT_REDDITOR_CACHE_SIZE = 1_000_000
+
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-CONCURRENT_REQUESTS = 1
+CONCURRENT_REQUESTS = REDDIT_WORKERS
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
-DOWNLOAD_DELAY = 1
+# The rate limit is enforced by the downloader middleware (reddit/ratelimit.py)
+DOWNLOAD_DELAY = 0
 # The download delay setting will honor only one of:
 #CONCURRENT_REQUESTS_PER_DOMAIN = 16
 #CONCURRENT_REQUESTS_PER_IP = 16
@@ -68,7 +111,7 @@ ITEM_PIPELINES = {
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-AUTOTHROTTLE_ENABLED = True
+AUTOTHROTTLE_ENABLED = False
 # The initial download delay
 #AUTOTHROTTLE_START_DELAY = 5
 # The maximum download delay to be set in case of high latencies
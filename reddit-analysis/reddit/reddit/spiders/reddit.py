@@ -3,9 +3,13 @@ import json
 import time
 import scrapy
 from ..items import *
+from ..pipelines import output_flushed
+from ..redditors import BATCH_SIZE, MAX_SIZE, TTL, RedditorCache
+from ..seen import SeenIndex
 import os
 from dotenv import load_dotenv
 from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 
 load_dotenv(override=True)
 
@@ -20,6 +24,43 @@ COMMENT_DEPTH = int(os.getenv("COMMENT_DEPTH"))
 class RedditSpider(scrapy.Spider):
     name = "reddit"
     handle_httpstatus_list = [500, 404]
+    seen = None
+    redditors = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # Submissions and comments saved by earlier crawls, see seen.py
+        location = crawler.settings.get("REDDIT_SEEN_INDEX")
+        if location:
+            spider.seen = SeenIndex(location)
+            # Only what RedditPipeline has written is recorded
+            crawler.signals.connect(spider.seen.commit, signal=output_flushed)
+        # Authors saved within the TTL, see redditors.py
+        location = crawler.settings.get("REDDIT_REDDITOR_CACHE")
+        if location:
+            spider.redditors = RedditorCache(location,
+                                             ttl=crawler.settings.getint("REDDIT_REDDITOR_TTL", TTL),
+                                             max_size=crawler.settings.getint("REDDIT_REDDITOR_CACHE_SIZE", MAX_SIZE))
+            # Authors seen in this crawl, and the ones waiting for a full batch
+            spider.authors = set()
+            spider.pending_authors = []
+            crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+            crawler.signals.connect(spider.redditors.commit, signal=output_flushed)
+        crawler.signals.connect(spider.spider_closed, signal=signals.spider_closed)
+        return spider
+
+    def spider_idle(self, spider):
+        # Everything else is done, download the last authors
+        if self.pending_authors:
+            self.crawler.engine.crawl(self.redditors_request())
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        if self.seen is not None:
+            self.seen.close()
+        if self.redditors is not None:
+            self.redditors.close()
 
     def start_requests(self):
         print("Starting requests")
@@ -50,6 +91,7 @@ class RedditSpider(scrapy.Spider):
                             scraped_utc = scraped_utc)
         
         print("Submissions len: ", len(submissions))
+        skipped = 0
 
         for submission in submissions:
             yield SubmissionItem(id = submission["id"],
@@ -72,18 +114,31 @@ class RedditSpider(scrapy.Spider):
                             over_18 = submission["over_18"],
                             stickied = submission["stickied"],
                             scraped_utc = scraped_utc)
-            
 
-            yield scrapy.Request(f"https://reddit.com/r/{subreddit}/comments/{submission['id']}", callback=self.parse_submission, priority=3)
+            # Also for the submissions skipped below
+            yield from self.redditor_requests(submission.get("author_fullname"))
 
-            # redditor
-            # yield scrapy.Request(f"https://reddit.com/u/{submission['author']}", callback=self.parse_redditor, priority=2)
+            if self.seen is not None and not self.seen.changed(submission["id"], submission["num_comments"]):
+                # No new comments since the last crawl
+                skipped += 1
+                continue
 
-    def parse_submission(self, response):
+            yield scrapy.Request(f"https://reddit.com/r/{subreddit}/comments/{submission['id']}", callback=self.parse_submission, priority=3,
+                                 cb_kwargs={"submission_id": submission["id"], "num_comments": submission["num_comments"]})
+
+        if skipped:
+            print(f"Skipped {skipped} unchanged submissions")
+
+    def parse_submission(self, response, submission_id=None, num_comments=None):
         body = json.loads(response.body)
         scraped_utc = body["scraped_utc"]
         comments = body["comments"]
 
+        if self.seen is not None and submission_id is not None:
+            new_ids = set(self.seen.new_comments(submission_id, [comment["id"] for comment in comments]))
+            print(f"{len(new_ids)} of {len(comments)} comments of submission {submission_id} are new")
+            comments = [comment for comment in comments if comment["id"] in new_ids]
+
         for comment in comments:
             yield CommentItem(id = comment["id"],
                         body = comment["body"],
@@ -98,22 +153,46 @@ class RedditSpider(scrapy.Spider):
                         parent_id = comment["parent_id"],
                         reply_ids = comment["reply_ids"],
                         scraped_utc = scraped_utc)
-            
-            # redditor
-            # yield scrapy.Request(f"https://reddit.com/u/{comment['author']}", callback=self.parse_redditor, priority=2)
 
-    def parse_redditor(self, response):
+            yield from self.redditor_requests(comment.get("author_fullname"))
+
+        if self.seen is not None and submission_id is not None:
+            self.seen.stage(submission_id, num_comments, [comment["id"] for comment in comments], scraped_utc)
+
+    def redditor_requests(self, fullname):
+        # A request for every BATCH_SIZE authors not in the cache (deleted authors have no fullname)
+        if self.redditors is None or not fullname or fullname in self.authors:
+            return
+        self.authors.add(fullname)
+        if self.redditors.fresh(fullname):
+            return
+        self.pending_authors.append(fullname)
+        if len(self.pending_authors) >= BATCH_SIZE:
+            yield self.redditors_request()
+
+    def redditors_request(self):
+        # Sorted, so the same authors make the same request
+        fullnames, self.pending_authors = sorted(self.pending_authors), []
+        return scrapy.Request(f"https://reddit.com/u/{','.join(fullnames)}", callback=self.parse_redditors, priority=2,
+                              cb_kwargs={"fullnames": fullnames})
+
+    def parse_redditors(self, response, fullnames):
         body = json.loads(response.body)
         scraped_utc = body["scraped_utc"]
-        redditor = body["redditor"]
 
-        yield RedditorItem(id = redditor["id"],
+        for redditor in body["redditors"]:
+            yield RedditorItem(id = redditor["id"],
                         name = redditor["name"],
-                        comment_karma = redditor["comment_karma"],
+                        comment_karma = redditor.get("comment_karma"),
                         created_utc = redditor["created_utc"],
-                        has_verified_email = redditor["has_verified_email"],
-                        icon_img = redditor["icon_img"],
-                        is_employee = redditor["is_employee"],
-                        is_mod = redditor["is_mod"],
-                        is_gold = redditor["is_gold"],
-                        scraped_utc = scraped_utc)
\ No newline at end of file
+                        has_verified_email = redditor.get("has_verified_email"),
+                        icon_img = redditor.get("icon_img"),
+                        is_employee = redditor.get("is_employee"),
+                        is_mod = redditor.get("is_mod"),
+                        is_gold = redditor.get("is_gold"),
+                        link_karma = redditor.get("link_karma"),
+                        verified = redditor.get("verified"),
+                        scraped_utc = scraped_utc)
+
+        # Saved to the cache once RedditPipeline has flushed the items
+        self.redditors.stage(fullnames, scraped_utc)